@@ -1,63 +1,34 @@
 import os
+import multiprocessing
+import queue
+import random
 import metrics
 from metrics import timeit
+from checkpoint import CheckpointWriter
+from actor_cache import ActorCache
 from shield import Shield
-
-################ Replay Buffer for DDPG ######################
-from collections import deque
-import random
+from Environment import Environment, FastEnvironment, VectorEnvironment
+from rollout import rollout, LinearController
+from replay_buffer import ReplayBuffer, SharedReplayBuffer, \
+        PrioritizedReplayBuffer
 
 import tensorflow as tf
 import tflearn
 import numpy as np
 
 
-class ReplayBuffer(object):
-
-    def __init__(self, buffer_size, random_seed=123):
-        """
-        The right side of the deque contains the most recent experiences
-        """
-        self.buffer_size = buffer_size
-        self.count = 0
-        self.buffer = deque()
-        # RANDOM
-        #random.seed(random_seed)
-
-    def add(self, s, a, r, t, s2):
-        experience = (s, a, r, t, s2)
-        if self.count < self.buffer_size:
-            self.buffer.append(experience)
-            self.count += 1
-        else:
-            self.buffer.popleft()
-            self.buffer.append(experience)
-
-    def size(self):
-        return self.count
-
-    def sample_batch(self, batch_size):
-        batch = []
-
-        if self.count < batch_size:
-            batch = random.sample(self.buffer, self.count)
-        else:
-            batch = random.sample(self.buffer, batch_size)
-
-        s_batch = np.array([_[0] for _ in batch])
-        a_batch = np.array([_[1] for _ in batch])
-        r_batch = np.array([_[2] for _ in batch])
-        t_batch = np.array([_[3] for _ in batch])
-        s2_batch = np.array([_[4] for _ in batch])
-
-        return s_batch, a_batch, r_batch, t_batch, s2_batch
-
-    def clear(self):
-        self.buffer.clear()
-        self.count = 0
-
-
 ################ DDPG Algorithm ######################
+def apply_gradients(optimizer, grads_and_vars):
+    """
+    Apply gradients with optimizer once all of them have been computed.
+    Variables are updated in place, so otherwise the update of a layer could
+    be seen by the gradient of an earlier layer, which reads the weights of
+    the later layers while backpropagating.
+    """
+    grads_and_vars = [(g, v) for (g, v) in grads_and_vars if g is not None]
+    with tf.control_dependencies([g for (g, _) in grads_and_vars]):
+        return optimizer.apply_gradients(grads_and_vars)
+
 class ActorNetwork(object):
 
     def __init__(self, sess, actor_structure,state_dim, action_dim,
@@ -72,17 +43,28 @@ class ActorNetwork(object):
         self.batch_size = batch_size
 
         # Actor Network
-        self.inputs, self.out, self.scaled_out = self.create_actor_network()
+        self.inputs, self.out, self.scaled_out, self.layers = \
+                self.create_actor_network()
 
         self.network_params = tf.trainable_variables()
 
         # Target Network
-        self.target_inputs, self.target_out, self.target_scaled_out = \
-                self.create_actor_network()
+        self.target_inputs, self.target_out, self.target_scaled_out, \
+                self.target_layers = self.create_actor_network()
 
         self.target_network_params = tf.trainable_variables()[
             len(self.network_params):]
 
+        # Variables of the actor network in the order NumpyActor uses them,
+        # including the batch normalization statistics
+        self.layer_params = []
+        for fc, bn in zip(self.layers[0:-1:2], self.layers[1:-1:2]):
+            with tf.variable_scope(bn.scope, reuse=True):
+                self.layer_params.extend([fc.W, fc.b,
+                    tf.get_variable('moving_mean'),
+                    tf.get_variable('moving_variance'), bn.beta, bn.gamma])
+        self.layer_params.extend([self.layers[-1].W, self.layers[-1].b])
+
         # Op for periodically updating target network with online network
         # weights
         self.update_target_network_params = \
@@ -101,8 +83,23 @@ class ActorNetwork(object):
             self.unnormalized_actor_gradients))
 
         # Optimization Op
-        self.optimize = tf.train.AdamOptimizer(self.learning_rate).\
-            apply_gradients(zip(self.actor_gradients, self.network_params))
+        self.optimizer = tf.train.AdamOptimizer(self.learning_rate)
+        self.optimize = apply_gradients(self.optimizer,
+            zip(self.actor_gradients, self.network_params))
+
+        # The weights after an update, fetched together with the update so
+        # that the numpy copy of the actor is refreshed without another
+        # session call
+        with tf.control_dependencies([self.optimize]):
+            self.updated_layer_params = [tf.identity(param)
+                    for param in self.layer_params]
+
+        # Batches of at most this many states are evaluated by a numpy copy
+        # of the actor, which is much faster than a session call for them
+        self.numpy_batch_size = 32
+        self.numpy_actor = None
+        # Incremented whenever the weights change, see ActorCache
+        self.weights_version = 0
 
         self.num_trainable_vars = len(
             self.network_params) + len(self.target_network_params)
@@ -110,26 +107,36 @@ class ActorNetwork(object):
     def create_actor_network(self):
         inputs = tflearn.input_data(shape=[None, self.s_dim])
         net = inputs
+        layers = []
         for layer_nueral_number in self.actor_structure:
             net = tflearn.fully_connected(net, layer_nueral_number)
+            layers.append(net)
             net = tflearn.layers.normalization.batch_normalization(net)
+            layers.append(net)
             net = tflearn.activations.relu(net)
 
         # Final layer weights are init to Uniform[-3e-3, 3e-3]
         w_init = tflearn.initializations.uniform(minval=-0.003, maxval=0.003)
         out = tflearn.fully_connected(
             net, self.a_dim, activation='tanh', weights_init=w_init)
+        layers.append(out)
         # Scale output to -action_bound to action_bound
         scaled_out = tf.multiply(out, self.action_bound)
-        return inputs, out, scaled_out
+        return inputs, out, scaled_out, layers
 
     def train(self, inputs, a_gradient):
-        self.sess.run(self.optimize, feed_dict={
+        _, weights = self.sess.run(
+                [self.optimize, self.updated_layer_params], feed_dict={
             self.inputs: inputs,
             self.action_gradient: a_gradient
         })
+        self.set_numpy_weights(weights)
 
     def predict(self, inputs):
+        if np.shape(inputs)[0] <= self.numpy_batch_size:
+            if self.numpy_actor is None:
+                self.set_numpy_weights(self.get_weights())
+            return self.numpy_actor.predict(inputs)
         return self.sess.run(self.scaled_out, feed_dict={
             self.inputs: inputs
         })
@@ -142,10 +149,63 @@ class ActorNetwork(object):
     def update_target_network(self):
         self.sess.run(self.update_target_network_params)
 
+    def get_weights(self):
+        """The weights of the actor network as numpy arrays, see layer_params."""
+        return self.sess.run(self.layer_params)
+
+    def set_numpy_weights(self, weights):
+        """
+        Refresh the numpy copy of the actor used by predict(). This is done
+        by train(), anything else which changes the weights of the actor
+        must either call this or reset numpy_actor to None.
+        """
+        if self.numpy_actor is None:
+            self.numpy_actor = NumpyActor(weights, self.action_bound)
+        else:
+            self.numpy_actor.set_weights(weights)
+        self.weights_version += 1
+
     def get_num_trainable_vars(self):
         return self.num_trainable_vars
 
 
+class NumpyActor(object):
+
+    def __init__(self, weights, action_bound):
+        """
+        The actor network evaluated in numpy, without a TensorFlow session.
+        Since tflearn is never put in training mode, batch normalization
+        only applies a fixed affine map with the moving statistics, which is
+        folded into the preceding dense layer:
+
+            W' = W * s,  b' = (b - mean) * s + beta,  s = gamma / sqrt(var + eps)
+
+        Arguments:
+            weights (list of np.array): from ActorNetwork.get_weights()
+            action_bound (np.array): the action bound of the actor
+        """
+        self.action_bound = np.asarray(action_bound,
+                dtype=np.asarray(weights[-1]).dtype)
+        self.set_weights(weights)
+
+    def set_weights(self, weights):
+        """Fold and store new weights, see ActorNetwork.get_weights()."""
+        self.layers = []
+        for i in range(0, len(weights) - 2, 6):
+            W, b, mean, variance, beta, gamma = weights[i:i+6]
+            scale = gamma / np.sqrt(variance + 1e-5)
+            self.layers.append((W * scale, (b - mean) * scale + beta))
+        self.out_W, self.out_b = weights[-2:]
+
+    def predict(self, inputs):
+        """The actions for the states in the rows of inputs."""
+        net = np.asarray(inputs, dtype=self.out_W.dtype)
+        for (W, b) in self.layers:
+            net = np.maximum(np.dot(net, W) + b, 0.0)
+        return np.tanh(np.dot(net, self.out_W) + self.out_b) * \
+                self.action_bound
+
+
 class CriticNetwork(object):
     """
     Input to the network is the state and action, output is Q(s,a).
@@ -163,12 +223,13 @@ class CriticNetwork(object):
         self.gamma = gamma
 
         # Create the critic network
-        self.inputs, self.action, self.out = self.create_critic_network()
+        self.inputs, self.action, self.out, self.layers = \
+                self.create_critic_network()
         self.network_params = tf.trainable_variables()[num_actor_vars:]
 
         # Target Network
-        self.target_inputs, self.target_action, self.target_out = \
-                self.create_critic_network()
+        self.target_inputs, self.target_action, self.target_out, \
+                self.target_layers = self.create_critic_network()
         self.target_network_params = \
                 tf.trainable_variables()[(len(self.network_params) +
                     num_actor_vars):]
@@ -184,10 +245,17 @@ class CriticNetwork(object):
         # Network target (y_i)
         self.predicted_q_value = tf.placeholder(tf.float32, [None, 1])
 
+        # Importance sampling weights for prioritized replay. Without a feed
+        # every sample has weight one and this is a plain mean squared error.
+        self.importance_weights = tf.placeholder_with_default(
+            tf.ones_like(self.out), [None, 1])
+
         # Define loss and optimization Op
-        self.loss = tflearn.mean_square(self.predicted_q_value, self.out)
-        self.optimize = tf.train.AdamOptimizer(
-            self.learning_rate).minimize(self.loss)
+        self.loss = tf.reduce_mean(self.importance_weights *
+                tf.square(self.predicted_q_value - self.out))
+        self.optimizer = tf.train.AdamOptimizer(self.learning_rate)
+        self.optimize = apply_gradients(self.optimizer,
+                self.optimizer.compute_gradients(self.loss))
 
         # Get the gradient of the net w.r.t. the action.
         # For each action in the minibatch (i.e., for each x in xs),
@@ -200,10 +268,15 @@ class CriticNetwork(object):
         inputs = tflearn.input_data(shape=[None, self.s_dim])
         action = tflearn.input_data(shape=[None, self.a_dim])
         net = inputs
+        # Layers in the order they are created, kept so that the network can
+        # be applied to other tensors with copy_critic_network
+        layers = []
 
         for layer_nueral_number in self.critic_structure[:-1]:
             net = tflearn.fully_connected(inputs, layer_nueral_number)
+            layers.append(net)
             net = tflearn.layers.normalization.batch_normalization(net)
+            layers.append(net)
             net = tflearn.activations.relu(net)
 
         # Add the action tensor in the 2nd hidden layer
@@ -219,14 +292,48 @@ class CriticNetwork(object):
         # Weights are init to Uniform[-3e-3, 3e-3]
         w_init = tflearn.initializations.uniform(minval=-0.003, maxval=0.003)
         out = tflearn.fully_connected(net, 1, weights_init=w_init)
-        return inputs, action, out
+        layers.extend([t1, t2, out])
+        return inputs, action, out, layers
+
+    def copy_critic_network(self, inputs, action, layers):
+        """
+        Apply the network whose layers were returned by create_critic_network
+        to the given input tensors. The copy shares all of its variables with
+        the original, so it can be used to differentiate Q through tensors
+        that are not placeholders, e.g., Q(s, mu(s)).
+        """
+        # Variables are read explicitly so that the copy sees any updates
+        # its ops are made to depend on through tf.control_dependencies.
+        # Batch normalization uses the moving statistics, as tflearn does
+        # outside of training mode, which is never enabled here.
+        net = inputs
+        hidden, (t1, t2, out) = layers[:-3], layers[-3:]
+
+        for fc, bn in zip(hidden[0::2], hidden[1::2]):
+            net = tf.matmul(inputs, fc.W.read_value()) + fc.b.read_value()
+            with tf.variable_scope(bn.scope, reuse=True):
+                mean = tf.get_variable('moving_mean')
+                variance = tf.get_variable('moving_variance')
+            net = tf.nn.batch_normalization(net, mean.read_value(),
+                    variance.read_value(), bn.beta.read_value(),
+                    bn.gamma.read_value(), 1e-5)
+            net = tflearn.activations.relu(net)
+
+        net = tflearn.activation(
+            tf.matmul(net, t1.W.read_value()) +
+            tf.matmul(action, t2.W.read_value()) + t2.b.read_value(),
+            activation='relu')
+        return tf.matmul(net, out.W.read_value()) + out.b.read_value()
 
-    def train(self, inputs, action, predicted_q_value):
-        return self.sess.run([self.out, self.optimize], feed_dict={
+    def train(self, inputs, action, predicted_q_value, weights=None):
+        feed_dict = {
             self.inputs: inputs,
             self.action: action,
             self.predicted_q_value: predicted_q_value
-        })
+        }
+        if weights is not None:
+            feed_dict[self.importance_weights] = weights
+        return self.sess.run([self.out, self.optimize], feed_dict=feed_dict)
 
     def predict(self, inputs, action):
         return self.sess.run(self.scaled_out, feed_dict={
@@ -249,23 +356,103 @@ class CriticNetwork(object):
     def update_target_network(self):
         self.sess.run(self.update_target_network_params)
 
+class DDPGUpdate(object):
+    """
+    One complete DDPG update from a minibatch as a single op: the TD target
+    is computed with the target networks, the critic takes a gradient step,
+    the actor follows the gradient of the updated critic and finally both
+    target networks are moved toward the online networks. This is the same
+    sequence of updates as the separate calls made in train(), but it needs
+    only one session call and the targets are computed inside the graph.
+    """
+
+    def __init__(self, sess, actor, critic):
+        self.sess = sess
+        self.actor = actor
+        self.critic = critic
+
+        self.rewards = tf.placeholder(tf.float32, [None, 1])
+        self.terminals = tf.placeholder(tf.float32, [None, 1])
+
+        # y_i = r_i + gamma * Q'(s2_i, mu'(s2_i)) for non-terminal transitions
+        target_q = critic.copy_critic_network(actor.target_inputs,
+                actor.target_scaled_out, critic.target_layers)
+        self.y = tf.stop_gradient(self.rewards +
+                critic.gamma * (1. - self.terminals) * target_q)
+        self.td_error = self.y - critic.out
+
+        loss = tf.reduce_mean(critic.importance_weights *
+                tf.square(self.td_error))
+        critic_step = apply_gradients(critic.optimizer,
+                critic.optimizer.compute_gradients(loss,
+                    var_list=critic.network_params))
+
+        # The actor is updated with the gradient of the updated critic
+        with tf.control_dependencies([critic_step]):
+            q = critic.copy_critic_network(critic.inputs, actor.scaled_out,
+                    critic.layers)
+            action_gradient = tf.gradients(q, actor.scaled_out)[0]
+            actor_gradients = list(map(
+                lambda x: tf.div(x, actor.batch_size),
+                tf.gradients(actor.scaled_out, actor.network_params,
+                    -action_gradient)))
+            actor_step = apply_gradients(actor.optimizer,
+                    zip(actor_gradients, actor.network_params))
+
+        with tf.control_dependencies([actor_step]):
+            # The updated actor weights, to refresh its numpy copy
+            self.actor_params = [tf.identity(param)
+                    for param in actor.layer_params]
+            target_updates = \
+                [target.assign(tf.multiply(param.read_value(), network.tau) +
+                    tf.multiply(target, 1. - network.tau))
+                    for network in (actor, critic)
+                    for param, target in zip(network.network_params,
+                        network.target_network_params)]
+        self.optimize = tf.group(*target_updates)
+
+    def train(self, s_batch, a_batch, r_batch, t_batch, s2_batch,
+              weights=None):
+        """
+        Returns the critic's Q values for the minibatch before the update and
+        the corresponding TD errors.
+        """
+        feed_dict = {
+            self.actor.inputs: s_batch,
+            self.actor.target_inputs: s2_batch,
+            self.critic.inputs: s_batch,
+            self.critic.action: a_batch,
+            self.rewards: np.reshape(r_batch, (-1, 1)),
+            self.terminals: np.reshape(t_batch, (-1, 1))
+        }
+        if weights is not None:
+            feed_dict[self.critic.importance_weights] = weights
+        q, td_error, _, actor_weights = self.sess.run(
+                [self.critic.out, self.td_error, self.optimize,
+                    self.actor_params],
+                feed_dict=feed_dict)
+        self.actor.set_numpy_weights(actor_weights)
+        return q, td_error
+
 # Taken from
 # https://github.com/openai/baselines/blob/master/baselines/ddpg/noise.py,
 # which is based on
 # http://math.stackexchange.com/questions/1287634/implementing-ornstein-uhlenbeck-in-matlab
 class OrnsteinUhlenbeckActionNoise:
-    def __init__(self, mu, sigma=0.3, theta=.15, dt=1e-2, x0=None):
+    def __init__(self, mu, sigma=0.3, theta=.15, dt=1e-2, x0=None,
+                 random_state=None):
         self.theta = theta
         self.mu = mu
         self.sigma = sigma
         self.dt = dt
         self.x0 = x0
+        self.random = np.random if random_state is None else random_state
         self.reset()
 
     def __call__(self):
         x = self.x_prev + self.theta * (self.mu - self.x_prev) * self.dt + \
                 self.sigma * np.sqrt(self.dt) * \
-                np.random.normal(size=self.mu.shape)
+                self.random.normal(size=self.mu.shape)
         self.x_prev = x
         return x
 
@@ -279,10 +466,429 @@ class OrnsteinUhlenbeckActionNoise:
         return 'OrnsteinUhlenbeckActionNoise(mu={}, sigma={})'.format(
                 self.mu, self.sigma)
 
+def update_networks(actor, critic, replay_buffer, minibatch_size,
+                    update=None):
+    """
+    Perform one DDPG update of the actor, the critic and their target
+    networks from a minibatch sampled from replay_buffer, using the fused
+    update op if one is given. Returns the largest Q value predicted for the
+    minibatch.
+    """
+    if isinstance(replay_buffer, PrioritizedReplayBuffer):
+        s_batch, a_batch, r_batch, t_batch, s2_batch, w_batch, idx_batch = \
+            replay_buffer.sample_batch(minibatch_size)
+    else:
+        s_batch, a_batch, r_batch, t_batch, s2_batch = \
+            replay_buffer.sample_batch(minibatch_size)
+        w_batch = None
+
+    if update is not None:
+        predicted_q_value, td_error = update.train(s_batch, a_batch, r_batch,
+                t_batch, s2_batch, w_batch)
+    else:
+        # Calculate targets
+        target_q = critic.predict_target(
+            s2_batch, actor.predict_target(s2_batch))
+
+        r_batch = np.reshape(r_batch, (-1, 1))
+        y_i = np.where(np.reshape(t_batch, (-1, 1)), r_batch,
+                r_batch + critic.gamma * target_q)
+
+        # Update the critic given the targets
+        predicted_q_value, _ = critic.train(s_batch, a_batch, y_i, w_batch)
+        td_error = y_i - predicted_q_value
+
+        # Update the actor policy using the sampled gradient
+        a_outs = actor.predict(s_batch)
+        grads = critic.action_gradients(s_batch, a_outs)
+        actor.train(s_batch, grads[0])
+
+        # Update target networks
+        actor.update_target_network()
+        critic.update_target_network()
+
+    # Refresh the priorities of the sampled transitions with the TD errors
+    # computed for this update
+    if isinstance(replay_buffer, PrioritizedReplayBuffer):
+        replay_buffer.update_priorities(idx_batch, td_error)
+
+    return np.amax(predicted_q_value)
+
+def run_vector_episode(venv, args, actor, critic, actor_noise, replay_buffer,
+                       update=None, shield=None, shield_penalty=0.0):
+    """
+    Run one training episode of max_episode_len steps on every member of a
+    VectorEnvironment. Each step queries the actor once for all members,
+    adds one transition per member to the replay buffer and performs one
+    network update. As in train(), members are reset when they terminate or
+    the shield intervenes. The shield is only used if one is given.
+
+    Returns:
+        (float, int, float, int): the mean episode reward of the members,
+        the number of unsafe transitions, the sum of the largest predicted
+        Q values and the number of shield interventions
+    """
+    safe_training = shield is not None
+    n = venv.num_envs
+    s = np.array(venv.reset())
+    ep_reward = np.zeros(n)
+    unsafe_count = 0
+    ep_ave_max_q = 0
+    shield_times = 0
+    # The shield remembers the piece it last used for a single trajectory,
+    # so keep that memory separately for each member
+    last_shield = np.full(n, -1)
+
+    for j in range(int(args['max_episode_len'])):
+        # Added exploration noise
+        a = actor.predict(s) + actor_noise()
+
+        shield_required = np.zeros(n, dtype=bool)
+        if safe_training:
+            shield_required, _ = shield.detector_batch(s, a)
+            last_shield[~shield_required] = -1
+            for k in np.flatnonzero(shield_required):
+                shield.last_shield = last_shield[k]
+                try:
+                    a[k] = np.ravel(shield.call_shield(np.matrix(s[k]).T))
+                except RuntimeError:
+                    s[k] = venv.reset(np.arange(n) == k)[k]
+                last_shield[k] = shield.last_shield
+
+        s2, r, terminal = venv.step(a, safe=safe_training)
+
+        if safe_training:
+            r[shield_required] += shield_penalty
+            shield_times += np.count_nonzero(shield_required)
+            terminal = terminal | shield_required
+            # The environment only resets members which terminate by itself
+            venv.reset(shield_required)
+        else:
+            unsafe_count += np.count_nonzero(
+                    np.abs(r - venv.bad_reward) < 0.1)
+
+        replay_buffer.add_batch(s, a, r, terminal, s2)
+
+        # Keep adding experience to the memory until
+        # there are at least minibatch size samples
+        if replay_buffer.size() > int(args['minibatch_size']):
+            ep_ave_max_q += update_networks(actor, critic, replay_buffer,
+                    int(args['minibatch_size']), update)
+
+        ep_reward += r
+        ep_reward[shield_required] -= shield_penalty
+        last_shield[terminal] = -1
+        s = np.array(venv.xk)
+
+    return np.mean(ep_reward), unsafe_count, ep_ave_max_q, shield_times
+
+def evaluate_policy(env, args, actor=None, actor_noise=None, shield=None,
+                    episodes=100, seed=None):
+    """
+    Evaluate the actor, the shield or their combination on a batch of
+    episodes of max_episode_len steps, run as the members of one
+    VectorEnvironment. Members are reset when they terminate, so a member
+    may go through several runs within its episode.
+
+    Without an actor every action comes from the shield. With both, the
+    shield is used whenever it detects that the action of the actor is
+    unsafe. Each member keeps its own memory of the shield piece it last
+    used, which like Shield.last_shield survives the resets between runs.
+    The initial states and the
+    exploration noise are drawn from a generator seeded with seed, so
+    repeated evaluations see the same initial states.
+
+    Arguments:
+        actor (ActorNetwork): the actor, if any
+        actor_noise (OrnsteinUhlenbeckActionNoise): its parameters are used
+            for the exploration noise added to the actions of the actor
+        shield (Shield): the shield, if any
+        episodes (int): the number of members
+
+    Returns:
+        (float, int, int): the sum of the rewards of all safe steps divided
+        by the number of episodes, the number of steps with the bad reward
+        and the number of runs
+    """
+    if actor is None and shield is None:
+        raise ValueError("Nothing to evaluate without an actor or a shield")
+
+    random_state = np.random.RandomState(seed)
+    venv = VectorEnvironment(env, episodes, random_state=random_state)
+    if actor is not None and actor_noise is not None:
+        # A serial evaluation keeps drawing from one long running noise
+        # process, so start every member from its stationary distribution
+        decay = 1 - actor_noise.theta * actor_noise.dt
+        scale = actor_noise.sigma * np.sqrt(actor_noise.dt / (1 - decay ** 2))
+        mu = np.zeros((episodes, actor.a_dim))
+        noise = OrnsteinUhlenbeckActionNoise(mu=mu,
+                sigma=actor_noise.sigma, theta=actor_noise.theta,
+                dt=actor_noise.dt,
+                x0=random_state.normal(scale=scale, size=mu.shape),
+                random_state=random_state)
+    else:
+        noise = lambda: 0.0
+
+    s_reward = 0.0
+    unsafe_count = 0
+    total_runs = episodes
+    s = np.array(venv.xk)
+    if shield is not None:
+        saved_last_shield = shield.last_shield
+        last_shield = np.full(episodes, -1)
+
+    for j in range(int(args['max_episode_len'])):
+        if actor is not None:
+            u = actor.predict(s) + noise()
+            if shield is not None:
+                shield_required, _ = shield.detector_batch(s, u)
+                last_shield[~shield_required] = -1
+        else:
+            u = np.zeros((episodes, env.action_dim))
+            shield_required = np.ones(episodes, dtype=bool)
+
+        if shield is not None:
+            for k in np.flatnonzero(shield_required):
+                shield.last_shield = last_shield[k]
+                u[k] = np.ravel(shield.call_shield(np.matrix(s[k]).T))
+                last_shield[k] = shield.last_shield
+
+        _, r, terminal = venv.step(u, safe=True)
+        bad = r == env.bad_reward
+        unsafe_count += np.count_nonzero(bad)
+        s_reward += np.sum(r[~bad])
+        total_runs += np.count_nonzero(terminal)
+        s = np.array(venv.xk)
+
+    if shield is not None:
+        shield.last_shield = saved_last_shield
+    return s_reward / episodes, unsafe_count, total_runs
+
+class SharedActorWeights(object):
+
+    def __init__(self, weights, context=None):
+        """
+        A copy of the actor weights in shared memory, published by the
+        learner and read by the rollout workers. The version number is
+        incremented on each publish so that readers can tell when their copy
+        is stale.
+        """
+        context = multiprocessing.get_context('fork') \
+                if context is None else context
+        self.shapes = [np.shape(w) for w in weights]
+        self.offsets = np.cumsum([0] + [np.size(w) for w in weights])
+        self.lock = context.Lock()
+        self.version = context.RawValue('l', 0)
+        self.flat = np.frombuffer(context.RawArray('f',
+            int(self.offsets[-1])), dtype=np.float32)
+        self.publish(weights)
+
+    def publish(self, weights):
+        with self.lock:
+            for i, w in enumerate(weights):
+                self.flat[self.offsets[i]:self.offsets[i+1]] = np.ravel(w)
+            self.version.value += 1
+
+    def read(self):
+        """Returns the current version number and a copy of the weights."""
+        with self.lock:
+            flat = self.flat.copy()
+            version = self.version.value
+        return version, [flat[self.offsets[i]:self.offsets[i+1]].reshape(shape)
+                for i, shape in enumerate(self.shapes)]
+
+
+def rollout_worker(worker_id, env, args, replay_buffer, weights, action_bound,
+                   shield, shield_queue, stats_queue, stop, shield_penalty):
+    """
+    The body of a rollout worker process started by AsyncTrainer. The worker
+    runs training episodes on its own copy of the environment exactly as
+    train() does, evaluating the actor in numpy with the most recently
+    published weights, and adds its transitions to the shared replay buffer.
+    New shields arrive on shield_queue. After each episode the tuple
+    (reward, unsafe transitions, shield interventions, steps) is put on
+    stats_queue.
+    """
+    # Forked processes start with the random state of their parent
+    np.random.seed()
+    random.seed()
+    # Don't keep the process alive at exit to flush unread statistics
+    stats_queue.cancel_join_thread()
+
+    safe_training = shield is not None
+    actor_noise = OrnsteinUhlenbeckActionNoise(mu=np.zeros(env.action_dim))
+    version, actor_weights = weights.read()
+    actor = NumpyActor(actor_weights, action_bound)
+
+    while not stop.is_set():
+        try:
+            while True:
+                pieces = shield_queue.get_nowait()
+                shield.set_pieces(pieces)
+        except queue.Empty:
+            pass
+
+        s = env.reset()
+        ep_reward = 0
+        unsafe_count = 0
+        shield_times = 0
+
+        for j in range(int(args['max_episode_len'])):
+            if weights.version.value != version:
+                version, actor_weights = weights.read()
+                actor.set_weights(actor_weights)
+
+            # Added exploration noise
+            a = actor.predict(np.reshape(s, (1, env.state_dim))) + \
+                    actor_noise()
+
+            shield_required = False
+            if safe_training and \
+                    shield.detector(s, a.reshape(env.action_dim, 1)):
+                shield_required = True
+                try:
+                    a = shield.call_shield(s)
+                except RuntimeError:
+                    s = env.reset()
+
+            s2, r, terminal = env.step(a.reshape(env.action_dim, 1),
+                    safe=safe_training)
+
+            if safe_training and shield_required:
+                r += shield_penalty
+                shield_times += 1
+                terminal = True
+
+            if abs(r - env.bad_reward) < 0.1 and not safe_training:
+                unsafe_count += 1
+
+            replay_buffer.add(np.reshape(np.array(s), (env.state_dim,)),
+                    np.reshape(np.array(a), (env.action_dim,)), r,
+                    terminal, np.reshape(np.array(s2), (env.state_dim,)))
+
+            s = s2
+            ep_reward += r
+            if safe_training and shield_required:
+                ep_reward -= shield_penalty
+
+            if terminal or shield_required:
+                s = env.reset()
+
+        stats_queue.put((ep_reward, unsafe_count, shield_times, j + 1))
+
+
+class AsyncTrainer(object):
+
+    def __init__(self, env, args, actor, critic, replay_buffer=None,
+                 update=None, shield=None, shield_penalty=0.0):
+        """
+        Splits DDPG training into args['num_workers'] rollout worker
+        processes, which collect experience with periodically synchronized
+        copies of the actor, and a learner, which is the calling process.
+        The learner updates the networks from a shared replay buffer with
+        next_episode() and is the only process that modifies the shield.
+        Workers are forked, so this must be created before any other threads
+        are started in the learner, and only the learner may use the
+        TensorFlow session.
+
+        Arguments:
+            replay_buffer (ReplayBuffer): transitions to start from
+            update (DDPGUpdate): fused update op to use, if any
+            shield (Shield): the shield to use for safe training, if any
+        """
+        if isinstance(replay_buffer, PrioritizedReplayBuffer):
+            raise ValueError("Prioritized replay is not supported with "
+                    "rollout workers")
+
+        context = multiprocessing.get_context('fork')
+        self.actor = actor
+        self.critic = critic
+        self.update = update
+        self.minibatch_size = int(args['minibatch_size'])
+        self.sync_every = int(args.get('sync_every', 10))
+        self.updates = 0
+
+        self.replay_buffer = SharedReplayBuffer(int(args['buffer_size']),
+                env.state_dim, env.action_dim, int(args['random_seed']),
+                context=context)
+        if replay_buffer is not None and replay_buffer.size() > 0:
+            n = replay_buffer.size()
+            self.replay_buffer.add_batch(replay_buffer.s[:n],
+                    replay_buffer.a[:n], replay_buffer.r[:n],
+                    replay_buffer.t[:n], replay_buffer.s2[:n])
+
+        self.weights = SharedActorWeights(actor.get_weights(), context)
+        self.stats_queue = context.Queue()
+        self.stop = context.Event()
+        self.shield_queues = []
+        self.workers = []
+        for worker_id in range(int(args['num_workers'])):
+            shield_queue = context.Queue()
+            worker = context.Process(target=rollout_worker,
+                    args=(worker_id, env, args, self.replay_buffer,
+                        self.weights, actor.action_bound, shield,
+                        shield_queue, self.stats_queue, self.stop,
+                        shield_penalty))
+            worker.daemon = True
+            worker.start()
+            self.shield_queues.append(shield_queue)
+            self.workers.append(worker)
+
+    def next_episode(self):
+        """
+        Update the networks from the shared replay buffer until some worker
+        finishes an episode.
+
+        Returns:
+            (float, int, float, int, int): the reward of the episode, its
+            number of unsafe transitions, the sum of the largest predicted Q
+            values of the updates made meanwhile, its number of shield
+            interventions and its number of steps
+        """
+        ep_ave_max_q = 0
+        while True:
+            if self.replay_buffer.size() > self.minibatch_size:
+                ep_ave_max_q += update_networks(self.actor, self.critic,
+                        self.replay_buffer, self.minibatch_size, self.update)
+                self.updates += 1
+                if self.updates % self.sync_every == 0:
+                    self.weights.publish(self.actor.get_weights())
+                timeout = None
+            else:
+                # Nothing to learn from yet, wait for the workers
+                timeout = 1.0
+
+            try:
+                if timeout is None:
+                    stats = self.stats_queue.get_nowait()
+                else:
+                    stats = self.stats_queue.get(timeout=timeout)
+                ep_reward, unsafe_count, shield_times, steps = stats
+                return ep_reward, unsafe_count, ep_ave_max_q, shield_times, \
+                        steps
+            except queue.Empty:
+                pass
+
+            if not any(worker.is_alive() for worker in self.workers):
+                raise RuntimeError("All rollout workers have exited")
+
+    def publish_shield(self, shield):
+        """Send a new shield to every worker."""
+        for shield_queue in self.shield_queues:
+            shield_queue.put(shield.get_pieces())
+
+    def close(self):
+        """Stop the workers."""
+        self.stop.set()
+        for worker in self.workers:
+            worker.join(timeout=10.0)
+            if worker.is_alive():
+                worker.terminate()
+
 @timeit
 def train(sess, env, args, actor, critic, actor_noise, restorer,
           replay_buffer=None, safe_training=False, rewardf=None, shields=1,
-          initial_shield=None, penalty_ratio=0.1, bound=20):
+          initial_shield=None, penalty_ratio=0.1, bound=20, update=None):
 
     print("Started training")
 
@@ -292,14 +898,33 @@ def train(sess, env, args, actor, critic, actor_noise, restorer,
 
     # Initialize replay memory
     if replay_buffer is None:
-        replay_buffer = ReplayBuffer(int(args['buffer_size']),
-                int(args['random_seed']))
+        if args.get('prioritized_replay', False):
+            replay_buffer = PrioritizedReplayBuffer(int(args['buffer_size']),
+                    int(args['random_seed']),
+                    alpha=float(args.get('per_alpha', 0.6)),
+                    beta=float(args.get('per_beta', 0.4)),
+                    beta_increment=float(args.get('per_beta_increment', 0.0)))
+        else:
+            replay_buffer = ReplayBuffer(int(args['buffer_size']),
+                    int(args['random_seed']))
+
+    num_envs = int(args.get('num_envs', 1))
+    if num_envs > 1:
+        venv = VectorEnvironment(env, num_envs)
+        vector_noise = OrnsteinUhlenbeckActionNoise(
+                mu=np.zeros((num_envs, actor.a_dim)))
 
     # Needed to enable BatchNorm.
     # This hurts the performance on Pendulum but could be useful in other
     # environments.
     # tflearn.is_training(True)
 
+    def save_model(path, metrics=None, best=False):
+        if isinstance(restorer, CheckpointWriter):
+            restorer.save(sess, path, metrics=metrics, best=best)
+        else:
+            restorer.save(sess, path)
+
     last_reward = env.bad_reward
     count = 0
     reward_list = []
@@ -313,114 +938,105 @@ def train(sess, env, args, actor, critic, actor_noise, restorer,
         else:
             # Don't ever modify the shield
             shield_iters = 2 * int(args['max_episodes'])
-        s_reward = 0.0
-        for i in range(100):
-            s = env.reset()
-            #for j in range(10 * bound):
-            for j in range(int(args['max_episode_len'])):
-                u = shield.call_shield(s)
-                s2, r, terminal = env.step(u.reshape(actor.a_dim, 1), safe=True)
-                if r != env.bad_reward:
-                    s_reward += r
-                s = s2
-                if terminal:
-                    s = env.reset()
-        s_reward /= 100.0
+        s_reward, _, _ = evaluate_policy(env, args, shield=shield,
+                seed=int(args['random_seed']))
         print("Average initial shield reward:", s_reward)
 
-    for i in range(int(args['max_episodes'])):
-        s = env.reset()
-        ep_reward = 0
-        unsafe_end = False
-        ep_ave_max_q = 0
-        #temp_r = env.bad_reward
-        shield_times = 0
+    # Shield synthesis queries the actor at many nearby states
+    actor_cache = None
+    if safe_training and args.get('actor_cache_resolution') is not None:
+        actor_cache = ActorCache(actor,
+                float(args['actor_cache_resolution']),
+                int(args.get('actor_cache_size', 100000)))
 
-        log = []
+    num_workers = int(args.get('num_workers', 0))
+    if num_workers > 0:
+        trainer = AsyncTrainer(env, args, actor, critic, replay_buffer,
+                update, shield if safe_training else None,
+                shield_penalty if safe_training else 0.0)
 
-        for j in range(int(args['max_episode_len'])):
-            # Added exploration noise
-            a = actor.predict(np.reshape(s, (1, actor.s_dim))) + actor_noise()
+    for i in range(int(args['max_episodes'])):
+        log = []
 
-            #tmp = 0
-            shield_required = False
-            if safe_training and shield.detector(s, a.reshape(actor.a_dim, 1)):
-                shield_required = True
-                #print s, a
-                #tmp += 1
-                #if tmp > 10:
-                #    raise RuntimeError("")
-                try:
-                    a = shield.call_shield(s)
-                except RuntimeError:
-                    s = env.reset()
-                #    #continue
-                #    #print "s, a, r, s2, shield_required, terminal"
-                #    #print log
-                #    #raise RuntimeError("")
+        if num_workers > 0:
+            ep_reward, unsafe_count, ep_ave_max_q, shield_times, steps = \
+                trainer.next_episode()
+            unsafe_runs += unsafe_count
+            unsafe_end = unsafe_count > 0
+            j = steps - 1
+        elif num_envs > 1:
+            ep_reward, unsafe_count, ep_ave_max_q, shield_times = \
+                run_vector_episode(venv, args, actor, critic, vector_noise,
+                        replay_buffer, update,
+                        shield if safe_training else None,
+                        shield_penalty if safe_training else 0.0)
+            unsafe_runs += unsafe_count
+            unsafe_end = unsafe_count > 0
+            j = int(args['max_episode_len']) - 1
+        else:
+            s = env.reset()
+            ep_reward = 0
+            unsafe_end = False
+            ep_ave_max_q = 0
+            #temp_r = env.bad_reward
+            shield_times = 0
 
-            s2, r, terminal = env.step(a.reshape(actor.a_dim, 1), safe=safe_training)
+            for j in range(int(args['max_episode_len'])):
+                # Added exploration noise
+                a = actor.predict(np.reshape(s, (1, actor.s_dim))) + actor_noise()
+
+                #tmp = 0
+                shield_required = False
+                if safe_training and shield.detector(s, a.reshape(actor.a_dim, 1)):
+                    shield_required = True
+                    #print s, a
+                    #tmp += 1
+                    #if tmp > 10:
+                    #    raise RuntimeError("")
+                    try:
+                        a = shield.call_shield(s)
+                    except RuntimeError:
+                        s = env.reset()
+                    #    #continue
+                    #    #print "s, a, r, s2, shield_required, terminal"
+                    #    #print log
+                    #    #raise RuntimeError("")
 
-            if safe_training and shield_required:
-                r += shield_penalty
-                shield_times += 1
-                terminal = True
+                s2, r, terminal = env.step(a.reshape(actor.a_dim, 1), safe=safe_training)
 
-            if abs(r - env.bad_reward) < 0.1 and not safe_training:
-                unsafe_runs += 1
-                unsafe_end = True
-
-            # if r > temp_r:
-            #   temp_r = r
-            replay_buffer.add(np.reshape(np.array(s), (actor.s_dim,)),
-                    np.reshape(np.array(a), (actor.a_dim,)), r,
-                    terminal, np.reshape(np.array(s2), (actor.s_dim, )))
-
-            #log.append((s, a, r, s2, shield_required, terminal))
-
-            # Keep adding experience to the memory until
-            # there are at least minibatch size samples
-            if replay_buffer.size() > int(args['minibatch_size']):
-                s_batch, a_batch, r_batch, t_batch, s2_batch = \
-                    replay_buffer.sample_batch(int(args['minibatch_size']))
-
-                # Calculate targets
-                target_q = critic.predict_target(
-                    s2_batch, actor.predict_target(s2_batch))
-
-                y_i = []
-                for k in range(int(args['minibatch_size'])):
-                    if t_batch[k]:
-                        y_i.append(r_batch[k])
-                    else:
-                        y_i.append(r_batch[k] + critic.gamma * target_q[k])
+                if safe_training and shield_required:
+                    r += shield_penalty
+                    shield_times += 1
+                    terminal = True
 
-                # Update the critic given the targets
-                predicted_q_value, _ = critic.train(
-                    s_batch, a_batch,
-                    np.reshape(y_i, (int(args['minibatch_size']), 1)))
+                if abs(r - env.bad_reward) < 0.1 and not safe_training:
+                    unsafe_runs += 1
+                    unsafe_end = True
 
-                ep_ave_max_q += np.amax(predicted_q_value)
+                # if r > temp_r:
+                #   temp_r = r
+                replay_buffer.add(np.reshape(np.array(s), (actor.s_dim,)),
+                        np.reshape(np.array(a), (actor.a_dim,)), r,
+                        terminal, np.reshape(np.array(s2), (actor.s_dim, )))
 
-                # Update the actor policy using the sampled gradient
-                a_outs = actor.predict(s_batch)
-                grads = critic.action_gradients(s_batch, a_outs)
-                actor.train(s_batch, grads[0])
+                #log.append((s, a, r, s2, shield_required, terminal))
 
-                # Update target networks
-                actor.update_target_network()
-                critic.update_target_network()
+                # Keep adding experience to the memory until
+                # there are at least minibatch size samples
+                if replay_buffer.size() > int(args['minibatch_size']):
+                    ep_ave_max_q += update_networks(actor, critic, replay_buffer,
+                            int(args['minibatch_size']), update)
 
-            s = s2
-            ep_reward += r
-            if safe_training and shield_required:
-                ep_reward -= shield_penalty
+                s = s2
+                ep_reward += r
+                if safe_training and shield_required:
+                    ep_reward -= shield_penalty
 
-            if terminal or shield_required:
-                # print "Termainal at step", j
-                if j < int(args['max_episode_len']):
-                    s = env.reset()
-                    continue
+                if terminal or shield_required:
+                    # print "Termainal at step", j
+                    if j < int(args['max_episode_len']):
+                        s = env.reset()
+                        continue
 
         count += 1
 
@@ -432,7 +1048,8 @@ def train(sess, env, args, actor, critic, actor_noise, restorer,
             if reward_mean > last_reward:
                 # print reward_mean
                 # print env.bad_reward
-                restorer.save(sess, args['model_path'])
+                save_model(args['model_path'], best=True, metrics={
+                    'episode': i, 'reward_mean': float(reward_mean)})
                 print('sess has been stored to', args['model_path'])
                 last_reward = reward_mean
 
@@ -445,75 +1062,34 @@ def train(sess, env, args, actor, critic, actor_noise, restorer,
         # print "u\n", env.last_u
 
         if safe_training and (i + 1) % shield_iters == 0:
-            s_reward = 0.0
-            for i in range(100):
-                s = env.reset()
-                #for j in range(10 * bound):
-                for j in range(int(args['max_episode_len'])):
-                    u = actor.predict(np.reshape(s, (1, actor.s_dim))) + actor_noise()
-                    shield_required = False
-                    if safe_training and shield.detector(s, u.reshape(actor.a_dim, 1)):
-                        shield_required = True
-                        try:
-                            u = shield.call_shield(s)
-                        except RuntimeError:
-                            print("s, a, r, s2, shield_required, terminal")
-                            print(log)
-                            raise RuntimeError("")
-                    s2, r, terminal = env.step(u.reshape(actor.a_dim, 1), safe=True)
-                    if r != env.bad_reward:
-                        s_reward += r
-                    s = s2
-                    if terminal:
-                        s = env.reset()
-            s_reward /= 100.0
+            s_reward, _, _ = evaluate_policy(env, args, actor, actor_noise,
+                    shield, seed=int(args['random_seed']))
             print("New combined reward (before shield update):", s_reward)
             old_shield = shield
             #shield.train_shield(old_shield, actor, bound=int(args['max_episode_len']))
-            shield.train_shield(old_shield, actor, bound=bound)
+            shield.train_shield(old_shield,
+                    actor if actor_cache is None else actor_cache, bound=bound)
             print('Learned a new shield')
+            if actor_cache is not None:
+                print('actor cache:', actor_cache.get_metrics())
+            if num_workers > 0:
+                trainer.publish_shield(shield)
+
+    if num_workers > 0:
+        trainer.close()
 
     print('min reward:', last_reward)
     if last_reward == env.bad_reward:
-        restorer.save(sess, args['model_path'])
+        save_model(args['model_path'])
     model_path = os.path.split(args['model_path'])[0]+'/'
     final_model = model_path+'final_model.chkp'
-    restorer.save(sess, final_model)
+    save_model(final_model)
     print('sess has been saved to', final_model)
     if not safe_training:
         print("Unsafe runs:", unsafe_runs)
-    s_reward = 0.0
-    unsafe_count = 0
-    total_runs = 0
-    for i in range(100):
-        s = env.reset()
-        total_runs += 1
-        log = []
-        #for j in range(10 * bound):
-        for j in range(int(args['max_episode_len'])):
-            u = actor.predict(np.reshape(s, (1, actor.s_dim))) + actor_noise()
-            shield_required = False
-            if safe_training and shield.detector(s, u.reshape(actor.a_dim, 1)):
-                shield_required = True
-                try:
-                    u = shield.call_shield(s)
-                except RuntimeError:
-                    print("s, a, r, s2, shield_required, terminal")
-                    print(log)
-                    raise RuntimeError("")
-            s2, r, terminal = env.step(u.reshape(actor.a_dim, 1), safe=True)
-            if r == env.bad_reward:
-            #    print s, u, s2, shield_required
-            #    raise RuntimeError("Unsafe state reached")
-                unsafe_count += 1
-            else:
-                s_reward += r
-            log.append((s, u, r, s2, shield_required, terminal))
-            s = s2
-            if terminal:
-                s = env.reset()
-                total_runs += 1
-    s_reward /= 100.0
+    s_reward, unsafe_count, total_runs = evaluate_policy(env, args, actor,
+            actor_noise, shield if safe_training else None,
+            seed=int(args['random_seed']))
     s = env.reset()
     log = []
     terminal = False
@@ -584,6 +1160,9 @@ def DDPG(env, args, replay_buffer=None, safe_training=False, rewardf=None,
     #np.random.seed(int(args['random_seed']))
     #tf.set_random_seed(int(args['random_seed']))
 
+    if args.get('fast_env', False) and isinstance(env, Environment):
+        env = FastEnvironment(env)
+
     state_dim = env.state_dim
     action_dim = env.action_dim
     #assert (env.u_max == -env.u_min).all()
@@ -600,8 +1179,17 @@ def DDPG(env, args, replay_buffer=None, safe_training=False, rewardf=None,
             float(args['gamma']),
             actor.get_num_trainable_vars())
 
+    if args.get('fused_update', False):
+        update = DDPGUpdate(sess, actor, critic)
+    else:
+        update = None
+
     sess.run(tf.global_variables_initializer())
-    restorer = tf.train.Saver(tf.global_variables())
+    if args.get('async_checkpoint', False):
+        restorer = CheckpointWriter(tf.global_variables(),
+                keep=int(args.get('keep_checkpoints', 5)))
+    else:
+        restorer = tf.train.Saver(tf.global_variables())
 
     #if tf.train.checkpoint_exists(args['model_path']):
     #    restorer.restore(sess, args['model_path'])
@@ -612,7 +1200,11 @@ def DDPG(env, args, replay_buffer=None, safe_training=False, rewardf=None,
     shield = train(sess, env, args, actor, critic, actor_noise, restorer,
             replay_buffer, safe_training, rewardf=rewardf, shields=shields,
             initial_shield=initial_shield, penalty_ratio=penalty_ratio,
-            bound=bound)
+            bound=bound, update=update)
+
+    if isinstance(restorer, CheckpointWriter):
+        restorer.close()
+        print('checkpoint writer:', restorer.get_metrics())
 
     if args['enable_test']:
         test(env, actor, args, actor_noise)
@@ -718,16 +1310,14 @@ def generate_replay_buffer(env, batch, buffer_size):
 @timeit
 def generate_replay_buffer_with_K(K, env, buffer_size, epsoides, steps):
     replay_buffer = ReplayBuffer(buffer_size)
-    for i in xrange(epsoides):
-        xk = env.reset()
-        last_x = xk
-        for j in xrange(steps):
-            u = K.dot(xk)
-            xk, r, terminal = env.step(u)
-            last_x = xk
-            replay_buffer.add(np.reshape(np.array(last_x), (env.state_dim,)),
-                    np.reshape(np.array(u), (env.action_dim,)), r, terminal,
-                    np.reshape(np.array(xk), (env.state_dim, )))
+    X0, E0 = env.reset_batch(epsoides)
+    states, actions, rewards, terminals, _ = rollout(env,
+            LinearController(K), X0, steps, E0, stop_on_terminal=False)
+    # As before, each transition is stored with its successor state in place
+    # of the state it starts from
+    s = states[:, 1:].reshape(-1, env.state_dim)
+    replay_buffer.add_batch(s, actions.reshape(-1, env.action_dim),
+            rewards.reshape(-1), terminals.reshape(-1), s)
 
     return replay_buffer
 
@@ -1,5 +1,71 @@
 ################ Environment Module ######################
 import numpy as np
+from polytopes import PolytopeUnion
+
+def unsafe_union(unsafe_A, unsafe_b, dim):
+    """Stack the unsafe polytopes A x <= b of an environment.
+
+    Args:
+        unsafe_A (list): constraint matrices of the unsafe polytopes
+        unsafe_b (list): constraint offsets of the unsafe polytopes
+        dim (int): the dimension of the state space
+
+    Returns:
+        PolytopeUnion: the unsafe set, or None if there are no unsafe
+        polytopes
+    """
+    if unsafe_A is None or unsafe_b is None:
+        return None
+    return PolytopeUnion(list(zip(unsafe_A, unsafe_b)), dim)
+
+def sample_box(low, high, n, random_state=None):
+    """Sample n points uniformly from the box low <= x <= high, one per row.
+
+    The points are drawn from random_state if it is given and from the
+    global numpy generator otherwise.
+    """
+    random = np.random if random_state is None else random_state
+    low = np.asarray(low)[:, 0]
+    high = np.asarray(high)[:, 0]
+    return random.uniform(low, high, size=(n, len(low)))
+
+# Functions which may be used in the expressions given to compile_dynamics()
+DYNAMICS_FUNCTIONS = ('sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan',
+        'sinh', 'cosh', 'tanh', 'exp', 'log', 'sqrt', 'abs', 'minimum',
+        'maximum', 'clip', 'pi')
+
+def compile_dynamics(exprs, constants=None):
+    """Compile symbolic dynamics into a batched dynamics function.
+
+    Each expression gives one component of the dynamics in terms of the
+    state x and the action u, e.g. "t * u[0] - 9.81 / l * sin(x[0])". The
+    expressions are compiled once, and every call evaluates them with x[i]
+    and u[j] bound to whole columns of the batch, so that each operation is
+    a single numpy ufunc call over all rows.
+
+    Args:
+        exprs (list): one expression string per state component
+        constants (dict): values of any other names used in the expressions
+
+    Returns:
+        function: f(X, U) mapping states and actions, one per row, to an
+        array of shape (N, len(exprs))
+    """
+    namespace = {name: getattr(np, name) for name in DYNAMICS_FUNCTIONS}
+    if constants is not None:
+        namespace.update(constants)
+    code = compile('(' + ', '.join(exprs) + ',)', '<dynamics>', 'eval')
+
+    def f(X, U):
+        X = np.asarray(X, dtype=np.float64)
+        U = np.asarray(U, dtype=np.float64)
+        columns = eval(code, namespace, {'x': X.T, 'u': U.T})
+        F = np.empty((len(X), len(columns)))
+        for i, column in enumerate(columns):
+            F[:, i] = column
+        return F
+
+    return f
 
 #Environment for linear systems
 class Environment:
@@ -11,7 +77,7 @@ class Environment:
                     unsafe=False, unsafe_property=None, multi_boundary=False,
                     bad_reward=-900, terminal_err=0, terminalf=None,
                     unsafe_A=None, unsafe_b=None, ev_min=None, ev_max=None,
-                    ev_func=None):
+                    ev_func=None, discretization='euler'):
 
         # State transform matrix
         self.A = A
@@ -35,6 +101,8 @@ class Environment:
 
         self.state_dim = len(s_min)
         assert len(s_min) == len(s_max)
+        # The unsafe polytopes as one stacked system of halfspaces
+        self.unsafe_set = unsafe_union(unsafe_A, unsafe_b, self.state_dim)
         if x_min is not None and x_max is not None:
             assert len(x_min) == len(x_max)
 
@@ -54,6 +122,11 @@ class Environment:
         # Time step
         self.timestep = timestep
 
+        # How continuous systems are turned into discrete transitions,
+        # either 'euler' or 'zoh' (exact for piecewise constant actions)
+        self.discretization = discretization
+        self.discretize()
+
         # reward function
         self.rewardf = rewardf
 
@@ -86,6 +159,39 @@ class Environment:
                   for i in range(len(self.ev_min))])
         return self.xk
 
+    def discretize(self):
+        """Precompute the transition x' = Ad x + Bd u + Cd c of this system.
+
+        Continuous systems dx/dt = A x + B u + c are discretized with the
+        time step, by forward Euler (Ad = I + dt A, Bd = dt B, Cd = dt I) or
+        by a zero order hold, using pympc. For discrete systems Ad = A,
+        Bd = B and the constant offset c is ignored, as it always was.
+        This must be called again after changing A, B or timestep.
+        """
+        A = np.asarray(self.A, dtype=np.float64)
+        B = np.asarray(self.B, dtype=np.float64)
+        n = A.shape[0]
+        if not self.continuous:
+            Ad, Bd, Cd = A, B, np.zeros((n, n))
+        elif self.discretization == 'euler':
+            Ad = np.eye(n) + self.timestep * A
+            Bd = self.timestep * B
+            Cd = self.timestep * np.eye(n)
+        elif self.discretization == 'zoh':
+            from pympc.dynamics.discretization_methods import zero_order_hold
+            # Discretizing the inputs together with an identity input gives
+            # the map of the constant offset as well
+            Ad, BCd, _ = zero_order_hold(A, np.hstack((B, np.eye(n))),
+                    np.zeros((n, 1)), self.timestep)
+            Bd = BCd[:, :B.shape[1]]
+            Cd = BCd[:, B.shape[1]:]
+        else:
+            raise ValueError("Unknown discretization: " +
+                    str(self.discretization))
+        self.Ad = np.matrix(Ad)
+        self.Bd = np.matrix(Bd)
+        self.Cd = np.matrix(Cd)
+
     def reward(self, x, u):
         # reward
         if self.rewardf:
@@ -99,10 +205,6 @@ class Environment:
 
     def step(self, uk, coffset=None, safe=True):
         #uk = np.array([[0]])
-        def f(x, u):
-            return self.A.dot(x.reshape([self.state_dim, 1])) + \
-                    self.B.dot(u.reshape([self.action_dim, 1]))
-
         self.last_u = uk
 
         #if (uk > self.u_max).all():
@@ -110,12 +212,11 @@ class Environment:
         #elif (uk < self.u_min).all():
         #    uk = self.u_min
 
-        if self.continuous:
-            self.xk = self.xk + self.timestep * f(self.xk, uk) \
-              if coffset is None \
-              else self.xk + self.timestep * (f(self.xk, uk) + coffset)
-        else:
-            self.xk = f(self.xk, uk)
+        self.xk = self.Ad.dot(self.xk.reshape([self.state_dim, 1])) + \
+                self.Bd.dot(uk.reshape([self.action_dim, 1]))
+        if self.continuous and coffset is not None:
+            self.xk = self.xk + self.Cd.dot(np.broadcast_to(coffset,
+                (self.state_dim, 1)))
 
         if self.ev_func is not None:
             self.extra_vars = self.ev_func(self.xk, uk, self.extra_vars)
@@ -134,10 +235,9 @@ class Environment:
                 terminal = self.terminalf(xk, self.extra_vars)
             else:
                 terminal = self.terminalf(xk)
-        if not safe and self.unsafe_A is not None and self.unsafe_b is not None:
-            for (A, b) in zip(self.unsafe_A, self.unsafe_b):
-                if (A * xk <= b).all():
-                    return xk, self.bad_reward, True
+        if not safe and self.unsafe_set is not None and \
+                self.unsafe_set.any(xk.T)[0]:
+            return xk, self.bad_reward, True
         if self.x_max is None and self.x_min is None:
             return xk, reward, terminal
         if not safe and not ((xk < self.x_max).any() and (xk > self.x_min).any()):
@@ -173,23 +273,343 @@ class Environment:
         return xk, reward, terminal
 
     def simulation(self, uk, coffset=None):
-        def f(x, u):
-            return self.A.dot(x) + self.B.dot(u)
-
         if (uk > self.u_max).all():
             uk = self.u_max
         elif (uk < self.u_min).all():
             uk = self.u_min
 
-        if self.continuous:
-            xk = self.xk + self.timestep * (f(self.xk, uk)) \
-                if coffset is None \
-                else self.xk + self.timestep * (f(self.xk, uk) + coffset)
-        else:
-            xk = f(self.xk, uk)
+        xk = self.Ad.dot(self.xk) + self.Bd.dot(uk)
+        if self.continuous and coffset is not None:
+            xk = xk + self.Cd.dot(np.broadcast_to(coffset,
+                (self.state_dim, 1)))
 
         return xk
 
+    def reset_batch(self, n, random_state=None):
+        """Sample n initial states (and extra variables) as array rows."""
+        X = sample_box(self.s_min, self.s_max, n, random_state)
+        E = sample_box(self.ev_min, self.ev_max, n, random_state) \
+                if self.ev_min is not None else None
+        return X, E
+
+    def transition(self, X, U, coffset=None):
+        """Successors of the states in the rows of X under the actions in U."""
+        F = X.dot(np.asarray(self.Ad).T) + U.dot(np.asarray(self.Bd).T)
+        if self.continuous and coffset is not None:
+            F = F + np.asarray(self.Cd).dot(np.broadcast_to(
+                np.ravel(coffset), (self.state_dim,)))
+        return F
+
+    def extra_vars_batch(self, X, U, E):
+        """Apply ev_func to each row of X, U and E."""
+        E = np.array(E)
+        for i in range(len(X)):
+            E[i] = np.ravel(self.ev_func(np.matrix(X[i]).T,
+                U[i].reshape([self.action_dim, 1]), np.matrix(E[i]).T))
+        return E
+
+    def reward_weights(self):
+        """The weights of |x| and |u| in the default reward.
+
+        The default reward is linear in |x| and |u|, whether Q and R are
+        matrices or arrays, so the weights are read off by evaluating it on
+        the unit vectors.
+        """
+        q_weights = np.array([np.sum(self.Q * np.eye(self.state_dim)[:, [i]])
+            for i in range(self.state_dim)])
+        r_weights = np.array([np.sum(self.R * np.eye(self.action_dim)[:, [i]])
+            for i in range(self.action_dim)])
+        return q_weights, r_weights
+
+    def reward_batch(self, X, U, E=None):
+        """Rewards for the rows of X and U, see reward()."""
+        if not self.rewardf:
+            q_weights, r_weights = self.reward_weights()
+            return -(np.abs(X).dot(q_weights) + np.abs(U).dot(r_weights))
+        rewards = np.empty(len(X))
+        for i in range(len(X)):
+            x = np.matrix(X[i]).T
+            u = U[i].reshape([self.action_dim, 1])
+            if self.rewardf and self.ev_min is not None:
+                r = self.rewardf(x, u, np.matrix(E[i]).T)
+            else:
+                r = self.reward(x, u)
+            rewards[i] = np.asarray(r).item()
+        return rewards
+
+    def unsafe_batch(self, X):
+        """Find which rows of X are inside the unsafe polytopes."""
+        if self.unsafe_set is None:
+            return np.zeros(len(X), dtype=bool)
+        return self.unsafe_set.any(X)
+
+    def observation_batch(self, X, U, E=None, safe=True):
+        """Rewards and terminal flags for the rows of X, see observation().
+
+        Args:
+            X (np.array): states, one per row
+            U (np.array): the actions which led to X, one per row
+            E (np.array): extra variables, one row per state
+            safe (bool): as in observation()
+
+        Returns:
+            (np.array, np.array): rewards and boolean terminal flags
+        """
+        rewards = self.reward_batch(X, U, E)
+        terminals = np.zeros(len(X), dtype=bool)
+        if self.terminalf is not None:
+            for i in range(len(X)):
+                x = np.matrix(X[i]).T
+                if self.ev_min is not None:
+                    terminals[i] = self.terminalf(x, np.matrix(E[i]).T)
+                else:
+                    terminals[i] = self.terminalf(x)
+        # States which end the episode with the bad reward
+        bad = np.zeros(len(X), dtype=bool)
+        if not safe:
+            bad |= self.unsafe_batch(X)
+        if self.x_max is None and self.x_min is None:
+            rewards[bad] = self.bad_reward
+            terminals[bad] = True
+            return rewards, terminals
+
+        # Compare each state against every column of the bounds as
+        # observation() does for a single state
+        below_max = X[:, :, None] < np.asarray(self.x_max)
+        above_min = X[:, :, None] > np.asarray(self.x_min)
+        if not safe:
+            bad |= ~(below_max.any(axis=(1, 2)) & above_min.any(axis=(1, 2)))
+
+        if self.terminalf is None:
+            if not self.unsafe:
+                # Bad Terminal
+                out = ~(below_max & above_min).all(axis=(1, 2))
+                terminals |= out
+                rewards[out] = self.bad_reward
+                # Good Terminal
+                terminals |= np.abs(rewards) < self.terminal_err
+            else:
+                # Bad Terminal
+                if self.multi_boundary:
+                    inside = (below_max & above_min).all(axis=2).any(axis=1)
+                else:
+                    inside = (below_max & above_min).all(axis=(1, 2))
+                terminals |= inside
+                rewards[inside] = self.bad_reward
+                # Good Terminal
+                good = np.abs(rewards) < self.terminal_err
+                for _ in range(np.count_nonzero(good)):
+                    print("good terminal")
+                terminals |= good
+
+        rewards[bad] = self.bad_reward
+        terminals[bad] = True
+        return rewards, terminals
+
+
+#Allocation-free view of a linear Environment
+class FastEnvironment(object):
+    '''
+      A lean stepping mode for a linear Environment. The dynamics are
+      the update x' = Ad x + Bd u precomputed by the environment, see
+      Environment.discretize(), the default reward is
+      reduced to two weight vectors and every intermediate result is written
+      into preallocated buffers.
+
+      States are (state_dim, 1) arrays rather than matrices. The simulation
+      alternates between two internal state buffers, and reset() and step()
+      return copies of them, so returned states may be kept. The xk
+      attribute is the current buffer itself, and assigning to it copies
+      the assigned state into that buffer.
+      Custom reward, terminal and extra variable functions are still called
+      for every step, with matrix views of the buffers. All other attributes
+      and methods, including the batched ones, are those of the wrapped
+      environment.
+    '''
+    __slots__ = ('env', 'Ad', 'Bd', 'Cd', 'q_weights', 'r_weights', 'states',
+                 'flat_states', 'matrix_states', 'current', 'last_u', 'extra_vars',
+                 'Bu', 'abs_x', 'abs_u', 'below_max', 'above_min',
+                 'inside', 'unsafe_set', 'unsafe_offsets', 'unsafe_Ax',
+                 'unsafe_violated', 'unsafe_outside')
+
+    def __init__(self, env):
+        self.env = env
+        d = env.state_dim
+        m = env.action_dim
+        self.Ad = np.asarray(env.Ad)
+        self.Bd = np.asarray(env.Bd)
+        self.Cd = np.asarray(env.Cd)
+
+        if env.rewardf is None:
+            self.q_weights, self.r_weights = env.reward_weights()
+        else:
+            self.q_weights = None
+            self.r_weights = None
+
+        self.states = [np.zeros((d, 1)), np.zeros((d, 1))]
+        self.flat_states = [x.reshape(d) for x in self.states]
+        # Views passed to the custom functions, which expect matrices
+        self.matrix_states = [np.asmatrix(x) for x in self.states]
+        self.current = 0
+        self.Bu = np.zeros((d, 1))
+        self.abs_x = np.zeros(d)
+        self.abs_u = np.zeros(m)
+
+        if env.x_max is not None and env.x_min is not None:
+            shape = np.broadcast(self.states[0], np.asarray(env.x_max)).shape
+            self.below_max = np.zeros(shape, dtype=bool)
+            self.above_min = np.zeros(shape, dtype=bool)
+            self.inside = np.zeros(shape, dtype=bool)
+        else:
+            self.below_max = None
+            self.above_min = None
+            self.inside = None
+
+        self.unsafe_set = env.unsafe_set
+        if self.unsafe_set is not None:
+            constrained = ~self.unsafe_set.unconstrained
+            self.unsafe_offsets = self.unsafe_set.offsets[constrained]
+            self.unsafe_Ax = np.zeros(len(self.unsafe_set.b))
+            self.unsafe_violated = np.zeros(len(self.unsafe_set.b), dtype=bool)
+            self.unsafe_outside = np.zeros(len(self.unsafe_offsets), dtype=bool)
+
+        self.reset()
+
+    def is_unsafe(self):
+        """Decide whether the current state is in an unsafe polytope."""
+        unsafe_set = self.unsafe_set
+        if unsafe_set.unconstrained.any():
+            return True
+        if len(self.unsafe_offsets) == 0:
+            return False
+        np.dot(unsafe_set.A, self.flat_states[self.current], out=self.unsafe_Ax)
+        np.greater(self.unsafe_Ax, unsafe_set.b, out=self.unsafe_violated)
+        np.logical_or.reduceat(self.unsafe_violated, self.unsafe_offsets,
+                out=self.unsafe_outside)
+        return not self.unsafe_outside.all()
+
+    def __getattr__(self, name):
+        # Only reached for names which are not slots of this class
+        if name == 'env':
+            raise AttributeError(name)
+        return getattr(self.env, name)
+
+    @property
+    def xk(self):
+        return self.states[self.current]
+
+    @xk.setter
+    def xk(self, value):
+        self.flat_states[self.current][:] = np.ravel(value)
+
+    @property
+    def terminal_err(self):
+        return self.env.terminal_err
+
+    @terminal_err.setter
+    def terminal_err(self, value):
+        self.env.terminal_err = value
+
+    def reset(self, x0=None):
+        env = self.env
+        self.current = 0
+        if x0 is None:
+            # sample an initial condition for system
+            self.flat_states[0][:] = np.random.uniform(
+                    np.asarray(env.s_min)[:, 0], np.asarray(env.s_max)[:, 0])
+        else:
+            self.flat_states[0][:] = np.ravel(x0)
+        self.last_u = np.zeros((1, env.action_dim))
+        if env.ev_min is not None:
+            self.extra_vars = np.matrix(np.random.uniform(
+                np.asarray(env.ev_min)[:, 0],
+                np.asarray(env.ev_max)[:, 0])).T
+        else:
+            self.extra_vars = None
+        return self.xk.copy()
+
+    def reward(self, x, u):
+        env = self.env
+        if env.rewardf:
+            x = self.matrix_states[self.current] if x is self.xk \
+                    else np.asmatrix(x)
+            if env.ev_min is not None:
+                return env.rewardf(x, u, self.extra_vars)
+            else:
+                return env.rewardf(x, u)
+        np.abs(np.ravel(x), out=self.abs_x)
+        np.abs(np.ravel(u), out=self.abs_u)
+        return -(self.q_weights.dot(self.abs_x) +
+                self.r_weights.dot(self.abs_u))
+
+    def step(self, uk, coffset=None, safe=True):
+        env = self.env
+        self.last_u = uk
+        u = np.reshape(uk, (env.action_dim, 1))
+
+        nxt = 1 - self.current
+        x = self.states[nxt]
+        np.dot(self.Ad, self.xk, out=x)
+        np.dot(self.Bd, u, out=self.Bu)
+        x += self.Bu
+        if env.continuous and coffset is not None:
+            x += self.Cd.dot(np.broadcast_to(coffset, (env.state_dim, 1)))
+        self.current = nxt
+
+        if env.ev_func is not None:
+            self.extra_vars = env.ev_func(self.matrix_states[nxt], uk,
+                    self.extra_vars)
+
+        return self.observation(safe=safe)
+
+    def observation(self, safe=True):
+        env = self.env
+        xk = self.xk
+        reward = self.reward(xk, self.last_u)
+        terminal = False
+        if env.terminalf is not None:
+            if env.ev_min is not None:
+                terminal = env.terminalf(self.matrix_states[self.current],
+                        self.extra_vars)
+            else:
+                terminal = env.terminalf(self.matrix_states[self.current])
+        if not safe and self.unsafe_set is not None and self.is_unsafe():
+            return xk.copy(), env.bad_reward, True
+        if self.inside is None:
+            return xk.copy(), reward, terminal
+        below_max = np.less(xk, env.x_max, out=self.below_max)
+        above_min = np.greater(xk, env.x_min, out=self.above_min)
+        if not safe and not (below_max.any() and above_min.any()):
+            return xk.copy(), env.bad_reward, True
+
+        if env.terminalf is None:
+            if not env.unsafe:
+                # Bad Terminal
+                if not (below_max.all() and above_min.all()):
+                    terminal = True
+                    reward = env.bad_reward
+                # Good Terminal
+                if np.abs(reward) < env.terminal_err:
+                    terminal = True
+            else:
+                # Bad Terminal
+                inside = np.logical_and(below_max, above_min,
+                        out=self.inside)
+                if env.multi_boundary:
+                    if inside.all(axis=1).any():
+                        terminal = True
+                        reward = env.bad_reward
+                else:
+                    if inside.all():
+                        terminal = True
+                        reward = env.bad_reward
+                # Good Terminal
+                if np.abs(reward) < env.terminal_err:
+                    print("good terminal")
+                    terminal = True
+
+        return xk.copy(), reward, terminal
+
 
 #Environment for Polynomial Systems
 class PolySysEnvironment:
@@ -205,10 +625,13 @@ class PolySysEnvironment:
                   terminal_err=0, capsule=None, unsafe_A=None, unsafe_b=None,
                   approx=False, breaks=None, break_breaks=None, lower_As=None,
                   lower_Bs=None, upper_As=None, upper_Bs=None,
-                  terminalf=None):
+                  terminalf=None, batch_polyf=None):
 
         # system dynamics:
         self.polyf = polyf
+        self.batch_polyf = None
+        if batch_polyf is not None:
+            self.register_dynamics(batch_polyf)
         self.polyf_to_str = polyf_to_str
         # reward function:
         self.rewardf = rewardf
@@ -251,6 +674,8 @@ class PolySysEnvironment:
         self.capsule = capsule
         self.unsafe_A = unsafe_A
         self.unsafe_b = unsafe_b
+        # The unsafe polytopes as one stacked system of halfspaces
+        self.unsafe_set = unsafe_union(unsafe_A, unsafe_b, state_dim)
 
         self.approx = approx
         self.breaks = breaks
@@ -266,6 +691,26 @@ class PolySysEnvironment:
         # sample an initial condition for system
         self.reset()
 
+    def register_dynamics(self, batch_polyf):
+        """Use a vectorized form of the dynamics for batches of states.
+
+        Args:
+            batch_polyf (function): f(X, U) computing the same dynamics as
+                polyf for states X and actions U given one per row, and
+                returning an array of shape (N, state_dim). It may also be
+                made from expressions with compile_dynamics().
+
+        Without a registered function transition() calls polyf once per row.
+        If the environment was built without polyf, single steps use
+        batch_polyf as well.
+        """
+        self.batch_polyf = batch_polyf
+        if self.polyf is None:
+            def polyf(x, u):
+                return np.matrix(batch_polyf(np.asarray(x).reshape(1, -1),
+                    np.asarray(u).reshape(1, -1))).T
+            self.polyf = polyf
+
     def reset(self, x0=None):
         if x0 is None:
             # sample an initial condition for system
@@ -317,13 +762,75 @@ class PolySysEnvironment:
             terminal = True
         if self.terminalf is not None and self.terminalf(xk):
             terminal = True
-        if not safe and self.unsafe_A is not None and self.unsafe_b is not None:
-            for (A, b) in zip(self.unsafe_A, self.unsafe_b):
-                if (A * xk <= b).all():
-                    return xk, self.bad_reward, True
+        if not safe and self.unsafe_set is not None and \
+                self.unsafe_set.any(xk.T)[0]:
+            return xk, self.bad_reward, True
 
         return xk, reward, terminal
 
+    def reset_batch(self, n, random_state=None):
+        """Sample n initial states as array rows."""
+        return sample_box(self.s_min, self.s_max, n, random_state), None
+
+    def transition(self, X, U, coffset=None):
+        """Successors of the states in the rows of X under the actions in U."""
+        if self.batch_polyf is not None:
+            F = np.asarray(self.batch_polyf(X, U.reshape(len(X),
+                self.action_dim)), dtype=np.float64).reshape(X.shape)
+        else:
+            F = np.empty_like(X, dtype=np.float64)
+            for i in range(len(X)):
+                F[i] = np.ravel(self.polyf(np.matrix(X[i]).T,
+                    U[i].reshape([self.action_dim, 1])))
+        if self.continuous:
+            if coffset is not None:
+                F = F + np.ravel(coffset)
+            return X + self.timestep * F
+        return F
+
+    def reward_batch(self, X, U, E=None):
+        """Rewards for the rows of X and U, see reward()."""
+        rewards = np.empty(len(X))
+        for i in range(len(X)):
+            rewards[i] = np.asarray(self.reward(np.matrix(X[i]).T,
+                U[i].reshape([self.action_dim, 1]))).item()
+        return rewards
+
+    def unsafe_batch(self, X):
+        """Find which rows of X are inside the unsafe polytopes."""
+        if self.unsafe_set is None:
+            return np.zeros(len(X), dtype=bool)
+        return self.unsafe_set.any(X)
+
+    def observation_batch(self, X, U, E=None, safe=True):
+        """Rewards and terminal flags for the rows of X, see observation().
+
+        Args:
+            X (np.array): states, one per row
+            U (np.array): the actions which led to X, one per row
+            E (np.array): unused, present for symmetry with Environment
+            safe (bool): as in observation()
+
+        Returns:
+            (np.array, np.array): rewards and boolean terminal flags
+        """
+        rewards = self.reward_batch(X, U)
+        terminals = np.zeros(len(X), dtype=bool)
+        for i in range(len(X)):
+            x = np.matrix(X[i]).T
+            if self.testf(x, U[i].reshape([self.action_dim, 1])) < 0:
+                terminals[i] = True
+                rewards[i] = self.bad_reward
+            if self.terminalf is not None and self.terminalf(x):
+                terminals[i] = True
+        terminals |= np.abs(rewards) < self.terminal_err
+        if not safe:
+            bad = self.unsafe_batch(X)
+            rewards[bad] = self.bad_reward
+            terminals[bad] = True
+
+        return rewards, terminals
+
     def simulation(self, uk, coffset=None):
         f = self.polyf
 
@@ -335,3 +842,83 @@ class PolySysEnvironment:
             xk = f(self.xk, uk)
 
         return xk
+
+
+#Several copies of an environment stepped together
+class VectorEnvironment:
+    '''
+      Steps num_envs independent copies of an Environment or
+      PolySysEnvironment at once. The states are the rows of one
+      (num_envs, state_dim) array and are advanced by a single call to the
+      batched dynamics of the wrapped environment. If auto_reset is set,
+      members which reach a terminal state are reset after each step.
+      Initial states are drawn from random_state if it is given.
+    '''
+    def __init__(self, env, num_envs, auto_reset=True, random_state=None):
+        self.env = env
+        self.num_envs = num_envs
+        self.auto_reset = auto_reset
+        self.random_state = random_state
+        self.state_dim = env.state_dim
+        self.action_dim = env.action_dim
+        self.bad_reward = env.bad_reward
+
+        self.reset()
+
+    def reset(self, mask=None):
+        """Reset every member, or only those where mask is True.
+
+        Returns:
+            np.array: the current states, one per row
+        """
+        if mask is None:
+            self.xk, self.extra_vars = self.env.reset_batch(self.num_envs,
+                    self.random_state)
+            self.last_u = np.zeros((self.num_envs, self.action_dim))
+            return self.xk
+
+        idx = np.flatnonzero(mask)
+        if len(idx) > 0:
+            X, E = self.env.reset_batch(len(idx), self.random_state)
+            self.xk[idx] = X
+            if E is not None:
+                self.extra_vars[idx] = E
+            self.last_u[idx] = 0
+        return self.xk
+
+    def step(self, U, coffset=None, safe=True):
+        """Apply one action to each member.
+
+        Args:
+            U (np.array): actions, one row per member
+            coffset (np.array): constant offset of continuous dynamics
+            safe (bool): as in Environment.step()
+
+        Returns:
+            (np.array, np.array, np.array): the successor states, rewards and
+            terminal flags of every member. Members which are reset
+            afterwards are still reported with the state they ended in.
+        """
+        U = np.reshape(U, (self.num_envs, self.action_dim))
+        self.last_u = U
+
+        X = self.env.transition(self.xk, U, coffset)
+        if self.extra_vars is not None and self.env.ev_func is not None:
+            self.extra_vars = self.env.extra_vars_batch(X, U, self.extra_vars)
+
+        rewards, terminals = self.env.observation_batch(X, U,
+                self.extra_vars, safe=safe)
+
+        self.xk = np.array(X)
+        if self.auto_reset:
+            self.reset(terminals)
+        return X, rewards, terminals
+
+    def observation(self, safe=True):
+        """Rewards and terminal flags of the current states."""
+        return self.env.observation_batch(self.xk, self.last_u,
+                self.extra_vars, safe=safe)
+
+    def unsafe(self):
+        """Find which members are currently inside an unsafe polytope."""
+        return self.env.unsafe_batch(self.xk)
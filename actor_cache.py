@@ -0,0 +1,124 @@
+import collections
+import threading
+
+import numpy as np
+
+class ActorCache(object):
+    """
+    Memoizes the actions of an actor at quantized states.
+
+    States are snapped to a grid with the given resolution, and the actor is
+    evaluated at the center of each grid cell the first time a state in that
+    cell is queried. Later queries in the same cell are answered from the
+    cache, so the result is exact up to the change of the actor within one
+    cell: for an actor with Lipschitz constant L on d dimensional states it
+    is off by at most L * resolution * sqrt(d) / 2. At most max_entries
+    cells are kept, evicting the least recently used one.
+
+    The cache is cleared whenever the weights_version of the actor changes,
+    see ActorNetwork.set_numpy_weights(). It can be used wherever the actor
+    is, since other attributes are those of the actor. Queries may come from
+    several threads, such as the measure callbacks of shield synthesis.
+    """
+
+    def __init__(self, actor, resolution=1e-3, max_entries=100000):
+        """
+        Arguments:
+            actor (ActorNetwork): the actor to cache
+            resolution (float): the side length of a grid cell
+            max_entries (int): the number of cells to keep
+        """
+        self.actor = actor
+        self.resolution = resolution
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.version = getattr(actor, 'weights_version', None)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Only reached for names which are not attributes of the cache
+        if name == 'actor':
+            raise AttributeError(name)
+        return getattr(self.actor, name)
+
+    @property
+    def numpy_batch_size(self):
+        return self.actor.numpy_batch_size
+
+    @numpy_batch_size.setter
+    def numpy_batch_size(self, value):
+        self.actor.numpy_batch_size = value
+
+    def predict(self, inputs):
+        """The cached actions for the states in the rows of inputs.
+
+        The lock is only held to look up and insert cells. Missing cells are
+        evaluated with the lock released, so that threads missing at the
+        same time query the actor concurrently. A cell filled by two threads
+        gets the same action from both, since it is that of the cell center.
+        """
+        cells = np.floor(np.asarray(inputs, dtype=np.float64) /
+                self.resolution + 0.5).astype(np.int64)
+        cells = cells.reshape(len(cells), -1)
+        keys = [cell.tobytes() for cell in cells]
+        outputs = [None] * len(keys)
+        missing = {}
+        with self.lock:
+            version = getattr(self.actor, 'weights_version', None)
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            if len(keys) == 1:
+                # Fast path for the common query of a single state
+                output = self.entries.get(keys[0])
+                if output is not None:
+                    self.entries.move_to_end(keys[0])
+                    self.hits += 1
+                    return output[np.newaxis]
+            for (i, key) in enumerate(keys):
+                output = self.entries.get(key)
+                if output is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self.entries.move_to_end(key)
+                    outputs[i] = output
+            misses = sum(len(rows) for rows in missing.values())
+            self.hits += len(keys) - misses
+            self.misses += misses
+
+        if missing:
+            rows = [rows[0] for rows in missing.values()]
+            actions = self.actor.predict(cells[rows] * self.resolution)
+            for (key, action) in zip(missing, actions):
+                for i in missing[key]:
+                    outputs[i] = action
+            with self.lock:
+                # Actions of weights which have since changed are not kept
+                if (self.version == version and version ==
+                        getattr(self.actor, 'weights_version', None)):
+                    for (key, action) in zip(missing, actions):
+                        self.entries[key] = action
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+        return np.array(outputs)
+
+    def invalidate(self):
+        """Forget every cached action."""
+        with self.lock:
+            self.entries.clear()
+
+    def get_metrics(self):
+        """
+        Returns:
+            dict: the number of hits and misses, the hit rate and the number
+            of cached cells
+        """
+        queries = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / queries if queries > 0 else 0.0,
+            'entries': len(self.entries),
+        }
@@ -32,6 +32,10 @@ def acc(learning_method, number_of_rollouts, simulation_steps,
                           [u[0,0] - lead_a],
                           [0.0]])
 
+    def f_batch(X, U):
+        lead_a = np.clip(np.random.normal(0, 1, len(X)), a_min, a_max)
+        return np.stack((X[:,1], U[:,0] - lead_a, np.zeros(len(X))), axis=1)
+
     def f_to_str(K):
         raise NotImplementedError
 
@@ -75,7 +79,7 @@ def acc(learning_method, number_of_rollouts, simulation_steps,
             break_breaks=break_breaks,
             lower_As=[lower_A], lower_Bs=[B],
             upper_As=[upper_A], upper_Bs=[B],
-            terminalf=terminalf);
+            terminalf=terminalf, batch_polyf=f_batch);
 
     if retrain_nn:
         args = { 'actor_lr': 0.0001,    # [240, 200]
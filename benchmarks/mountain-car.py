@@ -21,6 +21,10 @@ def car(learning_method, number_of_rollouts, simulation_steps,
     def f(x, u):
         return np.matrix([[x[1,0]], [0.001 * u[0,0] - 0.0025 * np.cos(3 * x[0,0])]])
 
+    def f_batch(X, U):
+        return np.stack((X[:,1], 0.001 * U[:,0] - 0.0025 * np.cos(3 * X[:,0])),
+                axis=1)
+
     def f_to_str(K):
         kstr = K_to_str(K)
         f = []
@@ -73,7 +77,8 @@ def car(learning_method, number_of_rollouts, simulation_steps,
             u_min=u_min, u_max=u_max, timestep=1.0, terminalf=terminalf,
             unsafe_A=uA, unsafe_b=ub, approx=True, breaks=breaks,
             break_breaks=break_breaks,
-            lower_As=lower_As, lower_Bs=Bs, upper_As=upper_As, upper_Bs=Bs)
+            lower_As=lower_As, lower_Bs=Bs, upper_As=upper_As, upper_Bs=Bs,
+            batch_polyf=f_batch)
 
     if retrain_nn:
         args = { 'actor_lr': 0.0001,
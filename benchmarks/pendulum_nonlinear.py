@@ -5,7 +5,7 @@ import numpy as np
 from DDPG import *
 from main import *
 import os.path
-from Environment import Environment, PolySysEnvironment
+from Environment import Environment, PolySysEnvironment, compile_dynamics
 from shield import Shield
 import argparse
 
@@ -34,6 +34,10 @@ def pendulum(learning_method, number_of_rollouts, simulation_steps,
                           [t * u[0,0] - 9.81 / l * np.sin(x[0,0])],
                           [0.0]])
 
+    # The same dynamics for a batch of states, one per row
+    f_batch = compile_dynamics(["x[1]", "t * u[0] - 9.81 / l * sin(x[0])",
+        "0.0"], {'t': t, 'l': l})
+
     def f_to_str(K):
         raise NotImplementedError
 
@@ -77,7 +81,8 @@ def pendulum(learning_method, number_of_rollouts, simulation_steps,
             u_min=u_min, u_max=u_max, timestep=0.01,
             unsafe_A=uA, unsafe_b=ub, approx=True, breaks=breaks,
             break_breaks=break_breaks,
-            lower_As=lower_As, lower_Bs=Bs, upper_As=upper_As, upper_Bs=Bs)
+            lower_As=lower_As, lower_Bs=Bs, upper_As=upper_As, upper_Bs=Bs,
+            batch_polyf=f_batch)
 
     if retrain_nn:
         args = { 'actor_lr': 0.0001,
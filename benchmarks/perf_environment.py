@@ -0,0 +1,97 @@
+import sys
+sys.path.append(".")
+
+import numpy as np
+from Environment import Environment, FastEnvironment
+import argparse
+import time
+
+# Microbenchmark comparing Environment.step against FastEnvironment.step on
+# the linear dynamics of car-racing.py, with and without its custom reward,
+# terminal and extra variable functions. Run from the repository root:
+#
+#     python benchmarks/perf_environment.py --steps 100000
+
+def car_racing(custom):
+    A = 0.1 * np.matrix([[0.0, 0.0, 10.0,  0.0, 0.0],
+                   [0.0, 0.0,  0.0, 10.0, 0.0],
+                   [0.0, 0.0,  0.0,  0.0, 0.0],
+                   [0.0, 0.0,  0.0,  0.0, 0.0],
+                   [0.0, 0.0,  0.0,  0.0, 0.0]])
+    B = 0.2 * np.matrix([[0.0, 0.0], [0.0, 0.0], [10.0, 0.0], [0.0, 10.0],
+        [0.0, 0.0]])
+
+    s_min = np.array([[0.0], [0.0], [0.0], [0.0], [1.0]])
+    s_max = np.array([[0.0], [0.0], [0.0], [0.0], [1.0]])
+    x_min = np.array([[-100.0], [-100.0], [-100.0], [-100.0], [0.0]])
+    x_max = np.array([[ 100.0], [ 100.0], [ 100.0], [ 100.0], [2.0]])
+    u_min = np.array([[-2.0], [-2.0]])
+    u_max = np.array([[ 5.0], [ 5.0]])
+
+    unsafe_A = [np.matrix([[ 1.0,  0.0, 0.0, 0.0, 0.0],
+                           [-1.0,  0.0, 0.0, 0.0, 0.0],
+                           [ 0.0,  1.0, 0.0, 0.0, 0.0],
+                           [ 0.0, -1.0, 0.0, 0.0, 0.0]])]
+    unsafe_b = [np.matrix([[2.0], [-1.0], [2.0], [-1.0]])]
+
+    Q = np.zeros((5, 5), float)
+    np.fill_diagonal(Q, 1)
+    R = np.zeros((2, 2), float)
+    np.fill_diagonal(R, 1)
+
+    if not custom:
+        return Environment(A, B, u_min, u_max, s_min, s_max, x_min, x_max,
+                Q, R, continuous=True, unsafe_A=unsafe_A, unsafe_b=unsafe_b)
+
+    x_goal = 3.0
+    y_goal = 3.0
+
+    def rewardf(x, u, extra_vars):
+        if extra_vars[0,0] <= 0.5:
+            return -(x_goal + y_goal + abs(x[0,0] - x_goal) +
+                    abs(x[1,0] - y_goal))
+        else:
+            return -(abs(x[0,0]) + abs(x[1,0]))
+
+    def terminalf(x, extra_vars):
+        return x[0,0] <= 0 and x[1,0] <= 0 and extra_vars[0,0] >= 0.5
+
+    def ev_func(x, u, extra_vars):
+        if x[0,0] >= x_goal and x[1,0] >= y_goal:
+            extra_vars[0,0] = 1.0
+        return extra_vars
+
+    return Environment(A, B, u_min, u_max, s_min, s_max, x_min, x_max, Q, R,
+            continuous=True, rewardf=rewardf, unsafe_A=unsafe_A,
+            unsafe_b=unsafe_b, terminalf=terminalf,
+            ev_min=np.array([[0.0]]), ev_max=np.array([[0.0]]),
+            ev_func=ev_func)
+
+
+def run(env, actions, safe):
+    env.reset()
+    start = time.time()
+    for u in actions:
+        _, _, terminal = env.step(u, safe=safe)
+        if terminal:
+            env.reset()
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Environment microbenchmark')
+    parser.add_argument('--steps', action="store", dest="steps", type=int)
+    parser_res = parser.parse_args()
+    steps = parser_res.steps if parser_res.steps is not None else 100000
+
+    actions = [np.random.uniform(-1.0, 1.0, size=(2, 1))
+            for _ in range(steps)]
+
+    for custom in (False, True):
+        for safe in (True, False):
+            for name, env in (("Environment", car_racing(custom)),
+                    ("FastEnvironment", FastEnvironment(car_racing(custom)))):
+                t = run(env, actions, safe)
+                print('| {:16s} | custom reward: {:5s} | safe: {:5s} | '
+                        '{:10.0f} steps/s |'.format(name, str(custom),
+                            str(safe), steps / t))
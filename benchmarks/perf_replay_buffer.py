@@ -0,0 +1,95 @@
+import sys
+sys.path.append(".")
+
+import numpy as np
+from DDPG import ReplayBuffer
+from collections import deque
+import argparse
+import random
+import time
+
+# Microbenchmark comparing the array-backed ReplayBuffer against the original
+# deque-of-tuples implementation. Run from the repository root:
+#
+#     python benchmarks/perf_replay_buffer.py --fill 100000 --samples 1000
+
+class DequeReplayBuffer(object):
+    """The original replay buffer, kept here as a point of comparison."""
+
+    def __init__(self, buffer_size):
+        self.buffer_size = buffer_size
+        self.count = 0
+        self.buffer = deque()
+
+    def add(self, s, a, r, t, s2):
+        experience = (s, a, r, t, s2)
+        if self.count < self.buffer_size:
+            self.buffer.append(experience)
+            self.count += 1
+        else:
+            self.buffer.popleft()
+            self.buffer.append(experience)
+
+    def size(self):
+        return self.count
+
+    def sample_batch(self, batch_size):
+        if self.count < batch_size:
+            batch = random.sample(self.buffer, self.count)
+        else:
+            batch = random.sample(self.buffer, batch_size)
+
+        s_batch = np.array([_[0] for _ in batch])
+        a_batch = np.array([_[1] for _ in batch])
+        r_batch = np.array([_[2] for _ in batch])
+        t_batch = np.array([_[3] for _ in batch])
+        s2_batch = np.array([_[4] for _ in batch])
+
+        return s_batch, a_batch, r_batch, t_batch, s2_batch
+
+    def clear(self):
+        self.buffer.clear()
+        self.count = 0
+
+
+def run(buf, states, actions, rewards, samples, minibatch_size):
+    start = time.time()
+    for i in range(len(states) - 1):
+        buf.add(states[i], actions[i], rewards[i], False, states[i+1])
+    fill_time = time.time() - start
+
+    start = time.time()
+    for _ in range(samples):
+        buf.sample_batch(minibatch_size)
+    sample_time = time.time() - start
+    return fill_time, sample_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay buffer microbenchmark')
+    parser.add_argument('--fill', action="store", dest="fill", type=int)
+    parser.add_argument('--samples', action="store", dest="samples", type=int)
+    parser.add_argument('--state_dim', action="store", dest="state_dim",
+            type=int)
+    parser.add_argument('--minibatch_size', action="store",
+            dest="minibatch_size", type=int)
+    parser_res = parser.parse_args()
+    fill = parser_res.fill if parser_res.fill is not None else 100000
+    samples = parser_res.samples if parser_res.samples is not None else 1000
+    state_dim = parser_res.state_dim \
+            if parser_res.state_dim is not None else 5
+    minibatch_size = parser_res.minibatch_size \
+            if parser_res.minibatch_size is not None else 64
+
+    states = np.random.randn(fill + 1, state_dim)
+    actions = np.random.randn(fill + 1, 2)
+    rewards = np.random.randn(fill + 1)
+
+    buffers = [("deque", DequeReplayBuffer(1000000)),
+               ("array (float64)", ReplayBuffer(1000000, dtype=np.float64)),
+               ("array (float32)", ReplayBuffer(1000000, dtype=np.float32))]
+    for name, buf in buffers:
+        fill_time, sample_time = run(buf, states, actions, rewards, samples,
+                minibatch_size)
+        print('| {:16s} | add: {:8.2f} us | sample_batch: {:8.2f} us |'.format(
+            name, 1e6 * fill_time / fill, 1e6 * sample_time / samples))
@@ -0,0 +1,213 @@
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+class CheckpointWriter(object):
+    """
+    Saves the variables of a TensorFlow session without blocking training.
+
+    save() only copies the current values of the variables into memory with
+    one session call. The values are written by a background thread to
+    <save_path>-<n>.npz, through a temporary file which is moved into place
+    with os.replace() so that a checkpoint is never seen half written. For
+    each save_path only the last keep checkpoints are kept, and the files
+    <save_path>.latest and <save_path>.best name the newest and the best
+    checkpoint together with the metrics they were saved with.
+
+    At most max_pending snapshots wait to be written. When the writer falls
+    further behind, save() blocks until there is room again.
+
+    save() takes the same leading arguments as tf.train.Saver.save(), so
+    the writer can be used in place of a Saver. The writer thread is only
+    started by the first save(), which lets processes be forked safely
+    before then.
+    """
+
+    def __init__(self, var_list, keep=5, max_pending=2):
+        """
+        Arguments:
+            var_list (list of tf.Variable): the variables to save
+            keep (int): the number of checkpoints to keep for each save_path
+            max_pending (int): the number of snapshots which may wait to be
+                written
+        """
+        self.var_list = list(var_list)
+        self.keep = keep
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.history = {}
+        self.best = {}
+        self.error = None
+
+        # Metrics
+        self.saves = 0
+        self.writes = 0
+        self.snapshot_time = 0.0
+        self.wait_time = 0.0
+        self.write_time = 0.0
+        self.last_write_time = 0.0
+
+        self.thread = None
+
+    def save(self, sess, save_path, metrics=None, best=False):
+        """
+        Snapshot the variables and queue them to be written.
+
+        Arguments:
+            sess (tf.Session): the session holding the variables
+            save_path (str): prefix of the checkpoint files
+            metrics (dict): JSON serializable values stored with the
+                checkpoint
+            best (bool): whether this is the best checkpoint so far
+
+        Returns:
+            str: the path the checkpoint will be written to
+        """
+        self.check_error()
+
+        start = time.time()
+        values = sess.run(self.var_list)
+        snapshot_end = time.time()
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        n = self.counters.get(save_path, 0)
+        self.counters[save_path] = n + 1
+        path = '{}-{}.npz'.format(save_path, n)
+        self.queue.put((save_path, path, values, metrics, best))
+
+        end = time.time()
+        with self.lock:
+            self.saves += 1
+            self.snapshot_time += snapshot_end - start
+            self.wait_time += end - snapshot_end
+        return path
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            start = time.time()
+            try:
+                self.write(*item)
+            except Exception as e:
+                self.error = e
+            end = time.time()
+            with self.lock:
+                self.writes += 1
+                self.write_time += end - start
+                self.last_write_time = end - start
+            self.queue.task_done()
+
+    def write(self, save_path, path, values, metrics, best):
+        arrays = {var.name: value
+                for (var, value) in zip(self.var_list, values)}
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # np.savez appends .npz to names without it
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+        pointer = {'path': os.path.basename(path), 'metrics': metrics}
+        write_json(save_path + '.latest', pointer)
+        history = self.history.setdefault(save_path, [])
+        if best:
+            write_json(save_path + '.best', pointer)
+            old = self.best.get(save_path)
+            if old is not None and old not in history and os.path.exists(old):
+                os.remove(old)
+            self.best[save_path] = path
+
+        # Rotate old checkpoints, but never the best one
+        history.append(path)
+        while len(history) > self.keep:
+            old = history.pop(0)
+            if old == self.best.get(save_path):
+                continue
+            if os.path.exists(old):
+                os.remove(old)
+
+    def restore(self, sess, path):
+        """
+        Load the variables from a checkpoint written by this class.
+
+        Arguments:
+            sess (tf.Session): the session holding the variables
+            path (str): a checkpoint file, or a save_path whose best
+                checkpoint (or else latest checkpoint) is loaded
+        """
+        if not path.endswith('.npz'):
+            for pointer in (path + '.best', path + '.latest'):
+                if os.path.exists(pointer):
+                    with open(pointer) as f:
+                        name = json.load(f)['path']
+                    path = os.path.join(os.path.dirname(pointer), name)
+                    break
+        with np.load(path) as arrays:
+            for var in self.var_list:
+                var.load(arrays[var.name], sess)
+
+    def check_error(self):
+        """Raise an error if writing some checkpoint failed."""
+        if self.error is not None:
+            raise RuntimeError("Writing a checkpoint failed") from self.error
+
+    def flush(self):
+        """Wait until every queued snapshot has been written."""
+        self.queue.join()
+        self.check_error()
+
+    def close(self):
+        """Write the remaining snapshots and stop the writer thread.
+
+        Raises the error of any write which failed, so that a failure of
+        the last checkpoint of training is not lost.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.check_error()
+
+    def queue_depth(self):
+        """The number of snapshots waiting to be written."""
+        return self.queue.qsize()
+
+    def get_metrics(self):
+        """
+        Returns:
+            dict: the number of saves, the queue depth and the mean time in
+            seconds spent in save() taking snapshots, in save() waiting for
+            room in the queue and in the writer thread per checkpoint, as
+            well as the time taken by the last write
+        """
+        with self.lock:
+            saves = max(self.saves, 1)
+            writes = max(self.writes, 1)
+            return {
+                'saves': self.saves,
+                'queue_depth': self.queue_depth(),
+                'snapshot_time': self.snapshot_time / saves,
+                'wait_time': self.wait_time / saves,
+                'write_time': self.write_time / writes,
+                'last_write_time': self.last_write_time,
+            }
+
+
+def write_json(path, obj):
+    """Write obj to path as JSON, replacing any existing file atomically."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
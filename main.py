@@ -19,9 +19,13 @@ import time
 import random
 import subprocess
 import platform
+import multiprocessing
+import queue
+import traceback
 
 from threading import Timer
 from metrics import timeit
+from rollout import ShieldController
 
 def dlqr(A, B, Q, R):
     """
@@ -106,7 +110,8 @@ def uniform_random_linear_policy(A, B, Q, R, x0, eq_err, N, T, x_min=None,
 def random_search_linear_policy(A, B, Q, R, x0, eq_err, N, T, x_min=None,
         x_max=None, continuous=False, timestep=0.01, rewardf=None,
         explore_mag=0.04, step_size=0.05, batch_size=4, coffset=None,
-        bias=False, unsafe_flag=False, lqr_start=False):
+        bias=False, unsafe_flag=False, lqr_start=False, num_workers=0,
+        actor=None, batch_rewardf=None):
     '''
     Arguments:
       state transition matrices (A,B)
@@ -128,55 +133,255 @@ def random_search_linear_policy(A, B, Q, R, x0, eq_err, N, T, x_min=None,
     def f(x, u):
         return A.dot(x) + B.dot(u)
 
+    def batch_f(X, U):
+        return X.dot(np.asarray(A).T) + U.dot(np.asarray(B).T)
+
     d,p = B.shape
 
     return random_search_helper(f, d, p, Q, R, x0, eq_err, N, T, x_min, x_max,
             continuous, timestep, rewardf, explore_mag, step_size, batch_size,
             coffset, bias, unsafe_flag,
             A if lqr_start and not bias else None,
-            B if lqr_start and not bias else None)
+            B if lqr_start and not bias else None, batch_f=batch_f,
+            batch_rewardf=batch_rewardf, num_workers=num_workers, actor=actor)
+
+class RolloutPool(object):
+
+    def __init__(self, func, num_workers, seed=None, actor=None):
+        """
+        A persistent pool of forked worker processes evaluating func, which
+        random_search_helper and policy_gradient_helper use to simulate
+        rollouts in parallel. Since the workers are forked, func may be a
+        closure over the dynamics, the reward function and the actor, and
+        only its arguments and results are sent between processes. Each
+        worker has its own random stream, seeded with seed plus its worker
+        id, and the i-th task of a map() always goes to the same worker, so
+        the results only depend on seed.
+
+        Arguments:
+            func (function): the function evaluated by the workers
+            num_workers (int): the number of worker processes
+            seed (int): seed of the random streams, drawn from the global
+                generator if None
+            actor (ActorNetwork): an actor used by func. The workers cannot
+                use its TensorFlow session and evaluate it in numpy.
+        """
+        context = multiprocessing.get_context('fork')
+        if seed is None:
+            seed = np.random.randint(2**31)
+        if actor is not None and getattr(actor, 'numpy_actor', 0) is None:
+            actor.set_numpy_weights(actor.get_weights())
+        self.results = context.Queue()
+        self.task_queues = []
+        self.workers = []
+        for worker_id in range(num_workers):
+            tasks = context.Queue()
+            worker = context.Process(target=rollout_pool_worker,
+                    args=(func, (seed + worker_id) % 2**32, actor, tasks,
+                        self.results))
+            worker.daemon = True
+            worker.start()
+            self.task_queues.append(tasks)
+            self.workers.append(worker)
+
+    def __len__(self):
+        return len(self.workers)
+
+    def map(self, tasks):
+        """
+        Evaluate func on each tuple of arguments in tasks.
+
+        Returns:
+            list: the results in the order of tasks
+        """
+        for (i, args) in enumerate(tasks):
+            self.task_queues[i % len(self.workers)].put((i, args))
+        results = [None] * len(tasks)
+        for _ in range(len(tasks)):
+            while True:
+                try:
+                    i, result, error = self.results.get(timeout=1.0)
+                    break
+                except queue.Empty:
+                    if not all(worker.is_alive() for worker in self.workers):
+                        raise RuntimeError("A rollout worker has exited")
+            if error is not None:
+                raise RuntimeError("Rollout worker failed:\n" + error)
+            results[i] = result
+        return results
+
+    def close(self):
+        """Stop the workers."""
+        for tasks in self.task_queues:
+            tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=10.0)
+            if worker.is_alive():
+                worker.terminate()
+
+
+def rollout_pool_worker(func, seed, actor, tasks, results):
+    """The body of a worker process started by RolloutPool."""
+    np.random.seed(seed)
+    random.seed(seed)
+    if actor is not None and hasattr(actor, 'numpy_batch_size'):
+        actor.numpy_batch_size = float('inf')
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        i, args = task
+        try:
+            results.put((i, func(*args), None))
+        except Exception:
+            results.put((i, None, traceback.format_exc()))
+
+def rowwise_rewardf(rewardf):
+    '''
+    Turn a reward function of one state and action, given as column
+    matrices, into one for states and actions given one per row.
+    '''
+    def batch_rewardf(X, Q, U, R):
+        return np.array([np.asarray(rewardf(np.matrix(x).T, Q,
+            np.matrix(u).T, R)).item() for (x, u) in zip(X, U)])
+    return batch_rewardf
+
+def simulate_linear_policies(f, Ks, x0, T, Q, R, eq_err, x_min=None,
+        x_max=None, continuous=False, timestep=0.01, rewardf=None,
+        coffset=None, bias=False, unsafe_flag=False, batch_f=None,
+        batch_rewardf=None, explore_mag=0.0):
+    '''
+    Simulate several linear policies from x0 at once. The state of each
+    policy is one row of a state batch, so each step is a few array
+    operations over all policies.
+
+    Arguments:
+      dynamics f(x, u), used one state at a time unless batch_f is given
+      stacked gains Ks of shape (n, p, d), or (n, p, d+1) with bias
+      Initial State x0
+      Time Horizon T
+      LQR Costs (Q,R)
+      magnitude of noise in dynamics eq_err
+
+      optional:
+        x_min, x_max: bounds of shape (d, k). States outside of the first
+          column are penalized, or with unsafe_flag the states which in
+          some dimension are strictly inside the bounds of every column
+        batch_f: f for states and actions given one per row
+        batch_rewardf: rewardf for states and actions given one per row,
+          returning one reward per row
+        explore_mag: magnitude of the gaussian noise added to the actions
+
+    Outputs:
+      The total reward of each policy. A rollout stops as soon as its state
+      exceeds 1e72 in some dimension. With explore_mag > 0 also the policy
+      gradient terms sum_t v_t x_t^T of each rollout, of shape (n, p, d),
+      where v_t is the noise added to the action taken in state x_t.
+    '''
+    Ks = np.asarray(Ks, dtype=np.float64)
+    n = Ks.shape[0]
+    x0 = np.asarray(x0, dtype=np.float64).reshape(1, -1)
+    d = x0.shape[1]
+    X = np.repeat(x0, n, axis=0)
+    offset = 0.0 if coffset is None else \
+            np.asarray(coffset, dtype=np.float64).reshape(1, d)
+    # Bounds are kept as (1, d, k) to compare against every column
+    lower = None if x_min is None else \
+            np.asarray(x_min, dtype=np.float64).reshape(1, d, -1)
+    upper = None if x_max is None else \
+            np.asarray(x_max, dtype=np.float64).reshape(1, d, -1)
+    if batch_rewardf is None and rewardf is not None:
+        batch_rewardf = rowwise_rewardf(rewardf)
+    if batch_rewardf is None:
+        Qa = np.asarray(Q, dtype=np.float64)
+        Ra = np.asarray(R, dtype=np.float64)
+
+    rewards = np.zeros(n)
+    if explore_mag > 0:
+        p = Ks.shape[1]
+        X_store = np.zeros((n, T, d))
+        V_store = np.zeros((n, T, p))
+    active = np.arange(n)
+    for t in range(T):
+        if len(active) == 0:
+            break
+        Xa = X[active]
+        Ka = Ks[active]
+        if bias:
+            U = np.einsum('nij,nj->ni', Ka[:, :, :-1], Xa) + Ka[:, :, -1]
+        else:
+            U = np.einsum('nij,nj->ni', Ka, Xa)
+        if explore_mag > 0:
+            V = explore_mag * np.random.randn(len(active), p)
+            X_store[active, t] = Xa
+            V_store[active, t] = V
+            U = U + V
+        if batch_f is not None:
+            F = np.asarray(batch_f(Xa, U), dtype=np.float64).reshape(Xa.shape)
+        else:
+            F = np.array([np.ravel(f(np.matrix(x).T, np.matrix(u).T))
+                for (x, u) in zip(Xa, U)], dtype=np.float64).reshape(Xa.shape)
+        noise = eq_err * np.random.randn(len(active), d)
+        # Use discrete or continuous semantics based on user's choice
+        if continuous:
+            Xa = Xa + timestep * (F + offset) + noise
+        else:
+            Xa = F + offset + noise
+        X[active] = Xa
+
+        if batch_rewardf is not None:
+            r = np.asarray(batch_rewardf(Xa, Q, U, R),
+                    dtype=np.float64).reshape(len(active))
+        else:
+            r = -np.einsum('ni,ij,nj->n', Xa, Qa, Xa) - \
+                    np.einsum('ni,ij,nj->n', U, Ra, U)
+        # Penality added to states
+        if unsafe_flag:
+            inside = (Xa[:, :, None] < upper) & (Xa[:, :, None] > lower)
+            r = r - 100 * inside.all(axis=2).any(axis=1)
+        else:
+            if lower is not None:
+                r = r - 100 * (Xa < lower[:, :, 0]).sum(axis=1)
+            if upper is not None:
+                r = r - 100 * (Xa > upper[:, :, 0]).sum(axis=1)
+        rewards[active] += r
+
+        # Break the closed loop system variables are so large
+        diverged = (np.abs(Xa) > 1e72).any(axis=1)
+        for i in np.flatnonzero(diverged):
+            print("unsafe x : {} at time {}".format(np.matrix(Xa[i]).T, t))
+        active = active[~diverged]
+    if explore_mag > 0:
+        return rewards, np.einsum('ntp,ntd->npd', V_store, X_store)
+    return rewards
 
 def random_search_helper(f, d, p, Q, R, x0, eq_err, N, T, x_min=None,
         x_max=None, continuous=False, timestep=0.01, rewardf=None,
         explore_mag=0.04, step_size=0.05, batch_size=4, coffset=None,
-        bias=False, unsafe_flag=False, A=None, B=None):
+        bias=False, unsafe_flag=False, A=None, B=None, batch_f=None,
+        batch_rewardf=None, num_workers=0, actor=None):
+    '''
+    With num_workers > 0 the perturbed gains of each iteration are split
+    between that many worker processes, see RolloutPool. actor is the
+    actor used by rewardf, if any.
+    '''
+
+    def simulate(Ks):
+        return simulate_linear_policies(f, Ks, x0, T, Q, R, eq_err, x_min,
+                x_max, continuous, timestep, rewardf, coffset, bias,
+                unsafe_flag, batch_f, batch_rewardf)
 
     def policy_test(K):
-        x = x0
-        reward = 0
-        for t in range(T):
-            u = np.dot(K, np.vstack([x,[1]])) if bias else np.dot(K, x)
-            # Use discrete or continuous semantics based on user's choice
-            if continuous:
-                x = x + timestep * f(x,u) + eq_err * np.random.randn(d, 1) \
-                        if coffset is None else \
-                        x + timestep * (f(x,u) + coffset) + eq_err * \
-                        np.random.randn(d,1)
-            else:
-                x = f(x,u) + eq_err * np.random.randn(d,1) if coffset is None \
-                        else f(x,u) + coffset + eq_err * np.random.randn(d, 1)
-            if rewardf is None:
-                reward += -np.dot(x.T, Q.dot(x)) - np.dot(u.T, R.dot(u))
-            else:
-                reward += rewardf(x, Q, u, R)
-            #reward += np.array([[0]])
-            # Penality added to states
-            if unsafe_flag:
-                if ((np.array(x) < x_max) * \
-                        (np.array(x) > x_min)).all(axis=1).any():
-                    reward[0,0] = reward[0,0] - 100
-            else:
-                if x_min is not None:
-                    for index in range(d):
-                        if x_min[index, 0] is not None and \
-                                x[index, 0] < x_min[index, 0]:
-                            reward[0,0] = reward[0,0] - 100
-                if x_max is not None:
-                    for index in range(d):
-                        if x_max[index, 0] is not None and \
-                                x[index, 0] > x_max[index, 0]:
-                            reward[0,0] = reward[0,0] - 100
-        return reward
+        return simulate(np.asarray(K)[np.newaxis])[0]
+
+    pool = RolloutPool(simulate, num_workers, actor=actor) \
+            if num_workers > 0 else None
+
+    def simulate_all(Ks):
+        if pool is None:
+            return simulate(Ks)
+        chunks = np.array_split(Ks, min(len(pool), len(Ks)))
+        return np.concatenate(pool.map([(chunk,) for chunk in chunks]))
 
     # initial condition for K
     K0 = 0 * np.random.randn(p, d+1) if bias else 0 * np.random.randn(p, d)
@@ -192,85 +397,37 @@ def random_search_helper(f, d, p, Q, R, x0, eq_err, N, T, x_min=None,
     K = K0
     best_K = K
     best_reward = -float("inf")
-    for k in range(N):
-        reward_store = []
-        mini_batch = np.zeros((p, d+1)) if bias else np.zeros((p, d))
-        for j in range(batch_size):
-            V = np.random.randn(p, d+1) if bias else np.random.randn(p, d)
-            for sign in [-1,1]:
-                x = x0
-                reward = 0
-                for t in range(T):
-                    u = np.dot(K + sign * explore_mag * V, np.vstack([x,[1]]))\
-                            if bias else np.dot(K + sign * explore_mag * V, x)
-                    # Use discrete or continuous semantics based on user's choice
-                    if continuous:
-                        x = x + timestep * f(x,u) + eq_err * \
-                                np.random.randn(d, 1) if coffset is None \
-                                else x + timestep * (f(x,u) + coffset) + \
-                                eq_err * np.random.randn(d, 1)
-                    else:
-                        x = f(x,u) + eq_err * np.random.randn(d, 1) \
-                                if coffset is None else \
-                                f(x,u) + coffset + eq_err * \
-                                np.random.randn(d, 1)
-                    if rewardf is None:
-                        reward += -np.dot(x.T, Q.dot(x)) - \
-                                np.dot(u.T, R.dot(u))
-                    else:
-                        reward += rewardf(x, Q, u, R)
-                    #reward += np.array([[0]])
-                    # Penality added to states
-                    #safe = True
-                    unsafe = False
-                    if unsafe_flag:
-                        if ((np.array(x) < x_max) * \
-                                (np.array(x) > x_min)).all(axis=1).any():
-                            reward[0,0] = reward[0,0] - 100
-                    else:
-                        if x_min is not None:
-                            for index in range(d):
-                                if x_min[index, 0] is not None \
-                                        and x[index, 0] < x_min[index, 0]:
-                                    reward[0,0] = reward[0,0] - 100
-                                    # New -Greg
-                                    #unsafe = True
-                                    #safe = False
-                                    #print ("unsafe state {}".format(x[index, 0]))
-                        if x_max is not None:
-                            for index in range(d):
-                                if x_max[index, 0] is not None \
-                                        and x[index, 0] > x_max[index, 0]:
-                                    reward[0,0] = reward[0,0] - 100
-                                    # New -Greg
-                                    #unsafe = True
-                    # Break the closed loop system variables are so large
-                    for index in range(d):
-                        if abs(x[index, 0]) > 1e72:
-                            unsafe = True
-                            break
-                    if unsafe:
-                        print("unsafe x : {} at time {}".format(x, t))
-                        break
-                mini_batch += reward[0,0] * sign * V
-                reward_store.append(reward)
-        #print "reward = {}".format(reward_store)
-        std = np.std(reward_store)
-        if std == 0:
-            #More thoughts into this required: K already converged?
-            #print ("K seems converged!")
-            #return K
-            K = K
-        else:
-            #print ("K is unconverged!")
-            #if (np.sum(reward_store) > best_reward):
-            #  best_reward = np.sum(reward_store)
-            #  best_K = K
-            K += (step_size / std / batch_size) * mini_batch
-            r = policy_test(K)
-            if r > best_reward:
-                best_reward = r
-                best_K = K
+    signs = np.tile([-1.0, 1.0], batch_size)
+    try:
+        for k in range(N):
+            # Every direction is evaluated with both signs, and all 2 *
+            # batch_size perturbed gains are simulated together
+            V = np.random.randn(batch_size, p, d+1) if bias else \
+                    np.random.randn(batch_size, p, d)
+            V = np.repeat(V, 2, axis=0)
+            reward_store = simulate_all(np.asarray(K) +
+                    explore_mag * signs[:, np.newaxis, np.newaxis] * V)
+            mini_batch = np.einsum('n,nij->ij', reward_store * signs, V)
+            #print "reward = {}".format(reward_store)
+            std = np.std(reward_store)
+            if std == 0:
+                #More thoughts into this required: K already converged?
+                #print ("K seems converged!")
+                #return K
+                K = K
+            else:
+                #print ("K is unconverged!")
+                #if (np.sum(reward_store) > best_reward):
+                #  best_reward = np.sum(reward_store)
+                #  best_K = K
+                K += (step_size / std / batch_size) * mini_batch
+                r = policy_test(K)
+                if r > best_reward:
+                    best_reward = r
+                    best_K = K
+    finally:
+        if pool is not None:
+            pool.close()
 
     #return K
     return best_K
@@ -278,7 +435,8 @@ def random_search_helper(f, d, p, Q, R, x0, eq_err, N, T, x_min=None,
 def policy_gradient_adam_linear_policy(A, B, Q, R, x0, eq_err, N, T,
         x_min=None, x_max=None, continuous=False, timestep=0.01, rewardf=None,
         explore_mag=0.04, step_size=0.05, batch_size=8, beta1=0.9, beta2=0.999,
-        epsilon=1.0e-8, coffset=None, bias=False):
+        epsilon=1.0e-8, coffset=None, bias=False, num_workers=0, actor=None,
+        batch_rewardf=None):
     '''
     Arguments:
       state transition matrices (A,B)
@@ -301,50 +459,56 @@ def policy_gradient_adam_linear_policy(A, B, Q, R, x0, eq_err, N, T,
     def f(x, u):
         return A.dot(x) + B.dot(u)
 
+    def batch_f(X, U):
+        return X.dot(np.asarray(A).T) + U.dot(np.asarray(B).T)
+
     d, p = B.shape
 
     return policy_gradient_helper(f, d, p, Q, R, x0, eq_err, N, T, x_min,
             x_max, continuous, timestep, rewardf, explore_mag, step_size,
-            batch_size, beta1, beta2, epsilon, coffset, bias)
+            batch_size, beta1, beta2, epsilon, coffset, bias,
+            num_workers=num_workers, actor=actor, batch_f=batch_f,
+            batch_rewardf=batch_rewardf)
 
 
 def policy_gradient_helper(f, d, p, Q, R, x0, eq_err, N, T, x_min=None,
         x_max=None, continuous=False, timestep=0.01, rewardf=None,
     explore_mag=0.04, step_size=0.05, batch_size=8, beta1=0.9, beta2=0.999,
-    epsilon=1.0e-8, coffset=None, bias=False):
+    epsilon=1.0e-8, coffset=None, bias=False, num_workers=0, actor=None,
+    batch_f=None, batch_rewardf=None):
+    '''
+    The trajectories of a minibatch are simulated together, see
+    simulate_linear_policies() for batch_f and batch_rewardf.
+
+    With num_workers > 0 the trajectories of each minibatch are split
+    between that many worker processes, see RolloutPool. actor is the
+    actor used by rewardf, if any.
+    '''
 
     def policy_test(K):
-        x = x0
-        reward = 0
-        for t in range(T):
-            u = np.dot(K, x)
-            # Use discrete or continuous semantics based on user's choice
-            if continuous:
-                x = x + timestep * (f(x,u)) + eq_err * np.random.randn(d, 1) \
-                        if coffset is None else \
-                        x + timestep * (f(x,u) + coffset) + eq_err * \
-                        np.random.randn(d, 1)
-            else:
-                x = f(x,u) + eq_err * np.random.randn(d, 1) \
-                        if coffset is None else \
-                        f(x,u) + coffset + eq_err * np.random.randn(d, 1)
-            if rewardf is None:
-                reward += -np.dot(x.T, Q.dot(x)) - np.dot(u.T, R.dot(u))
-            else:
-                reward += rewardf(x, Q, u, R)
-            #reward += np.array([[0]])
-            # Penality added to states 
-            if x_min is not None:
-                for index in range(d):
-                    if x_min[index, 0] is not None and \
-                            x[index, 0] < x_min[index, 0]:
-                        reward[0,0] = reward[0,0] - 100
-            if x_max is not None:
-                for index in range(d):
-                    if x_max[index, 0] is not None and \
-                            x[index, 0] > x_max[index, 0]:
-                        reward[0,0] = reward[0,0] - 100
-        return reward
+        return simulate_linear_policies(f, np.asarray(K)[np.newaxis], x0, T,
+                Q, R, eq_err, x_min, x_max, continuous, timestep, rewardf,
+                coffset, batch_f=batch_f, batch_rewardf=batch_rewardf)[0]
+
+    def collect(K, n):
+        """Rewards and gradient terms V X^T of n trajectories."""
+        Ks = np.repeat(np.asarray(K)[np.newaxis], n, axis=0)
+        return simulate_linear_policies(f, Ks, x0, T, Q, R, eq_err, x_min,
+                x_max, continuous, timestep, rewardf, coffset,
+                batch_f=batch_f, batch_rewardf=batch_rewardf,
+                explore_mag=explore_mag)
+
+    pool = RolloutPool(collect, num_workers, actor=actor) \
+            if num_workers > 0 else None
+
+    def collect_all(K):
+        if pool is None:
+            return collect(K, batch_size)
+        sizes = [len(chunk) for chunk in np.array_split(np.arange(batch_size),
+            min(len(pool), batch_size))]
+        results = pool.map([(K, n) for n in sizes])
+        return np.concatenate([r for (r, _) in results]), \
+                np.concatenate([mb for (_, mb) in results])
 
     # initial condition for K
     K0 = 0.0 * np.random.randn(p, d)
@@ -359,91 +523,35 @@ def policy_gradient_helper(f, d, p, Q, R, x0, eq_err, N, T, x_min=None,
     Adam_M = np.zeros((p, d))
     Adam_V = np.zeros((p, d))
 
-    for k in range(N):
-        mini_batch = np.zeros((p, d))
-        mb_store = np.zeros((p, d, batch_size))
-        reward = np.zeros((batch_size))
-
-        # Collect policy gradients for the current minibatch
-        for j in range(batch_size):
-            x = x0
-            X_store = np.zeros((d, T))
-            V_store = np.zeros((p, T))
-            for t in range(T):
-                v = explore_mag*np.random.randn(p, 1)
-                X_store[:,t] = x.flatten()
-                V_store[:,t] = v.flatten()
-                u = np.dot(K,x) + v
-
-                # Use discrete or continuous semantics based on user's choice
-                if continuous:
-                    x = x + timestep * f(x,u) + eq_err * \
-                            np.random.randn(d, 1) if coffset is None else \
-                            x + timestep * (f(x,u) + coffset) + eq_err * \
-                            np.random.randn(d, 1)
-                else:
-                    x = f(x,u) + eq_err * np.random.randn(d, 1) \
-                            if coffset is None else \
-                            f(x,u) + coffset + eq_err * np.random.randn(d, 1)
-                if rewardf is None:
-                    reward[j] += -np.dot(x.T, Q.dot(x)) - np.dot(u.T, R.dot(u))
-                else:
-                    reward[j] += rewardf (x, Q, u, R)
-                #reward += np.array([[0]])
-                # Penality added to states
-                #safe = True
-                unsafe = False
-                if x_min is not None:
-                    for index in range(d):
-                        if x_min[index, 0] is not None and \
-                                x[index, 0] < x_min[index, 0]:
-                            reward[j] = reward[j] - 100
-                            #safe = False
-                            #print ("unsafe state {}".format(x[index, 0]))
-                if x_max is not None:
-                    for index in range(d):
-                        if x_max[index, 0] is not None and \
-                                x[index, 0] > x_max[index, 0]:
-                            reward[j] = reward[j] - 100
-                            #safe = False
-                            #print ("unsafe state {}".format(x[index, 0]))
-                #if ((x_min is not None or x_max is not None) and safe):
-                #    reward[0, 0] = reward[0,0] + 100
-                #if safe is False:
-                  #print ("unsafe x : {} at time {}".format(x, t))
-                  #break
-                # Break the closed loop system variables are so large
-                for index in range(d):
-                    if abs(x[index, 0]) > 1e72:
-                        unsafe = True
-                        break
-                if unsafe:
-                    print("unsafe x : {} at time {}".format(x, t))
-                    break
-            mb_store[:,:,j] = np.dot(V_store, X_store.T)
+    try:
+        for k in range(N):
+            # Collect policy gradients for the current minibatch
+            reward, mb_store = collect_all(K)
 
-        # Mean of rewards over a minibatch are subtracted from reward.
-        # This is a heuristic for baseline subtraction. 
+            # Mean of rewards over a minibatch are subtracted from reward.
+            # This is a heuristic for baseline subtraction. 
 
-        #print "reward = {}".format(reward)
+            #print "reward = {}".format(reward)
 
-        for j in range(batch_size):
-            mini_batch += ((reward[j] - baseline) / batch_size) * \
-                    mb_store[:,:,j]
-        baseline = np.mean(reward)
+            mini_batch = np.einsum('n,npd->pd', (reward - baseline) / batch_size,
+                    mb_store)
+            baseline = np.mean(reward)
 
-        # Adam Algorithm
+            # Adam Algorithm
 
-        Adam_M = beta1*Adam_M + (1 - beta1) * mini_batch
-        Adam_V = beta2*Adam_V + (1 - beta2) * (mini_batch * mini_batch)
+            Adam_M = beta1*Adam_M + (1 - beta1) * mini_batch
+            Adam_V = beta2*Adam_V + (1 - beta2) * (mini_batch * mini_batch)
 
-        effective_step_size = step_size * np.sqrt(1 - beta2**(k+1)) / \
-                (1 - beta1**(k+1))
-        K += effective_step_size * Adam_M / (np.sqrt(Adam_V) + epsilon)
-        r = policy_test(K)
-        if r > best_reward:
-            best_reward = r
-            best_K = K
+            effective_step_size = step_size * np.sqrt(1 - beta2**(k+1)) / \
+                    (1 - beta1**(k+1))
+            K += effective_step_size * Adam_M / (np.sqrt(Adam_V) + epsilon)
+            r = policy_test(K)
+            if r > best_reward:
+                best_reward = r
+                best_K = K
+    finally:
+        if pool is not None:
+            pool.close()
 
     return best_K
 
@@ -725,7 +833,8 @@ def learn_shield(A, B, Q, R, x0, eq_err, learning_method, number_of_rollouts,
         simulation_steps, actor, x_min, x_max, rewardf=None, continuous=False,
         timestep=0.005, explore_mag=0.04, step_size=0.05, coffset=None,
         bias=False, unsafe_flag=False, lqr_start=False,
-        without_nn_guide=False, nn_weight=0.0, old_shield=None):
+        without_nn_guide=False, nn_weight=0.0, old_shield=None,
+        num_workers=0):
 
     def reward_func(x, Q, u, R):
         """
@@ -736,7 +845,8 @@ def learn_shield(A, B, Q, R, x0, eq_err, learning_method, number_of_rollouts,
         """
         sim_score = 0 if actor is None else \
                 -np.matrix([[np.sum(np.abs(actor.predict(
-                    np.reshape(x, (-1, actor.s_dim))) - u))]])
+                    np.reshape(x, (-1, actor.s_dim))) -
+                    np.reshape(u, (1, -1))))]])
         safe_score = 0 if actor is not None or rewardf is None \
                 else rewardf(x, Q, u, R)
         return sim_score + safe_score
@@ -745,36 +855,74 @@ def learn_shield(A, B, Q, R, x0, eq_err, learning_method, number_of_rollouts,
         if actor is None:
             sim_score = 0
         else:
-            p = actor.predict(np.reshape(x, (-1, actor.s_dim)))
+            p = np.reshape(actor.predict(np.reshape(x, (-1, actor.s_dim))),
+                    (-1, 1))
             if shield.detector(x, p):
-                sim_score = -np.matrix([[np.sum(np.abs(shield.call_shield(x,
-                        mute=True) - u))]])
+                sim_score = -np.matrix([[np.sum(np.abs(shield.call_shield(x)
+                        - u))]])
             else:
                 sim_score = -np.matrix([[np.sum(np.abs(p - u))]])
         safe_score = 0 if actor is not None or rewardf is None \
                 else rewardf(x, Q, u, R)
         return sim_score + safe_score
 
+    # The random search simulates all of its rollouts together and calls
+    # these with the states and actions of every rollout at a step, so that
+    # the actor and the old shield are queried once per step.
+    batch_rewardf = None if rewardf is None else rowwise_rewardf(rewardf)
+
+    def batch_reward_func(X, Q, U, R):
+        """reward_func() for states and actions given one per row."""
+        if actor is None:
+            return batch_rewardf(X, Q, U, R)
+        return -np.sum(np.abs(actor.predict(X) - U), axis=1)
+
+    def batch_shielded_reward_func(X, Q, U, R, shield):
+        """
+        shielded_reward_func() for states and actions given one per row.
+        Where the action of the actor is unsafe, the shield acts with the
+        first piece whose invariant contains the state.
+        """
+        if actor is None:
+            return batch_reward_func(X, Q, U, R)
+        P = np.asarray(actor.predict(X), dtype=np.float64)
+        unsafe, _ = shield.detector_batch(X, P)
+        if unsafe.any():
+            shield_controller.reset(np.count_nonzero(unsafe))
+            P[unsafe] = shield_controller.actions(X[unsafe],
+                    np.arange(np.count_nonzero(unsafe)))
+        return -np.sum(np.abs(P - U), axis=1)
+
     if actor is None and rewardf is None:
         shield_reward = None
+        batch_shield_reward = None
     elif not without_nn_guide and old_shield is not None:
         shield_reward = lambda x, Q, u, R: shielded_reward_func(x, Q, u, R,
                 shield=old_shield)
+        shield_controller = ShieldController(old_shield)
+        batch_shield_reward = lambda X, Q, U, R: batch_shielded_reward_func(
+                X, Q, U, R, shield=old_shield)
     elif not without_nn_guide and rewardf is not None:
         shield_reward = \
                 lambda x, Q, u, R: nn_weight * reward_func(x, Q, u, R) + \
                                    (1 - nn_weight) * rewardf(x, Q, u, R)
+        batch_shield_reward = \
+                lambda X, Q, U, R: nn_weight * batch_reward_func(X, Q, U, R) + \
+                                   (1 - nn_weight) * batch_rewardf(X, Q, U, R)
     elif not without_nn_guide:
         shield_reward = reward_func
+        batch_shield_reward = batch_reward_func
     else:
         shield_reward = rewardf
+        batch_shield_reward = batch_rewardf
 
     if learning_method == "random_search":
         K = random_search_linear_policy(A, B, Q, R, x0, eq_err,
                 number_of_rollouts, simulation_steps, x_min, x_max, continuous,
                 timestep, shield_reward, explore_mag, step_size,
                 coffset=coffset, bias=bias, unsafe_flag=unsafe_flag,
-                lqr_start=lqr_start)
+                lqr_start=lqr_start, num_workers=num_workers, actor=actor,
+                batch_rewardf=batch_shield_reward)
         print("K = {}".format(K))
     elif learning_method == "random_search_2":
         K = uniform_random_linear_policy(A, B, Q, R, x0, eq_err,
@@ -785,7 +933,8 @@ def learn_shield(A, B, Q, R, x0, eq_err, learning_method, number_of_rollouts,
         K = policy_gradient_adam_linear_policy(A, B, Q, R, x0, eq_err,
                 number_of_rollouts, simulation_steps, x_min, x_max, continuous,
                 timestep, shield_reward, explore_mag, step_size,
-                coffset=coffset)
+                coffset=coffset, num_workers=num_workers, actor=actor,
+                batch_rewardf=batch_shield_reward)
         print("K = {}".format(K))
     else:
         print("Learning method {} is not found".format(learning_method))
@@ -795,7 +944,8 @@ def learn_shield(A, B, Q, R, x0, eq_err, learning_method, number_of_rollouts,
 def learn_polysys_shield(f, ds, us, Q, R, x0, eq_err, learning_method,
         number_of_rollouts, simulation_steps, actor, rewardf=None,
         continuous=False, timestep=0.005, explore_mag=0.04, step_size=0.05,
-        coffset=None, bias=False, unsafe_flag=False, without_nn_guide=False):
+        coffset=None, bias=False, unsafe_flag=False, without_nn_guide=False,
+        batch_f=None, num_workers=0):
 
     def reward_func(x, Q, u, R):
         """
@@ -806,23 +956,35 @@ def learn_polysys_shield(f, ds, us, Q, R, x0, eq_err, learning_method,
         """
         sim_score = 0 if actor is None else \
                 -np.matrix([[np.sum(np.abs(
-                    actor.predict(np.reshape(x, (-1, actor.s_dim))) - u))]])
+                    actor.predict(np.reshape(x, (-1, actor.s_dim))) -
+                    np.reshape(u, (1, -1))))]])
         safe_score = 0 if actor is not None or rewardf is None \
                 else rewardf(x, Q, u, R)
         return sim_score + safe_score
 
+    def batch_reward_func(X, Q, U, R):
+        """reward_func() for the states of all rollouts at a step."""
+        if actor is None:
+            return rowwise_rewardf(rewardf)(X, Q, U, R)
+        return -np.sum(np.abs(actor.predict(X) - U), axis=1)
+
     if actor is None and rewardf is None:
         shield_reward = None
+        batch_shield_reward = None
     elif not without_nn_guide:
         shield_reward = reward_func
+        batch_shield_reward = batch_reward_func
     else:
         shield_reward = rewardf
+        batch_shield_reward = None
 
     K = random_search_helper(f, ds, us, Q, R, x0, eq_err, number_of_rollouts,
             simulation_steps, continuous=continuous, timestep=timestep,
             rewardf=shield_reward, explore_mag=explore_mag,
             step_size=step_size, coffset=coffset, bias=bias,
-            unsafe_flag=unsafe_flag)  
+            unsafe_flag=unsafe_flag, batch_f=batch_f,
+            batch_rewardf=batch_shield_reward, num_workers=num_workers,
+            actor=actor)
 
     print("K = {}".format(K))
     return K
@@ -1,5 +1,6 @@
 import numpy as np
 import time
+from rollout import rollout, LinearController
 
 def distance_between_linear_function_and_neural_network(env, actor, K,
         terminal_err=0.01, rounds=10, steps=500):
@@ -90,18 +91,17 @@ def linear_function_performance(env, K, terminal_err=0.01, rounds=100,
         rounds(int): rounds
         steps(int): steps
     """
-    sum_steps = 0
     temp_env_ter_err = env.terminal_err
     env.terminal_err = terminal_err
-    for i in range(rounds):
-        env.reset()
-        for s in range(steps):
-            xk, r, terminal = env.observation()
-            if terminal:
-                break
-            sum_steps += 1
-            u = K.dot(xk)
-            env.step(u)
+    X0, E0 = env.reset_batch(rounds)
+    # Each round first observes its initial state with a zero action
+    _, initial = env.observation_batch(X0,
+            np.zeros((rounds, env.action_dim)), E0)
+    _, _, _, terminals, _ = rollout(env, LinearController(K), X0, steps, E0)
+    lengths = np.where(terminals.any(axis=1),
+            np.argmax(terminals, axis=1) + 1, steps)
+    lengths[initial] = 0
+    sum_steps = np.sum(lengths)
 
     env.terminal_err = temp_env_ter_err
     return float(sum_steps) / rounds
@@ -0,0 +1,284 @@
+import numpy as np
+import scipy
+import scipy.optimize
+
+def linprog_method(version=scipy.__version__):
+    """The linprog method to use with a given version of SciPy.
+
+    HiGHS only exists from SciPy 1.5 on, while the older solvers were removed
+    in SciPy 1.11, so neither is available across every supported version.
+
+    Arguments:
+        version (str): the version string of SciPy
+
+    Returns:
+        str: the name of the method to pass to scipy.optimize.linprog
+    """
+    major, minor = (int(v) for v in version.split('.')[:2])
+    if (major, minor) >= (1, 5):
+        return 'highs'
+    return 'revised simplex'
+
+class PolytopeUnion(object):
+    """A union of polytopes stored as a single stacked system of halfspaces.
+
+    Each polytope is a pair (A, b) containing all points x such that
+    A * x <= b. The rows of every A are concatenated into one matrix, with
+    offsets marking where each polytope's rows begin, so that the membership
+    of many points in every polytope is decided with one matrix product and
+    one segmented reduction instead of a Python loop over the polytopes.
+
+    Attributes:
+        A (np.array): the stacked constraint matrices
+        b (np.array): the stacked constraint offsets
+        offsets (np.array): index of the first row of each polytope
+    """
+
+    def __init__(self, polytopes, dim=None, index=False):
+        """Stack a list of polytopes.
+
+        Arguments:
+            polytopes (list): pairs (A, b) of matrices
+            dim (int): the dimension of the space, only needed when the list
+                of polytopes is empty
+            index (bool): build a BoxTree over the bounding boxes of the
+                polytopes to speed up find_one()
+        """
+        As = [np.asarray(A, dtype=np.float64) for (A, _) in polytopes]
+        bs = [np.asarray(b, dtype=np.float64).flatten() for (_, b) in polytopes]
+        self.size = len(As)
+        if dim is None:
+            dim = As[0].shape[1] if self.size > 0 else 0
+        self.dim = dim
+
+        counts = np.array([len(b) for b in bs], dtype=int)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)[:-1])) \
+                if self.size > 0 else np.zeros(0, dtype=int)
+        self.A = np.vstack(As) if self.size > 0 else np.zeros((0, dim))
+        self.b = np.concatenate(bs) if self.size > 0 else np.zeros(0)
+        self.counts = counts
+        # A polytope without constraints is the whole space. np.reduceat
+        # cannot express empty segments, so those are handled separately.
+        self.unconstrained = counts == 0
+
+        self.index = None
+        if index:
+            boxes = [bounding_box(A, b) for (A, b) in zip(As, bs)]
+            self.index = BoxTree(np.array([l for (l, _) in boxes]).reshape(-1, dim),
+                    np.array([u for (_, u) in boxes]).reshape(-1, dim))
+
+    def __len__(self):
+        return self.size
+
+    def contains(self, X):
+        """Decide membership of each point in each polytope.
+
+        Arguments:
+            X (np.array): points, one per row
+
+        Returns:
+            np.array: an (N, size) boolean array whose entry (i, j) is True
+            if X[i] is in polytope j
+        """
+        X = np.asarray(X, dtype=np.float64).reshape(-1, self.dim)
+        inside = np.ones((len(X), self.size), dtype=bool)
+        if len(self.b) == 0:
+            return inside
+        violated = X.dot(self.A.T) > self.b
+        constrained = ~self.unconstrained
+        inside[:, constrained] = ~np.logical_or.reduceat(violated,
+                self.offsets[constrained], axis=1)
+        return inside
+
+    def find(self, X):
+        """Find the first polytope containing each point.
+
+        Arguments:
+            X (np.array): points, one per row
+
+        Returns:
+            np.array: for each point the index of the first polytope which
+            contains it, or -1 if there is none
+        """
+        inside = self.contains(X)
+        if self.size == 0:
+            return np.full(len(inside), -1)
+        first = np.argmax(inside, axis=1)
+        first[~inside[np.arange(len(inside)), first]] = -1
+        return first
+
+    def any(self, X):
+        """Decide for each point whether some polytope contains it."""
+        return self.contains(X).any(axis=1)
+
+    def polytopes(self):
+        """The polytopes as pairs (A, b) of views into the stacked arrays.
+
+        This is the form in which the synthesis extension takes regions of
+        the state space, without copying them.
+        """
+        return [(self.A[offset:offset + count], self.b[offset:offset + count])
+                for (offset, count) in zip(self.offsets, self.counts)]
+
+    def find_one(self, x):
+        """Find the first polytope containing a single point.
+
+        If the union was built with an index only the polytopes whose
+        bounding boxes contain x are checked, so the cost of a lookup grows
+        with the depth of the index rather than the number of polytopes.
+
+        Arguments:
+            x (np.array): the point
+
+        Returns:
+            int: the index of the first polytope containing x, or -1
+        """
+        x = np.asarray(x, dtype=np.float64).flatten()
+        if self.index is None:
+            return self.find(x)[0]
+        for j in self.index.query(x):
+            if self.unconstrained[j]:
+                return j
+            rows = slice(self.offsets[j], self.offsets[j] + self.counts[j])
+            if (self.A[rows].dot(x) <= self.b[rows]).all():
+                return j
+        return -1
+
+
+def bounding_box(A, b, tol=1e-6, method=None):
+    """Compute the smallest axis-aligned box containing a polytope.
+
+    Each bound is found by minimizing or maximizing one coordinate subject
+    to A * x <= b. Unbounded directions get infinite bounds and an empty
+    polytope gets lower bounds of inf and upper bounds of -inf. The box is
+    widened by tol so that points on the boundary of the polytope are not
+    lost to the tolerance of the LP solver.
+
+    Arguments:
+        A (np.matrix): constraint matrix of the polytope
+        b (np.matrix): constraint offsets of the polytope
+        tol (float): relative amount by which to widen the box
+        method (str): the linprog method, by default the one chosen by
+            linprog_method for the installed SciPy
+
+    Returns:
+        (np.array, np.array): the lower and upper corners of the box
+    """
+    if method is None:
+        method = linprog_method()
+    A = np.asarray(A, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64).flatten()
+    dim = A.shape[1]
+    lower = np.full(dim, -np.inf)
+    upper = np.full(dim, np.inf)
+    if len(b) == 0:
+        return lower, upper
+    for i in range(dim):
+        for sign in (1.0, -1.0):
+            c = np.zeros(dim)
+            c[i] = sign
+            res = scipy.optimize.linprog(c, A_ub=A, b_ub=b,
+                    bounds=[(None, None)] * dim, method=method)
+            if res.status == 2:
+                # Infeasible, so no point can ever be inside
+                return np.full(dim, np.inf), np.full(dim, -np.inf)
+            if res.status == 0:
+                if sign > 0:
+                    lower[i] = res.x[i]
+                else:
+                    upper[i] = res.x[i]
+    lower -= tol * (1 + np.abs(lower))
+    upper += tol * (1 + np.abs(upper))
+    return lower, upper
+
+
+class BoxTree(object):
+    """An axis-aligned bounding volume hierarchy over a list of boxes.
+
+    The tree is built top down by splitting the boxes of a node at the
+    median center along the axis in which the centers are most spread out,
+    until at most leaf_size boxes remain. Nodes are stored in flat arrays.
+
+    Attributes:
+        lower (np.array): lower corners of the boxes, one per row
+        upper (np.array): upper corners of the boxes, one per row
+    """
+
+    def __init__(self, lower, upper, leaf_size=4):
+        self.lower = np.asarray(lower, dtype=np.float64)
+        self.upper = np.asarray(upper, dtype=np.float64)
+        self.leaf_size = leaf_size
+
+        # Boxes which are empty can never contain a point
+        items = np.flatnonzero((self.lower <= self.upper).all(axis=1))
+        # Centers used to partition the boxes. Infinite sides are ignored.
+        lo = np.where(np.isfinite(self.lower), self.lower, self.upper)
+        hi = np.where(np.isfinite(self.upper), self.upper, self.lower)
+        bounded = np.isfinite(lo) & np.isfinite(hi)
+        self.centers = np.where(bounded, (np.where(bounded, lo, 0) +
+                np.where(bounded, hi, 0)) / 2.0, 0.0)
+
+        self.node_lower = []
+        self.node_upper = []
+        # Children of inner nodes, -1 for leaves
+        self.left = []
+        self.right = []
+        # Boxes of leaves, stored as ranges of self.items
+        self.start = []
+        self.end = []
+        self.items = []
+        if len(items) > 0:
+            self.build(items)
+        self.node_lower = np.array(self.node_lower)
+        self.node_upper = np.array(self.node_upper)
+        self.items = np.array(self.items, dtype=int)
+
+    def build(self, items):
+        node = len(self.left)
+        self.node_lower.append(self.lower[items].min(axis=0))
+        self.node_upper.append(self.upper[items].max(axis=0))
+        self.left.append(-1)
+        self.right.append(-1)
+        self.start.append(len(self.items))
+        if len(items) <= self.leaf_size:
+            self.items.extend(items)
+            self.end.append(len(self.items))
+            return node
+        self.end.append(len(self.items))
+
+        centers = self.centers[items]
+        axis = np.argmax(centers.max(axis=0) - centers.min(axis=0))
+        order = items[np.argsort(centers[:, axis], kind='stable')]
+        half = len(order) // 2
+        self.left[node] = self.build(order[:half])
+        self.right[node] = self.build(order[half:])
+        return node
+
+    def query(self, x):
+        """Find the boxes containing a point.
+
+        Arguments:
+            x (np.array): the point
+
+        Returns:
+            list: the indices of the boxes containing x in ascending order
+        """
+        found = []
+        if len(self.left) == 0:
+            return found
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if not ((self.node_lower[node] <= x).all() and
+                    (x <= self.node_upper[node]).all()):
+                continue
+            if self.left[node] < 0:
+                items = self.items[self.start[node]:self.end[node]]
+                inside = ((self.lower[items] <= x) &
+                        (x <= self.upper[items])).all(axis=1)
+                found.extend(items[inside])
+            else:
+                stack.append(self.left[node])
+                stack.append(self.right[node])
+        found.sort()
+        return found
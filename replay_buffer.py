@@ -0,0 +1,283 @@
+################ Replay Buffer for DDPG ######################
+import multiprocessing
+
+import numpy as np
+
+
+class ReplayBuffer(object):
+
+    def __init__(self, buffer_size, random_seed=123, dtype=np.float32):
+        """
+        A fixed-size ring buffer of transitions.
+
+        Each field of a transition is stored in its own preallocated column
+        so that a minibatch can be drawn with a single fancy-index gather.
+        The columns are allocated lazily on the first call to add() since the
+        state and action dimensions are not known until then. States,
+        actions and rewards are stored with the given dtype.
+        """
+        self.buffer_size = buffer_size
+        self.dtype = dtype
+        self.count = 0
+        # Index of the slot the next experience will be written to
+        self.position = 0
+        self.s = None
+        self.a = None
+        self.r = None
+        self.t = None
+        self.s2 = None
+        # RANDOM
+        #random.seed(random_seed)
+
+    def allocate(self, s, a):
+        s_dim = np.size(s)
+        a_dim = np.size(a)
+        self.s = np.empty((self.buffer_size, s_dim), dtype=self.dtype)
+        self.a = np.empty((self.buffer_size, a_dim), dtype=self.dtype)
+        self.r = np.empty(self.buffer_size, dtype=self.dtype)
+        self.t = np.empty(self.buffer_size, dtype=bool)
+        self.s2 = np.empty((self.buffer_size, s_dim), dtype=self.dtype)
+
+    def add(self, s, a, r, t, s2):
+        if self.s is None:
+            self.allocate(s, a)
+        i = self.position
+        self.s[i] = np.ravel(s)
+        self.a[i] = np.ravel(a)
+        self.r[i] = np.asarray(r).item()
+        self.t[i] = t
+        self.s2[i] = np.ravel(s2)
+        self.position = (i + 1) % self.buffer_size
+        if self.count < self.buffer_size:
+            self.count += 1
+
+    def add_batch(self, s, a, r, t, s2):
+        """
+        Add one transition per row of the given arrays. Returns the slots
+        they were written to.
+        """
+        s = np.reshape(s, (len(r), -1))
+        a = np.reshape(a, (len(r), -1))
+        if self.s is None:
+            self.allocate(s[0], a[0])
+        idx = (self.position + np.arange(len(r))) % self.buffer_size
+        self.s[idx] = s
+        self.a[idx] = a
+        self.r[idx] = r
+        self.t[idx] = t
+        self.s2[idx] = np.reshape(s2, (len(r), -1))
+        self.position = (self.position + len(r)) % self.buffer_size
+        self.count = min(self.count + len(r), self.buffer_size)
+        return idx
+
+    def size(self):
+        return self.count
+
+    def sample_indices(self, batch_size):
+        """
+        Draw a minibatch of distinct slots, as random.sample did. When the
+        buffer is much larger than the minibatch, duplicates of independent
+        draws are redrawn instead of permuting the whole buffer.
+        """
+        if self.count < batch_size:
+            return np.random.permutation(self.count)
+        if self.count < 4 * batch_size:
+            return np.random.choice(self.count, batch_size, replace=False)
+        idx = np.random.randint(0, self.count, size=batch_size)
+        while True:
+            first = np.unique(idx, return_index=True)[1]
+            if len(first) == batch_size:
+                return idx
+            first.sort()
+            idx = np.concatenate((idx[first], np.random.randint(0,
+                self.count, size=batch_size - len(first))))
+
+    def sample_batch(self, batch_size):
+        idx = self.sample_indices(batch_size)
+        return self.s[idx], self.a[idx], self.r[idx], self.t[idx], \
+                self.s2[idx]
+
+    def clear(self):
+        self.count = 0
+        self.position = 0
+
+
+class SharedReplayBuffer(ReplayBuffer):
+
+    def __init__(self, buffer_size, state_dim, action_dim, random_seed=123,
+                 dtype=np.float32, context=None):
+        """
+        A ReplayBuffer whose columns and counters live in shared memory so
+        that processes forked after its creation can all add to it. Every
+        access is serialized with a lock; a minibatch is gathered under the
+        lock as well so that it never contains a partially written
+        transition.
+        """
+        context = multiprocessing.get_context('fork') \
+                if context is None else context
+        self.lock = context.Lock()
+        self.shared_count = context.RawValue('l', 0)
+        self.shared_position = context.RawValue('l', 0)
+        super(SharedReplayBuffer, self).__init__(buffer_size, random_seed,
+                dtype)
+
+        def column(shape, dtype):
+            dtype = np.dtype(dtype)
+            raw = context.RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+            return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+        self.s = column((buffer_size, state_dim), dtype)
+        self.a = column((buffer_size, action_dim), dtype)
+        self.r = column((buffer_size,), dtype)
+        self.t = column((buffer_size,), bool)
+        self.s2 = column((buffer_size, state_dim), dtype)
+
+    @property
+    def count(self):
+        return self.shared_count.value
+
+    @count.setter
+    def count(self, value):
+        self.shared_count.value = value
+
+    @property
+    def position(self):
+        return self.shared_position.value
+
+    @position.setter
+    def position(self, value):
+        self.shared_position.value = value
+
+    def add(self, s, a, r, t, s2):
+        with self.lock:
+            super(SharedReplayBuffer, self).add(s, a, r, t, s2)
+
+    def add_batch(self, s, a, r, t, s2):
+        with self.lock:
+            return super(SharedReplayBuffer, self).add_batch(s, a, r, t, s2)
+
+    def sample_batch(self, batch_size):
+        with self.lock:
+            return super(SharedReplayBuffer, self).sample_batch(batch_size)
+
+    def clear(self):
+        with self.lock:
+            super(SharedReplayBuffer, self).clear()
+
+
+class SumTree(object):
+    """
+    A binary tree stored in a flat array where every internal node holds the
+    sum of its two children. The leaves hold one priority per replay buffer
+    slot, so both updating a priority and finding the slot for a given
+    prefix sum take O(log n) time. The number of leaves is rounded up to a
+    power of two so that every leaf sits at the same depth, which lets a
+    whole minibatch descend the tree together.
+    """
+
+    def __init__(self, capacity):
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.tree = np.zeros(2 * self.leaves)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, idx):
+        return self.tree[np.asarray(idx) + self.leaves]
+
+    def set(self, i, priority):
+        i += self.leaves
+        self.tree[i] = priority
+        i //= 2
+        while i >= 1:
+            self.tree[i] = self.tree[2 * i] + self.tree[2 * i + 1]
+            i //= 2
+
+    def update(self, idx, priorities):
+        idx = np.asarray(idx) + self.leaves
+        self.tree[idx] = priorities
+        idx = np.unique(idx // 2)
+        while idx[0] >= 1:
+            self.tree[idx] = self.tree[2 * idx] + self.tree[2 * idx + 1]
+            idx = np.unique(idx // 2)
+
+    def find(self, values):
+        """
+        For each value v find the leaf i such that the sum of the leaves
+        before i is at most v and the sum up to and including i exceeds v.
+        """
+        values = np.array(values, dtype=np.float64)
+        idx = np.ones(len(values), dtype=np.int64)
+        while idx[0] < self.leaves:
+            left = self.tree[2 * idx]
+            go_right = values >= left
+            values -= left * go_right
+            idx = 2 * idx + go_right
+        return idx - self.leaves
+
+    def clear(self):
+        self.tree[:] = 0.0
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+
+    def __init__(self, buffer_size, random_seed=123, dtype=np.float32,
+                 alpha=0.6, beta=0.4, beta_increment=0.0, epsilon=1e-6):
+        """
+        Proportional prioritized experience replay (Schaul et al., 2016).
+
+        Transition i is sampled with probability p_i^alpha / sum_k p_k^alpha
+        where p_i is the magnitude of its last TD error. New transitions get
+        the largest priority seen so far so that each one is replayed at
+        least once. sample_batch also returns importance sampling weights,
+        annealed toward 1 by beta_increment per call, and the sampled slots
+        so that their priorities can be refreshed with update_priorities().
+        """
+        super(PrioritizedReplayBuffer, self).__init__(buffer_size,
+                random_seed, dtype)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.tree = SumTree(buffer_size)
+
+    def add(self, s, a, r, t, s2):
+        i = self.position
+        super(PrioritizedReplayBuffer, self).add(s, a, r, t, s2)
+        self.tree.set(i, self.max_priority ** self.alpha)
+
+    def add_batch(self, s, a, r, t, s2):
+        idx = super(PrioritizedReplayBuffer, self).add_batch(s, a, r, t, s2)
+        self.tree.update(idx, np.full(len(idx), self.max_priority ** self.alpha))
+        return idx
+
+    def sample_indices(self, batch_size):
+        # Stratified sampling: split [0, total) into batch_size equal
+        # segments and draw one prefix sum uniformly from each.
+        n = min(batch_size, self.count)
+        segment = self.tree.total() / n
+        values = (np.arange(n) + np.random.random_sample(n)) * segment
+        # Guard against rounding errors walking past the last filled slot.
+        return np.minimum(self.tree.find(values), self.count - 1)
+
+    def sample_batch(self, batch_size):
+        idx = self.sample_indices(batch_size)
+        probs = self.tree.get(idx) / self.tree.total()
+        weights = np.power(self.count * probs, -self.beta)
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return self.s[idx], self.a[idx], self.r[idx], self.t[idx], \
+                self.s2[idx], weights.reshape(-1, 1), idx
+
+    def update_priorities(self, idx, td_errors):
+        priorities = np.abs(np.ravel(td_errors)) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(idx, np.power(priorities, self.alpha))
+
+    def clear(self):
+        super(PrioritizedReplayBuffer, self).clear()
+        self.tree.clear()
+        self.max_priority = 1.0
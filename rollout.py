@@ -0,0 +1,154 @@
+import numpy as np
+
+class LinearController(object):
+    """
+    The controller u = K x, or u = K (x | 1) if bias is set.
+
+    For a linear environment the closed loop x' = (Ad + Bd K) x + Bd k is
+    precomputed once, see Environment.discretize().
+    """
+
+    def __init__(self, K, bias=False):
+        self.K = np.asarray(K, dtype=np.float64)
+        self.bias = bias
+        self.env = None
+
+    def reset(self, n):
+        pass
+
+    def actions(self, X, idx):
+        """The actions for the states X, which are the trajectories idx."""
+        if self.bias:
+            return X.dot(self.K[:, :-1].T) + self.K[:, -1]
+        return X.dot(self.K.T)
+
+    def transition(self, env, X, U, idx):
+        """The successors of the states X under their actions U."""
+        if not hasattr(env, 'Ad'):
+            return env.transition(X, U)
+        if self.env is not env:
+            Ad = np.asarray(env.Ad)
+            Bd = np.asarray(env.Bd)
+            K = self.K[:, :-1] if self.bias else self.K
+            self.closed_loop = (Ad + Bd.dot(K)).T
+            self.offset = Bd.dot(self.K[:, -1]) if self.bias else 0.0
+            self.env = env
+        return X.dot(self.closed_loop) + self.offset
+
+
+class ShieldController(object):
+    """
+    The piecewise linear controller of a shield. As in Shield.call_shield(),
+    each trajectory keeps using the piece it first found a state in, and a
+    RuntimeError is raised for a state outside of every invariant.
+    """
+
+    def __init__(self, shield):
+        self.shield = shield
+        self.K = np.array([np.asarray(K, dtype=np.float64)
+            for K in shield.K_list])
+        self.env = None
+
+    def reset(self, n):
+        self.pieces = np.full(n, -1)
+
+    def actions(self, X, idx):
+        pieces = self.pieces[idx]
+        missing = pieces < 0
+        if missing.any():
+            pieces[missing] = self.shield.invariants.find(X[missing])
+            if (pieces < 0).any():
+                print(X[pieces < 0])
+                raise RuntimeError(
+                        "No appropriate controller found in shield invocation")
+            self.pieces[idx] = pieces
+        return np.einsum('nij,nj->ni', self.K[pieces], X)
+
+    def transition(self, env, X, U, idx):
+        if not hasattr(env, 'Ad'):
+            return env.transition(X, U)
+        if self.env is not env:
+            Ad = np.asarray(env.Ad)
+            Bd = np.asarray(env.Bd)
+            self.closed_loop = np.array([(Ad + Bd.dot(K)).T for K in self.K])
+            self.env = env
+        pieces = self.pieces[idx]
+        X2 = np.empty_like(X)
+        for p in np.unique(pieces):
+            rows = pieces == p
+            X2[rows] = X[rows].dot(self.closed_loop[p])
+        return X2
+
+
+def rollout(env, controller, X0, steps, E0=None, safe=True,
+            stop_on_terminal=True):
+    """
+    Simulate a controller from many initial states at once. The states of
+    all trajectories are advanced together as the rows of one array.
+
+    Arguments:
+        env (Environment or PolySysEnvironment): the environment, whose
+            batched methods define the dynamics, rewards and terminal states
+        controller (LinearController or ShieldController): the controller
+        X0 (np.array): initial states, one per row
+        steps (int): the number of steps of every trajectory
+        E0 (np.array): initial extra variables, sampled if needed and not
+            given
+        safe (bool): as in Environment.step()
+        stop_on_terminal (bool): whether a trajectory stops after reaching
+            a terminal state, or keeps going as Environment.step() allows
+
+    Returns:
+        (np.array, np.array, np.array, np.array, np.array): the states, of
+        shape (N, steps + 1, state_dim), the actions and the rewards of each
+        step, the terminal flags of each step and for each trajectory the
+        first step whose successor is unsafe or gets the bad reward, or -1.
+        After a trajectory stops its state is repeated and its actions and
+        rewards are zero.
+    """
+    X = np.array(X0, dtype=np.float64).reshape(-1, env.state_dim)
+    n = len(X)
+    E = E0
+    if E is None and getattr(env, 'ev_min', None) is not None:
+        _, E = env.reset_batch(n)
+    if E is not None:
+        E = np.array(E, dtype=np.float64)
+
+    states = np.zeros((n, steps + 1, env.state_dim))
+    actions = np.zeros((n, steps, env.action_dim))
+    rewards = np.zeros((n, steps))
+    terminals = np.zeros((n, steps), dtype=bool)
+    first_violation = np.full(n, -1)
+    states[:, 0] = X
+
+    controller.reset(n)
+    active = np.ones(n, dtype=bool)
+    for t in range(steps):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            states[:, t+1:] = states[:, t:t+1]
+            break
+        Xa = X[idx]
+        U = controller.actions(Xa, idx)
+        X2 = controller.transition(env, Xa, U, idx)
+        Ea = None
+        if E is not None:
+            Ea = E[idx]
+            if env.ev_func is not None:
+                Ea = env.extra_vars_batch(X2, U, Ea)
+                E[idx] = Ea
+        r, terminal = env.observation_batch(X2, U, Ea, safe=safe)
+
+        X[idx] = X2
+        states[:, t+1] = X
+        actions[idx, t] = U
+        rewards[idx, t] = r
+        terminals[idx, t] = terminal
+
+        violation = (r == env.bad_reward) | env.unsafe_batch(X2)
+        first = idx[violation & (first_violation[idx] < 0)]
+        first_violation[first] = t
+        if stop_on_terminal:
+            active[idx[terminal]] = False
+
+    return states, actions, rewards, terminals, first_violation
@@ -1,11 +1,13 @@
 from distutils.core import setup, Extension
 import os
 
+import numpy
+
 os.environ["CC"] = "g++"
 os.environ["CXX"] = "g++"
 
 module1 = Extension('synthesis',
-                    include_dirs = ['/home/greg/Documents/eigen'],
+                    include_dirs = ['/home/greg/Documents/eigen', numpy.get_include()],
                     libraries = ['gmp', 'mpfr', 'apron', 't1pD', 'boxD', 'polkaMPQ'],
                     sources = ['abstract.cpp', 'synthesis.cpp'],
                     extra_compile_args = ['-std=c++17', '-g', '-O0']
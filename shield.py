@@ -3,6 +3,8 @@ from metrics import timeit
 from main import *
 import scipy.optimize
 import Environment
+from polytopes import PolytopeUnion
+from rollout import rollout, ShieldController
 
 import os
 import re
@@ -42,194 +44,196 @@ class Shield(object):
             inv_list (list of polytopes): The initial invariants.
         """
         self.env = env
+        self.synthesis_env_cache = None
 
         self.K_list = [] if K_list is None else K_list
         self.inv_list = [] if inv_list is None else inv_list
         self.cover_list = [] if cover_list is None else cover_list
 
+        # set_covers() indexes the pieces itself
         if K_list is not None:
             self.set_covers(bound)
+        else:
+            self.index_pieces()
 
         self.last_shield = -1
 
-    def set_covers(self, bound=20):
-        self.use_list = []
+    def index_pieces(self):
+        """Rebuild the lookup structures for the pieces of this shield.
+
+        This must be called whenever inv_list changes. The invariants are
+        indexed by their own bounding boxes rather than by the boxes in
+        cover_list, since an invariant may extend beyond its cover.
+        """
+        self.invariants = PolytopeUnion(self.inv_list, self.env.state_dim,
+                index=True)
+
+    def get_pieces(self):
+        """The controllers, invariants and covers which define this shield."""
+        return (self.K_list, self.inv_list, self.cover_list,
+                getattr(self, 'use_list', []))
+
+    def set_pieces(self, pieces):
+        """Replace the definition of this shield with one from get_pieces().
+
+        This avoids recomputing the covers when a shield trained elsewhere is
+        copied, e.g., into a rollout worker process.
+        """
+        self.K_list, self.inv_list, self.cover_list, self.use_list = pieces
+        self.index_pieces()
+        self.last_shield = -1
+
+    def synthesis_env(self):
+        """The environment in the form taken by the synthesis extension.
+
+        The unsafe polytopes come from the stacked unsafe set of the
+        environment, whose list form is only built once. Linear environments
+        without unsafe polytopes are unsafe outside of [x_min, x_max].
+        """
+        if self.synthesis_env_cache is not None:
+            return self.synthesis_env_cache
+
         dt = self.env.timestep if self.env.continuous else 0.01
         if isinstance(self.env, Environment.PolySysEnvironment):
-            unsafe_space = []
-            for (A, b) in zip(self.env.unsafe_A, self.env.unsafe_b):
-                unsafe_space.append((A.tolist(), np.asarray(b).flatten().tolist()))
+            unsafe_space = self.env.unsafe_set.polytopes()
             if self.env.approx:
                 env = (self.env.breaks, self.env.break_breaks,
-                        list(map(lambda x: x.tolist(), self.env.lower_As)),
-                        list(map(lambda x: x.tolist(), self.env.lower_Bs)),
-                        list(map(lambda x: x.tolist(), self.env.upper_As)),
-                        list(map(lambda x: x.tolist(), self.env.upper_Bs)),
+                        list(self.env.lower_As), list(self.env.lower_Bs),
+                        list(self.env.upper_As), list(self.env.upper_Bs),
                         self.env.continuous, dt, unsafe_space)
             else:
                 env = (self.env.capsule, self.env.continuous, dt, unsafe_space)
         else:
             # unsafe_space format: [(matrix, vector}]
-            if self.env.unsafe_A is not None:
-                unsafe_space = []
-                for (A, b) in zip(self.env.unsafe_A, self.env.unsafe_b):
-                    unsafe_space.append((A.tolist(), np.asarray(b).flatten().tolist()))
+            if self.env.unsafe_set is not None:
+                unsafe_space = self.env.unsafe_set.polytopes()
             else:
                 unsafe_space = []
-                safe_min = self.env.x_min
-                safe_max = self.env.x_max
-                for i in range(len(safe_min)):
-                    A1 = [[0.0] * len(safe_min)]
-                    A1[0][i] = 1.0
-                    b1 = [safe_min[i]]
-                    unsafe_space.append((A1, b1))
-                    A2 = [[0.0] * len(safe_max)]
-                    A2[0][i] = -1.0
-                    b2 = [-safe_max[i]]
-                    unsafe_space.append((A2, b2))
-            env = (self.env.A.tolist(), self.env.B.tolist(),
-                    self.env.continuous, dt, unsafe_space)
-        covers = []
-        for inv in self.cover_list:
-            covers.append((inv[0].tolist(),
-                inv[1].flatten().tolist()[0],
-                inv[2].flatten().tolist()[0],
-                inv[3].flatten().tolist()[0]))
-
-        controllers = []
-        for k in self.K_list:
-            controllers.append(k.tolist())
+                # Flat bounds, since the extension takes at most 2-D arrays
+                safe_min = np.asarray(self.env.x_min, dtype=np.float64).ravel()
+                safe_max = np.asarray(self.env.x_max, dtype=np.float64).ravel()
+                d = len(safe_min)
+                for i in range(d):
+                    A1 = np.zeros((1, d))
+                    A1[0, i] = 1.0
+                    unsafe_space.append((A1, safe_min[i:i+1]))
+                    A2 = np.zeros((1, d))
+                    A2[0, i] = -1.0
+                    unsafe_space.append((A2, -safe_max[i:i+1]))
+            # The synthesis extension gets the precomputed discrete
+            # transition, so it agrees with the environment
+            env = (self.env.Ad, self.env.Bd, False, dt, unsafe_space)
+        self.synthesis_env_cache = env
+        return env
+
+    def set_covers(self, bound=20):
+        self.use_list = []
+        env = self.synthesis_env()
+        # The extension reads NumPy arrays directly
+        covers = [tuple(inv) for inv in self.cover_list]
+        controllers = list(self.K_list)
 
         ret = synthesis.get_covers(env, controllers, covers, bound)
 
         for (A, b) in ret:
-            self.use_list.append((np.matrix(A),
-                np.matrix([[x] for x in b])))
+            self.use_list.append((np.asmatrix(A), np.asmatrix(b).T))
+        self.index_pieces()
 
     @timeit
-    def train_shield(self, old_shield, actor, bound=20):
+    def train_shield(self, old_shield, actor, bound=20, threads=0):
         """Train a shield.
 
         This simply invokes the C++ extension, see synthesis.cpp for a more
         detailed description of the synthesis algorithm. This algorithm
         requires the old shield to use as a starting point for synthesis.
+        Synthesis is seeded from numpy, so that np.random.seed() makes it
+        deterministic whatever the number of threads.
 
         Arguments:
             old_shield (Shield): The previous shield for this environment.
+            threads (int): The number of threads evaluating split candidates,
+                or 0 to use one per core.
         """
 
-        dt = self.env.timestep if self.env.continuous else 0.01
-
-        if isinstance(self.env, Environment.PolySysEnvironment):
-            unsafe_space = []
-            for (A, b) in zip(self.env.unsafe_A, self.env.unsafe_b):
-                unsafe_space.append((A.tolist(), np.asarray(b).flatten().tolist()))
-            if self.env.approx:
-                env = (self.env.breaks, self.env.break_breaks,
-                        list(map(lambda x: x.tolist(), self.env.lower_As)),
-                        list(map(lambda x: x.tolist(), self.env.lower_Bs)),
-                        list(map(lambda x: x.tolist(), self.env.upper_As)),
-                        list(map(lambda x: x.tolist(), self.env.upper_Bs)),
-                        self.env.continuous, dt, unsafe_space)
-            else:
-                env = (self.env.capsule, self.env.continuous, dt, unsafe_space)
-        else:
-            # unsafe_space format: [(matrix, vector}]
-            if self.env.unsafe_A is not None:
-                unsafe_space = []
-                for (A, b) in zip(self.env.unsafe_A, self.env.unsafe_b):
-                    unsafe_space.append((A.tolist(), np.asarray(b).flatten().tolist()))
-            else:
-                unsafe_space = []
-                safe_min = self.env.x_min
-                safe_max = self.env.x_max
-                for i in range(len(safe_min)):
-                    A1 = [[0.0] * len(safe_min)]
-                    A1[0][i] = 1.0
-                    b1 = [safe_min[i]]
-                    unsafe_space.append((A1, b1))
-                    A2 = [[0.0] * len(safe_max)]
-                    A2[0][i] = -1.0
-                    b2 = [-safe_max[i]]
-                    unsafe_space.append((A2, b2))
-            env = (self.env.A.tolist(), self.env.B.tolist(),
-                    self.env.continuous, dt, unsafe_space)
+        env = self.synthesis_env()
 
         # We need to compute bounding boxes for these polytopes. The
         # polytopes are represented as a set of linear constraints. In general
         # we can find the maximum or minimum value for a particular dimension
         # i by solving a linear optimization problem with objective x_i or
         # -x_i and the existing constraints.
-        covers = []
-        for inv in old_shield.cover_list:
-            covers.append((inv[0].tolist(),
-                inv[1].flatten().tolist()[0],
-                inv[2].flatten().tolist()[0],
-                inv[3].flatten().tolist()[0]))
-
-        controllers = []
-        for k in old_shield.K_list:
-            controllers.append(k.tolist())
-
-        def measure(K, space, dataset):
-            A = np.matrix(space[0])
-            b = np.matrix([[x] for x in space[1]])
-            lower = np.matrix([[x] for x in space[2]])
-            upper = np.matrix([[x] for x in space[3]])
-            contr = np.matrix(K)
-            grad = np.zeros_like(K)
-            total = 0.0
+        covers = [tuple(inv) for inv in old_shield.cover_list]
+        controllers = list(old_shield.K_list)
+
+        def measure(K, space, dataset, seed):
+            # K is either one controller or an array of candidate
+            # controllers, which are all measured from the same initial
+            # states. K and space are read only views of the extension's
+            # memory and must not be kept after returning. Every
+            # trajectory is simulated together, with one actor query per step.
+            #
+            # dataset is None on the first call for a cover. The initial
+            # states and the actions of the actor in them are then sampled
+            # once and returned as the dataset, which synthesis.cpp passes
+            # back to every later call for the same cover. The candidates of
+            # all of those calls are therefore compared on the same states.
+            # The states are sampled with the given seed, which synthesis.cpp
+            # draws per split candidate, and not with the global numpy
+            # generator, which the threads of the extension share.
+            Ks = np.asarray(K, dtype=np.float64)
+            single = Ks.ndim == 2
+            if single:
+                Ks = Ks[np.newaxis]
+            (c, p, d) = Ks.shape
             its = 10
-            for _ in range(its):
-                # sample an initial state from the cover of this controller
-                iters = 0
-                while True:
-                    x = np.random.random_sample(lower.shape)
-                    x = lower + np.multiply(x, upper - lower)
-                    if (A * x <= b).all():
-                        break
-                    iters += 1
-                    if iters > 200:
-                        # This space is very low-density in the region
-                        # In this case we will just return some value because
-                        # the probability of the state of the system reaching
-                        # this space is low
-                        return (0.0, 0.0, dataset)
-                    #else:
-                    #    print x
-                    #    print A * x
-                    #    print b
-                length = 10
-                for _ in range(length):
-                    u_n = actor.predict(x.transpose()).T
-                    u_k = contr * x
-                    diff = np.linalg.norm(u_n - u_k)
-                    if isinstance(self.env, Environment.Environment):
-                        xp = self.env.A * x + self.env.B * u_k
-                    else:
-                        xp = self.env.polyf(x, u_k)
-                    if self.env.continuous:
-                        x = x + self.env.timestep * xp
-                    else:
-                        x = xp
-                    total += diff / length
-                    grad += (1.0 / length) * (u_k - u_n) * x.T
-            return (((1.0 / its) * grad).tolist(), -total / its, dataset)
+            if dataset is None:
+                # sample initial states from the cover of this controller
+                X0 = synthesis.sample_polytope(space[0], space[1], space[2],
+                        space[3], its, seed)
+                dataset = {
+                    'states': X0,
+                    'actions': None if X0 is None else
+                        np.asarray(actor.predict(X0)).reshape(its, p),
+                }
+            X0 = dataset['states']
+            if X0 is None:
+                # This space has an empty interior, so the probability of
+                # the state of the system reaching it is low. In this case
+                # we will just return some value.
+                if single:
+                    return (0.0, 0.0, dataset)
+                return ([0.0] * c, [0.0] * c, dataset)
+            X = np.tile(X0, (c, 1))
+            contr = np.repeat(Ks, its, axis=0)
+            grad = np.zeros_like(contr)
+            total = np.zeros(c * its)
+            length = 10
+            for t in range(length):
+                if t == 0:
+                    u_n = np.tile(dataset['actions'], (c, 1))
+                else:
+                    u_n = np.asarray(actor.predict(X)).reshape(c * its, p)
+                u_k = np.einsum('nij,nj->ni', contr, X)
+                total += np.linalg.norm(u_n - u_k, axis=1)
+                X = self.env.transition(X, u_k)
+                grad += np.einsum('ni,nj->nij', u_k - u_n, X)
+            grad = grad.reshape(c, its, p, d).sum(axis=1) / (length * its)
+            score = -total.reshape(c, its).sum(axis=1) / (length * its)
+            if single:
+                return (grad[0], score[0], dataset)
+            return (grad, score, dataset)
 
         ret = synthesis.synthesize_shield(env, covers, controllers,
-                bound, measure)
+                bound, measure, threads, np.random.randint(2 ** 31))
 
         self.K_list = []
         self.inv_list = []
         self.cover_list = []
         for (k, (A, b), (sA, sb, l, u)) in ret:
-            self.K_list.append(np.matrix(k))
-            self.inv_list.append((np.matrix(A),
-                np.matrix([[x] for x in b])))
-            self.cover_list.append((np.matrix(sA),
-                np.matrix([[x] for x in sb]),
-                np.matrix([[x] for x in l]),
-                np.matrix([[x] for x in u])))
+            self.K_list.append(np.asmatrix(k))
+            self.inv_list.append((np.asmatrix(A), np.asmatrix(b).T))
+            self.cover_list.append((np.asmatrix(sA), np.asmatrix(sb).T,
+                np.asmatrix(l).T, np.asmatrix(u).T))
         self.set_covers(bound)
         print("Controllers:")
         print(self.K_list)
@@ -267,19 +271,16 @@ class Shield(object):
             bool: True if the action is unsafe.
         """
         if isinstance(self.env, Environment.Environment):
-            n = self.env.A * x + self.env.B * u
+            n = self.env.Ad * x + self.env.Bd * u
         else:
             n = self.env.polyf(x, u)
+            if self.env.continuous:
+                n = x + self.env.timestep * n
 
-        if self.env.continuous:
-            n = x + self.env.timestep * n
-
-        for (A, b) in self.inv_list:
-            if (A * n <= b).all():
-                # We are inside the invariant of some piece of the shield
-                self.last_shield = -1
-                # print A, b, n, A * n
-                return False
+        if self.invariants.find_one(n) >= 0:
+            # We are inside the invariant of some piece of the shield
+            self.last_shield = -1
+            return False
         #print("Shield called in state:")
         #print(x)
         #print("Next state:")
@@ -287,6 +288,27 @@ class Shield(object):
 
         return True
 
+    def detector_batch(self, X, U):
+        """Determine which of many actions are unsafe under this shield.
+
+        Unlike detector(), this does not reset the piece remembered by
+        call_shield(); callers running several trajectories have to keep
+        track of that for each of them.
+
+        Arguments:
+            X (np.array): current states, one per row
+            U (np.array): current actions, one per row
+
+        Returns:
+            (np.array, np.array): a boolean array which is True where the
+            action is unsafe, and for each row the index of the first piece
+            whose invariant contains the next state, or -1 if there is none
+        """
+        X = np.asarray(X, dtype=np.float64).reshape(-1, self.env.state_dim)
+        U = np.asarray(U, dtype=np.float64).reshape(-1, self.env.action_dim)
+        pieces = self.invariants.find(self.env.transition(X, U))
+        return pieces < 0, pieces
+
     def call_shield(self, x):
         """Choose an action for a particular state.
 
@@ -299,11 +321,10 @@ class Shield(object):
         if self.last_shield >= 0:
             return self.K_list[self.last_shield] * x
 
-        for i in range(len(self.K_list)):
-            (A, b) = self.inv_list[i]
-            if (A * x <= b).all():
-                self.last_shield = i
-                return self.K_list[i] * x
+        i = self.invariants.find_one(x)
+        if i >= 0:
+            self.last_shield = i
+            return self.K_list[i] * x
         print(x)
         for (A, b) in self.inv_list:
             print(A)
@@ -604,17 +625,12 @@ class Shield(object):
             sample_ep (int, optional): epsoides
             sample_step (int, optional): step in each epsoide
         """
-        max_boundary = np.zeros([self.env.state_dim, 1])
-        min_boundary = np.zeros([self.env.state_dim, 1])
-
-        for ep in xrange(sample_ep):
-            x = self.env.reset()
-            for i in xrange(sample_step):
-                u = self.call_shield(x)
-                max_boundary, min_boundary = metrics.find_boundary(
-                        x, max_boundary, min_boundary)
-                # step
-                x, _, terminal = self.env.step(u)
+        X0, E0 = self.env.reset_batch(sample_ep)
+        states, _, _, _, _ = rollout(self.env, ShieldController(self), X0,
+                sample_step, E0, stop_on_terminal=False)
+        visited = states[:, :sample_step].reshape(-1, self.env.state_dim)
+        max_boundary = np.maximum(visited.max(axis=0), 0.0).reshape(-1, 1)
+        min_boundary = np.minimum(visited.min(axis=0), 0.0).reshape(-1, 1)
 
         print('max_boundary:\n{}\nmin_boundary:\n{}'.format(
                 max_boundary, min_boundary))
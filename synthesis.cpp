@@ -1,8 +1,14 @@
+#include <atomic>
+#include <exception>
+#include <mutex>
 #include <optional>
 #include <random>
+#include <thread>
 
 //#include <glpk.h>
 #include <Python.h>
+#define NPY_NO_DEPRECATED_API NPY_1_7_API_VERSION
+#include <numpy/arrayobject.h>
 
 #include "abstract.hpp"
 
@@ -691,6 +697,242 @@ bool controller_is_safe(const Environment& env, const Controller& controller,
   return true;
 }
 
+/**
+ * The random number generator used for sampling states and controllers.
+ * Each thread has its own generator, see synthesize_shield().
+ */
+static std::mt19937& random_engine() {
+  thread_local std::mt19937 generator;
+  return generator;
+}
+
+/**
+ * A matrix with entries drawn uniformly from [-1, 1], like
+ * Eigen::MatrixXd::Random but using the generator of the current thread.
+ */
+static Eigen::MatrixXd random_matrix(int rows, int cols) {
+  std::uniform_real_distribution<double> uniform(-1.0, 1.0);
+  Eigen::MatrixXd ret(rows, cols);
+  for (int j = 0; j < cols; j++) {
+    for (int i = 0; i < rows; i++) {
+      ret(i, j) = uniform(random_engine());
+    }
+  }
+  return ret;
+}
+
+/**
+ * Find the center of the largest ball inside a bounded polytope.
+ *
+ * This maximizes r subject to `a_i x + r ||a_i|| <= b_i` with a log barrier
+ * method. The search starts from `start` with r small enough that the start
+ * is strictly feasible, so no separate feasibility phase is needed.
+ *
+ * \param a The constraint matrix. The polytope it describes must be bounded
+ *        and none of its rows may be zero.
+ * \param b The constraint offsets.
+ * \param start Any point to start the search from.
+ * \return The center of the ball and its radius. The radius is not positive
+ *         if the polytope has an empty interior.
+ */
+std::pair<Eigen::VectorXd, double> chebyshev_center(const Eigen::MatrixXd& a,
+    const Eigen::VectorXd& b, const Eigen::VectorXd& start) {
+  int n = a.cols();
+  Eigen::VectorXd norms = a.rowwise().norm();
+  // The constraints on z = (x, r) are c z <= b.
+  Eigen::MatrixXd c(a.rows(), n + 1);
+  c << a, norms;
+  Eigen::VectorXd z(n + 1);
+  z.head(n) = start;
+  double r = std::numeric_limits<double>::max();
+  for (int i = 0; i < a.rows(); i++) {
+    r = std::min(r, (b(i) - a.row(i).dot(start)) / norms(i));
+  }
+  z(n) = r - 1.0;
+
+  // Minimize -t r - sum_i log(b_i - c_i z) for increasing t.
+  auto barrier = [&](const Eigen::VectorXd& y, double t) {
+    Eigen::VectorXd slack = b - c * y;
+    if (slack.minCoeff() <= 0) {
+      return std::numeric_limits<double>::infinity();
+    }
+    return -t * y(n) - slack.array().log().sum();
+  };
+  for (double t = 1.0; a.rows() / t > 1e-8; t *= 10.0) {
+    for (int j = 0; j < 50; j++) {
+      Eigen::VectorXd inv_slack = (b - c * z).cwiseInverse();
+      Eigen::VectorXd grad = c.transpose() * inv_slack;
+      grad(n) -= t;
+      Eigen::MatrixXd hess = c.transpose() * inv_slack.cwiseAbs2().asDiagonal()
+        * c;
+      Eigen::VectorXd step = -hess.ldlt().solve(grad);
+      double decrement = -grad.dot(step);
+      if (!(decrement > 1e-10)) {
+        break;
+      }
+      // Backtracking line search
+      double s = 1.0;
+      double f = barrier(z, t);
+      while (barrier(z + s * step, t) > f - 0.25 * s * decrement) {
+        s /= 2;
+        if (s < 1e-12) {
+          break;
+        }
+      }
+      if (s < 1e-12) {
+        break;
+      }
+      z += s * step;
+    }
+  }
+  return std::make_pair(Eigen::VectorXd(z.head(n)), z(n));
+}
+
+/**
+ * Sample points from a bounded polytope with a hit-and-run walk.
+ *
+ * Each step of the walk picks a random direction and moves to a uniformly
+ * random point of the chord through the current point in that direction.
+ * Directions are drawn from a normal distribution with covariance
+ * `directions * directions^T`, which should be shaped like the polytope so
+ * that the walk mixes quickly in thin polytopes. The walk starts from
+ * `start`, which must be in the interior, and takes `thin` steps between
+ * samples.
+ *
+ * \param a The constraint matrix.
+ * \param b The constraint offsets.
+ * \param start An interior point of the polytope.
+ * \param directions The transformation applied to standard normal
+ *        directions.
+ * \param n The number of samples.
+ * \param burn The number of steps before the first sample.
+ * \param thin The number of steps between samples.
+ * \param generator The random number generator.
+ * \return The samples, one per row.
+ */
+Eigen::MatrixXd hit_and_run(const Eigen::MatrixXd& a, const Eigen::VectorXd& b,
+    const Eigen::VectorXd& start, const Eigen::MatrixXd& directions, int n,
+    int burn, int thin, std::mt19937& generator) {
+  std::normal_distribution<double> normal;
+  std::uniform_real_distribution<double> uniform;
+  Eigen::VectorXd x = start;
+  Eigen::VectorXd slack = b - a * x;
+  Eigen::VectorXd g(x.size());
+  Eigen::MatrixXd ret(n, x.size());
+  for (int i = 0; i < burn + n * thin; i++) {
+    for (int j = 0; j < g.size(); j++) {
+      g(j) = normal(generator);
+    }
+    Eigen::VectorXd u = directions * g;
+    Eigen::VectorXd au = a * u;
+    double lo = -std::numeric_limits<double>::max();
+    double hi = std::numeric_limits<double>::max();
+    for (int j = 0; j < au.size(); j++) {
+      if (au(j) > 0) {
+        hi = std::min(hi, std::max(slack(j), 0.0) / au(j));
+      } else if (au(j) < 0) {
+        lo = std::max(lo, std::max(slack(j), 0.0) / au(j));
+      }
+    }
+    if (hi > lo) {
+      double t = lo + uniform(generator) * (hi - lo);
+      x += t * u;
+      slack -= t * au;
+    }
+    if (i >= burn && (i - burn) % thin == thin - 1) {
+      ret.row((i - burn) / thin) = x;
+    }
+  }
+  return ret;
+}
+
+/**
+ * Sample points from the polytope of a space.
+ *
+ * The polytope is intersected with the bounding box of the space. Dimensions
+ * in which the bounding box has width zero are fixed to that value and the
+ * others are sampled by a hit-and-run walk from the Chebyshev center, so the
+ * time taken does not depend on the volume of the space. The directions of
+ * the walk follow the Dikin ellipsoid of the log barrier at the center.
+ *
+ * \param s The space to sample from.
+ * \param n The number of samples.
+ * \param generator The random number generator.
+ * \return The samples, one per row, or nothing if the space has no interior.
+ */
+std::optional<Eigen::MatrixXd> sample_polytope(const Space& s, int n,
+    std::mt19937& generator) {
+  int dim = s.bb_lower.size();
+  std::vector<int> free;
+  Eigen::VectorXd fixed = (s.bb_lower + s.bb_upper) / 2;
+  for (int i = 0; i < dim; i++) {
+    if (std::abs(s.bb_upper(i) - s.bb_lower(i)) > 0.00000001) {
+      free.push_back(i);
+      fixed(i) = 0;
+    }
+  }
+  int m = s.space.weights.rows();
+  int f = free.size();
+  Eigen::MatrixXd ret = fixed.transpose().replicate(n, 1);
+  if (f == 0) {
+    if (m > 0 && (s.space.weights * fixed - s.space.biases).maxCoeff()
+        > 0.00000001) {
+      return {};
+    }
+    return ret;
+  }
+
+  // Constraints on the free dimensions, followed by their bounding box.
+  // Constraints which only involve fixed dimensions are dropped once they
+  // are known to hold.
+  std::vector<int> rows;
+  for (int i = 0; i < m; i++) {
+    double bias = s.space.biases(i) - s.space.weights.row(i).dot(fixed);
+    double norm = 0;
+    for (int j : free) {
+      norm += std::abs(s.space.weights(i, j));
+    }
+    if (norm > 1e-12) {
+      rows.push_back(i);
+    } else if (bias < -0.00000001) {
+      return {};
+    }
+  }
+  int k = rows.size();
+  Eigen::MatrixXd a = Eigen::MatrixXd::Zero(k + 2 * f, f);
+  Eigen::VectorXd b(k + 2 * f);
+  for (int i = 0; i < k; i++) {
+    b(i) = s.space.biases(rows[i]) - s.space.weights.row(rows[i]).dot(fixed);
+    for (int j = 0; j < f; j++) {
+      a(i, j) = s.space.weights(rows[i], free[j]);
+    }
+  }
+  Eigen::VectorXd center(f);
+  for (int j = 0; j < f; j++) {
+    a(k + 2 * j, j) = 1;
+    b(k + 2 * j) = s.bb_upper(free[j]);
+    a(k + 2 * j + 1, j) = -1;
+    b(k + 2 * j + 1) = -s.bb_lower(free[j]);
+    center(j) = (s.bb_lower(free[j]) + s.bb_upper(free[j])) / 2;
+  }
+
+  auto cheb = chebyshev_center(a, b, center);
+  if (cheb.second <= 0) {
+    return {};
+  }
+  Eigen::VectorXd inv_slack = (b - a * cheb.first).cwiseInverse();
+  Eigen::MatrixXd hess = a.transpose() * inv_slack.cwiseAbs2().asDiagonal() * a;
+  // With hess = U^T U, U^-1 g has covariance hess^-1.
+  Eigen::MatrixXd directions = hess.llt().matrixU().solve(
+      Eigen::MatrixXd::Identity(f, f));
+  Eigen::MatrixXd samples = hit_and_run(a, b, cheb.first, directions, n,
+      10 * f, f, generator);
+  for (int j = 0; j < f; j++) {
+    ret.col(free[j]) = samples.col(j);
+  }
+  return ret;
+}
+
 /**
  * Measure the safety of a controller in an environment.
  *
@@ -700,7 +942,8 @@ bool controller_is_safe(const Environment& env, const Controller& controller,
  * \param env The environment under control.
  * \param k The controller.
  * \param initial The states the controller should be safe in.
- * \return A measure of the safety of this controller.
+ * \return A measure of the safety of this controller. This is the largest
+ *         double if `initial` has no interior to sample from.
  */
 double measure_safety(const Environment& env, const Eigen::MatrixXd& k,
     const Space& initial, int bound) {
@@ -712,25 +955,14 @@ double measure_safety(const Environment& env, const Eigen::MatrixXd& k,
   //for (int j = 0; j < bound; j++) {
   //  n_step *= update;
   //}
+  // Sample initial states from the initial space.
+  std::optional<Eigen::MatrixXd> xs = sample_polytope(initial, iters,
+      random_engine());
+  if (!xs) {
+    return std::numeric_limits<double>::max();
+  }
   for (int i = 0; i < iters; i++) {
-    // Sample x from the initial space.
-    Eigen::VectorXd x;
-    while (true) {
-      x = initial.bb_lower + Eigen::VectorXd::Random(
-          initial.bb_lower.size()).cwiseProduct(
-          initial.bb_upper - initial.bb_lower);
-      Eigen::VectorXd ax = initial.space.weights * x;
-      bool inside = true;
-      for (int j = 0; j < ax.size(); j++) {
-        if (ax(j) > initial.space.biases(j)) {
-          inside = false;
-          break;
-        }
-      }
-      if (inside) {
-        break;
-      }
-    }
+    Eigen::VectorXd x = xs.value().row(i);
     int is = bound > 0 ? bound : 20;
     // See how safe x is.
     for (int j = 0; j < is; j++) {
@@ -778,7 +1010,7 @@ std::optional<Eigen::MatrixXd> find_counterexample(const Environment& env,
       // If the controller is unsafe then we've found a counterexample.
       return k;
     }
-    Eigen::MatrixXd delta = Eigen::MatrixXd::Random(k.rows(), k.cols());
+    Eigen::MatrixXd delta = random_matrix(k.rows(), k.cols());
     double sim_plus = measure_safety(env, k + v * delta, cover, bound);
     double sim_minus = measure_safety(env, k - v * delta, cover, bound);
     if (sim_plus <= 0.0) {
@@ -858,29 +1090,48 @@ std::optional<Interval> compute_safe_space(
   return itv;
 }
 
-// Convert a python list of doubles to an Eigen::VectorXd
-static Eigen::VectorXd pylist_to_vector(PyObject* list) {
-  Py_ssize_t size = PyList_Size(list);
-  Eigen::VectorXd ret(size);
-  for (Py_ssize_t i = 0; i < size; i++) {
-    PyObject* elem = PyList_GetItem(list, i);
-    ret(i) = PyFloat_AsDouble(elem);
+typedef Eigen::Matrix<double, Eigen::Dynamic, Eigen::Dynamic, Eigen::RowMajor>
+  RowMatrixXd;
+
+// View a python object as a NumPy array of doubles. Arrays which are already
+// C contiguous arrays of doubles are used as they are, anything else
+// supporting the buffer protocol or nested sequences of numbers is
+// converted. Returns a new reference, or NULL with an exception set.
+static PyArrayObject* pyarray_of_doubles(PyObject* obj) {
+  return (PyArrayObject*) PyArray_FROMANY(obj, NPY_DOUBLE, 0, 2,
+      NPY_ARRAY_IN_ARRAY);
+}
+
+// Convert a python array of doubles of any shape to an Eigen::VectorXd
+static Eigen::VectorXd pyarray_to_vector(PyObject* obj) {
+  PyArrayObject* arr = pyarray_of_doubles(obj);
+  if (arr == NULL) {
+    return Eigen::VectorXd(0);
   }
+  Eigen::VectorXd ret = Eigen::Map<const Eigen::VectorXd>(
+      (const double*) PyArray_DATA(arr), PyArray_SIZE(arr));
+  Py_DECREF(arr);
   return ret;
 }
 
-static Eigen::MatrixXd pylist_to_matrix(PyObject* list) {
-  Py_ssize_t rows = PyList_Size(list);
-  if (rows == 0) {
+// Convert a python array of doubles to an Eigen::MatrixXd. An empty array is
+// a 0 x 0 matrix and any other one dimensional array is a single row.
+static Eigen::MatrixXd pyarray_to_matrix(PyObject* obj) {
+  PyArrayObject* arr = pyarray_of_doubles(obj);
+  if (arr == NULL) {
     return Eigen::MatrixXd(0, 0);
   }
-  PyObject* first = PyList_GetItem(list, 0);
-  Py_ssize_t cols = PyList_Size(first);
-  Eigen::MatrixXd ret(rows, cols);
-  for (Py_ssize_t i = 0; i < rows; i++) {
-    Eigen::VectorXd row = pylist_to_vector(PyList_GetItem(list, i));
-    ret.row(i) = row;
+  Eigen::Index rows = 1;
+  Eigen::Index cols = PyArray_SIZE(arr);
+  if (PyArray_NDIM(arr) == 2) {
+    rows = PyArray_DIM(arr, 0);
+    cols = PyArray_DIM(arr, 1);
+  } else if (cols == 0) {
+    rows = 0;
   }
+  Eigen::MatrixXd ret = Eigen::Map<const RowMatrixXd>(
+      (const double*) PyArray_DATA(arr), rows, cols);
+  Py_DECREF(arr);
   return ret;
 }
 
@@ -888,7 +1139,7 @@ static std::vector<Eigen::MatrixXd> pylist_to_matrix_list(PyObject* list) {
   Py_ssize_t size = PyList_Size(list);
   std::vector<Eigen::MatrixXd> ret;
   for (int i = 0; i < size; i++) {
-    ret.push_back(pylist_to_matrix(PyList_GetItem(list, i)));
+    ret.push_back(pyarray_to_matrix(PyList_GetItem(list, i)));
   }
   return ret;
 }
@@ -902,22 +1153,22 @@ static std::vector<Space> pylist_to_space(PyObject* list) {
   std::vector<Space> ret = {};
   for (Py_ssize_t i = 0; i < len; i++) {
     PyObject* lc = PyList_GetItem(list, i);
-    Eigen::MatrixXd a = pylist_to_matrix(PyTuple_GetItem(lc, 0));
+    Eigen::MatrixXd a = pyarray_to_matrix(PyTuple_GetItem(lc, 0));
     if (PyErr_Occurred()) {
       PyErr_PrintEx(0);
       throw std::runtime_error("pylist_to_space after a: " + std::to_string(i));
     }
-    Eigen::VectorXd b = pylist_to_vector(PyTuple_GetItem(lc, 1));
+    Eigen::VectorXd b = pyarray_to_vector(PyTuple_GetItem(lc, 1));
     if (PyErr_Occurred()) {
       PyErr_PrintEx(0);
       throw std::runtime_error("pylist_to_space after b: " + std::to_string(i));
     }
-    Eigen::VectorXd l = pylist_to_vector(PyTuple_GetItem(lc, 2));
+    Eigen::VectorXd l = pyarray_to_vector(PyTuple_GetItem(lc, 2));
     if (PyErr_Occurred()) {
       PyErr_PrintEx(0);
       throw std::runtime_error("pylist_to_space after l: " + std::to_string(i));
     }
-    Eigen::VectorXd u = pylist_to_vector(PyTuple_GetItem(lc, 3));
+    Eigen::VectorXd u = pyarray_to_vector(PyTuple_GetItem(lc, 3));
     if (PyErr_Occurred()) {
       PyErr_PrintEx(0);
       throw std::runtime_error("pylist_to_space after u: " + std::to_string(i));
@@ -936,108 +1187,280 @@ static std::vector<Space> pylist_to_space(PyObject* list) {
   return ret;
 }
 
+// Convert a python list of (A, b) pairs to linear constraints. If a pair can
+// not be converted the constraints so far are returned with the exception
+// set, so callers must check PyErr_Occurred().
 static std::vector<LinCons> pylist_to_lincons(PyObject* list) {
   Py_ssize_t len = PyList_Size(list);
   std::vector<LinCons> ret = {};
   for (Py_ssize_t i = 0; i < len; i++) {
     PyObject* lc = PyList_GetItem(list, i);
-    Eigen::MatrixXd a = pylist_to_matrix(PyTuple_GetItem(lc, 0));
-    Eigen::VectorXd b = pylist_to_vector(PyTuple_GetItem(lc, 1));
+    Eigen::MatrixXd a = pyarray_to_matrix(PyTuple_GetItem(lc, 0));
+    if (PyErr_Occurred()) {
+      break;
+    }
+    Eigen::VectorXd b = pyarray_to_vector(PyTuple_GetItem(lc, 1));
+    if (PyErr_Occurred()) {
+      break;
+    }
     ret.push_back(LinCons(a, b));
   }
   return ret;
 }
 
-// Convert an Eigen::VectorXd to a python list of doubles
-static PyObject* vector_to_pylist(const Eigen::VectorXd& b) {
-  PyObject* ret = PyList_New(b.size());
-  for (Py_ssize_t i = 0; i < b.size(); i++) {
-    PyObject* pi = PyFloat_FromDouble(b(i));
-    PyList_SetItem(ret, i, pi);
-  }
+static void destroy_matrix(PyObject* capsule) {
+  delete (Eigen::MatrixXd*) PyCapsule_GetPointer(capsule,
+      "synthesis.matrix");
+}
+
+static void destroy_vector(PyObject* capsule) {
+  delete (Eigen::VectorXd*) PyCapsule_GetPointer(capsule,
+      "synthesis.vector");
+}
+
+// Move an Eigen::VectorXd into a NumPy array which owns its data
+static PyObject* vector_to_pyarray(Eigen::VectorXd b) {
+  Eigen::VectorXd* owned = new Eigen::VectorXd(std::move(b));
+  npy_intp dims[1] = { owned->size() };
+  PyObject* ret = PyArray_SimpleNewFromData(1, dims, NPY_DOUBLE,
+      owned->data());
+  PyArray_SetBaseObject((PyArrayObject*) ret,
+      PyCapsule_New(owned, "synthesis.vector", &destroy_vector));
   return ret;
 }
 
-static PyObject* matrix_to_pylist(const Eigen::MatrixXd& m) {
-  PyObject* ret = PyList_New(m.rows());
-  for (Py_ssize_t i = 0; i < m.rows(); i++) {
-    PyObject* pyrow = vector_to_pylist(m.row(i));
-    PyList_SetItem(ret, i, pyrow);
-  }
+// Move an Eigen::MatrixXd into a (Fortran ordered) NumPy array which owns its
+// data
+static PyObject* matrix_to_pyarray(Eigen::MatrixXd m) {
+  Eigen::MatrixXd* owned = new Eigen::MatrixXd(std::move(m));
+  npy_intp dims[2] = { owned->rows(), owned->cols() };
+  PyObject* ret = PyArray_New(&PyArray_Type, 2, dims, NPY_DOUBLE, NULL,
+      owned->data(), 0, NPY_ARRAY_FARRAY, NULL);
+  PyArray_SetBaseObject((PyArrayObject*) ret,
+      PyCapsule_New(owned, "synthesis.matrix", &destroy_matrix));
   return ret;
 }
 
+// A read only NumPy view of an Eigen::VectorXd. The view does not own its
+// data, so it must not outlive `b`.
+static PyObject* vector_view(const Eigen::VectorXd& b) {
+  npy_intp dims[1] = { b.size() };
+  return PyArray_New(&PyArray_Type, 1, dims, NPY_DOUBLE, NULL,
+      (void*) b.data(), 0, NPY_ARRAY_C_CONTIGUOUS | NPY_ARRAY_ALIGNED, NULL);
+}
+
+// A read only NumPy view of an Eigen::MatrixXd. The view does not own its
+// data, so it must not outlive `m`.
+static PyObject* matrix_view(const Eigen::MatrixXd& m) {
+  npy_intp dims[2] = { m.rows(), m.cols() };
+  return PyArray_New(&PyArray_Type, 2, dims, NPY_DOUBLE, NULL,
+      (void*) m.data(), 0, NPY_ARRAY_F_CONTIGUOUS | NPY_ARRAY_ALIGNED, NULL);
+}
+
+// A tuple of views of the polytope and bounding box of a space, in the form
+// (A, b, lower, upper) taken by measure callbacks.
+static PyObject* space_view(const Space& s) {
+  return Py_BuildValue("NNNN", matrix_view(s.space.weights),
+      vector_view(s.space.biases), vector_view(s.bb_lower),
+      vector_view(s.bb_upper));
+}
+
 static PyObject* controller_to_pylist(const std::vector<Controller>& contr) {
   PyObject* ret = PyList_New(contr.size());
   for (Py_ssize_t i = 0; i < contr.size(); i++) {
-    PyObject* k = matrix_to_pylist(contr[i].k);
-    PyObject* a = matrix_to_pylist(contr[i].invariant.weights);
-    PyObject* b = vector_to_pylist(contr[i].invariant.biases);
-    PyObject* l = vector_to_pylist(contr[i].space.bb_lower);
-    PyObject* u = vector_to_pylist(contr[i].space.bb_upper);
-    PyObject* sa = matrix_to_pylist(contr[i].space.space.weights);
-    PyObject* sb = vector_to_pylist(contr[i].space.space.biases);
+    PyObject* k = matrix_to_pyarray(contr[i].k);
+    PyObject* a = matrix_to_pyarray(contr[i].invariant.weights);
+    PyObject* b = vector_to_pyarray(contr[i].invariant.biases);
+    PyObject* l = vector_to_pyarray(contr[i].space.bb_lower);
+    PyObject* u = vector_to_pyarray(contr[i].space.bb_upper);
+    PyObject* sa = matrix_to_pyarray(contr[i].space.space.weights);
+    PyObject* sb = vector_to_pyarray(contr[i].space.space.biases);
     PyObject* c = Py_BuildValue("N(NN)(NNNN)", k, a, b, sa, sb, l, u);
     PyList_SetItem(ret, i, c);
   }
   return ret;
 }
 
+/**
+ * Holds the GIL for as long as it is alive.
+ *
+ * Synthesis runs without the GIL so that split candidates can be evaluated
+ * on several threads. Anything which touches python objects during
+ * synthesis, such as the measure callbacks, must hold one of these.
+ */
+class GILLock {
+  private:
+    PyGILState_STATE state;
+
+  public:
+    GILLock(): state(PyGILState_Ensure()) {}
+    ~GILLock() {
+      PyGILState_Release(state);
+    }
+    GILLock(const GILLock&) = delete;
+    GILLock& operator=(const GILLock&) = delete;
+};
+
+/**
+ * The dataset of a measure callback, see measure_similarity.
+ *
+ * The reference to the dataset is released when this goes out of scope, so
+ * that it is not leaked when synthesis is interrupted by an exception.
+ */
+class Dataset {
+  public:
+    // A reference to the dataset, or NULL before the first callback.
+    PyObject* object;
+
+    Dataset(): object(NULL) {}
+    ~Dataset() {
+      if (object != NULL) {
+        GILLock lock;
+        Py_DECREF(object);
+      }
+    }
+    Dataset(const Dataset&) = delete;
+    Dataset& operator=(const Dataset&) = delete;
+};
+
+/**
+ * Measure the similarity of a controller to a network.
+ *
+ * The callback is given the controller, the cover, `dataset`, which it
+ * may use to keep data such as sampled states between calls, and a seed
+ * drawn from the generator of the calling thread. The callback must draw any
+ * random numbers it needs, such as the states it samples, from that seed
+ * rather than from a global generator, so that its results do not depend on
+ * how the threads of synthesize_shield() are scheduled. The dataset it
+ * returns replaces `dataset`, which holds a new reference to it. The
+ * controller and cover are read only NumPy views of `mat` and `cover`, so
+ * the callback must copy them to keep them after it returns.
+ *
+ * \param mat The controller.
+ * \param cover The space in which the controller is measured.
+ * \param measure A python callback for measuring similarity.
+ * \param dataset Data kept by the callback.
+ * \return The similarity of `mat`.
+ */
 double measure_similarity(const Eigen::MatrixXd& mat, const Space& cover,
-    PyObject* measure, PyObject* dataset) {
+    PyObject* measure, Dataset& dataset) {
   if (measure == NULL) {
     return -mat.norm();
   }
-  PyObject* K = matrix_to_pylist(mat);
-  PyObject* s = Py_BuildValue("NNNN", matrix_to_pylist(cover.space.weights),
-      vector_to_pylist(cover.space.biases), vector_to_pylist(cover.bb_lower),
-      vector_to_pylist(cover.bb_upper));
+  GILLock lock;
+  PyObject* K = matrix_view(mat);
+  PyObject* s = space_view(cover);
+  unsigned long seed = random_engine()();
   PyObject* args;
-  if (dataset == NULL) {
-    args = Py_BuildValue("NNO", K, s, Py_None);
+  if (dataset.object == NULL) {
+    args = Py_BuildValue("NNOk", K, s, Py_None, seed);
   } else {
-    args = Py_BuildValue("NNO", K, s, dataset);
+    args = Py_BuildValue("NNOk", K, s, dataset.object, seed);
   }
   PyObject* res = PyObject_CallObject(measure, args);
+  Py_DECREF(args);
   if (PyErr_Occurred()) {
     PyErr_PrintEx(0);
+    Py_XDECREF(res);
     throw std::runtime_error("Callback failed");
   }
   PyObject* score = PyTuple_GetItem(res, 1);
-  Py_XDECREF(dataset);
-  dataset = PyTuple_GetItem(res, 2);
+  Py_XDECREF(dataset.object);
+  dataset.object = PyTuple_GetItem(res, 2);
   // Dataset here is a borrowed reference but we need it to be separate.
-  Py_INCREF(dataset);
-  Py_DECREF(args);
+  Py_INCREF(dataset.object);
   double ret = PyFloat_AsDouble(score);
   Py_DECREF(res);
   return ret;
 }
 
-Eigen::MatrixXd get_gradient(const Eigen::MatrixXd& mat, const Space& cover,
-    PyObject* measure, PyObject* dataset) {
-  PyObject* K = matrix_to_pylist(mat);
-  PyObject* s = Py_BuildValue("NNNN", matrix_to_pylist(cover.space.weights),
-      vector_to_pylist(cover.space.biases), vector_to_pylist(cover.bb_lower),
-      vector_to_pylist(cover.bb_upper));
+/**
+ * Measure the similarity of two candidate controllers with one callback.
+ *
+ * The measure is given both controllers stacked in one array instead of a
+ * single one, so that it can simulate them together from the same initial
+ * states. It returns a sequence with the score of each controller.
+ *
+ * \param plus The first candidate.
+ * \param minus The second candidate.
+ * \param cover The space in which the candidates are measured.
+ * \param measure A python callback for measuring similarity.
+ * \param dataset Data kept by the callback, as in measure_similarity.
+ * \return The similarities of `plus` and `minus`.
+ */
+std::pair<double, double> measure_similarity_pair(const Eigen::MatrixXd& plus,
+    const Eigen::MatrixXd& minus, const Space& cover, PyObject* measure,
+    Dataset& dataset) {
+  if (measure == NULL) {
+    return std::make_pair(-plus.norm(), -minus.norm());
+  }
+  GILLock lock;
+  // The candidates are stacked into one array of shape (2, rows, cols).
+  npy_intp dims[3] = { 2, plus.rows(), plus.cols() };
+  PyObject* Ks = PyArray_SimpleNew(3, dims, NPY_DOUBLE);
+  double* data = (double*) PyArray_DATA((PyArrayObject*) Ks);
+  Eigen::Map<RowMatrixXd>(data, plus.rows(), plus.cols()) = plus;
+  Eigen::Map<RowMatrixXd>(data + plus.size(), plus.rows(), plus.cols()) =
+    minus;
+  PyObject* s = space_view(cover);
+  unsigned long seed = random_engine()();
   PyObject* args;
-  if (dataset == NULL) {
-    args = Py_BuildValue("NNO", K, s, Py_None);
+  if (dataset.object == NULL) {
+    args = Py_BuildValue("NNOk", Ks, s, Py_None, seed);
   } else {
-    args = Py_BuildValue("NNO", K, s, dataset);
+    args = Py_BuildValue("NNOk", Ks, s, dataset.object, seed);
   }
   PyObject* res = PyObject_CallObject(measure, args);
+  Py_DECREF(args);
   if (PyErr_Occurred()) {
     PyErr_PrintEx(0);
+    Py_XDECREF(res);
     throw std::runtime_error("Callback failed");
   }
-  Py_XDECREF(dataset);
-  dataset = PyTuple_GetItem(res, 2);
+  Py_XDECREF(dataset.object);
+  dataset.object = PyTuple_GetItem(res, 2);
   // Dataset here is a borrowed reference but we need it to be separate.
-  Py_INCREF(dataset);
+  Py_INCREF(dataset.object);
+  PyObject* scores = PyTuple_GetItem(res, 1);
+  PyObject* score_plus = PySequence_GetItem(scores, 0);
+  PyObject* score_minus = PySequence_GetItem(scores, 1);
+  double sim_plus = PyFloat_AsDouble(score_plus);
+  double sim_minus = PyFloat_AsDouble(score_minus);
+  Py_XDECREF(score_plus);
+  Py_XDECREF(score_minus);
+  Py_DECREF(res);
+  if (PyErr_Occurred()) {
+    PyErr_PrintEx(0);
+    throw std::runtime_error("Callback returned invalid scores");
+  }
+  return std::make_pair(sim_plus, sim_minus);
+}
+
+Eigen::MatrixXd get_gradient(const Eigen::MatrixXd& mat, const Space& cover,
+    PyObject* measure, Dataset& dataset) {
+  GILLock lock;
+  PyObject* K = matrix_view(mat);
+  PyObject* s = space_view(cover);
+  unsigned long seed = random_engine()();
+  PyObject* args;
+  if (dataset.object == NULL) {
+    args = Py_BuildValue("NNOk", K, s, Py_None, seed);
+  } else {
+    args = Py_BuildValue("NNOk", K, s, dataset.object, seed);
+  }
+  PyObject* res = PyObject_CallObject(measure, args);
   Py_DECREF(args);
+  if (PyErr_Occurred()) {
+    PyErr_PrintEx(0);
+    Py_XDECREF(res);
+    throw std::runtime_error("Callback failed");
+  }
+  Py_XDECREF(dataset.object);
+  dataset.object = PyTuple_GetItem(res, 2);
+  // Dataset here is a borrowed reference but we need it to be separate.
+  Py_INCREF(dataset.object);
   PyObject* grads = PyTuple_GetItem(res, 0);
-  Eigen::MatrixXd ret = pylist_to_matrix(grads);
+  Eigen::MatrixXd ret = pyarray_to_matrix(grads);
   Py_DECREF(res);
   return ret;
 }
@@ -1134,8 +1557,8 @@ Space lincons_to_space(const LinCons& lc) {
  */
 double measure_piece(const Controller& ctrl, PyObject* measure) {
   //Space s = lincons_to_space(ctrl.invariant);
-  double ret = measure_similarity(ctrl.k, ctrl.space, measure, NULL);
-  return ret;
+  Dataset dataset;
+  return measure_similarity(ctrl.k, ctrl.space, measure, dataset);
 }
 
 /**
@@ -1195,7 +1618,9 @@ std::optional<Controller> synthesize_linear_controller(
   double lr = 0.01;
   double v = 0.1;
   int steps_per_projection = 30;
-  PyObject* dataset = NULL;
+  // The dataset of the measure callback for this cover. It is kept across
+  // every gradient step so that the callback can reuse its samples.
+  Dataset dataset;
   for (int i = 0; i < 20; i++) {
     std::optional<Interval> safe = compute_safe_space(
         env, cover, other_covers, k, steps_per_projection * lr / 2, bound);
@@ -1213,11 +1638,13 @@ std::optional<Controller> synthesize_linear_controller(
     //double ave_grad_size = 0;
     // Gradient steps
     for (int j = 0; j < steps_per_projection; j++) {
-      Eigen::MatrixXd delta = Eigen::MatrixXd::Random(k.rows(), k.cols());
-      double sim_plus = measure_similarity(k + v * delta, cover, measure,
-          dataset);
-      double sim_minus = measure_similarity(k - v * delta, cover, measure,
-          dataset);
+      Eigen::MatrixXd delta = random_matrix(k.rows(), k.cols());
+      // Both candidates are measured in one callback so that they are
+      // simulated together.
+      auto sims = measure_similarity_pair(k + v * delta, k - v * delta, cover,
+          measure, dataset);
+      double sim_plus = sims.first;
+      double sim_minus = sims.second;
       Eigen::MatrixXd grad = (sim_plus - sim_minus) / v * delta;
       //Eigen::MatrixXd grad = -get_gradient(k, cover, measure, dataset);
       //ave_grad_size += grad.norm();
@@ -1228,7 +1655,6 @@ std::optional<Controller> synthesize_linear_controller(
     //std::cout << "Average gradient size in batch " << i << ": " << ave_grad_size << std::endl;
   }
   LinCons inv = env.compute_invariant(cover, bound, other_covers, k);
-  Py_XDECREF(dataset);
   return Controller {
     .k = k,
     .invariant = inv,
@@ -1312,22 +1738,75 @@ std::pair<Space, Space> split_cover(const Space& s, int d, double x) {
   return std::make_pair(lower, upper);
 }
 
+/**
+ * Call `f(i)` for every `i < n` on up to `threads` threads.
+ *
+ * The calling thread is one of the threads. If `f` throws, the first
+ * exception is rethrown here once every thread has finished.
+ *
+ * \param n The number of calls.
+ * \param threads The maximum number of threads.
+ * \param f The function to call.
+ */
+template <typename F>
+void parallel_for(size_t n, unsigned int threads, F f) {
+  std::atomic<size_t> next(0);
+  std::exception_ptr error;
+  std::mutex error_mutex;
+  auto work = [&]() {
+    for (size_t i = next++; i < n; i = next++) {
+      try {
+        f(i);
+      } catch (...) {
+        std::lock_guard<std::mutex> guard(error_mutex);
+        if (!error) {
+          error = std::current_exception();
+        }
+      }
+    }
+  };
+  std::vector<std::thread> pool;
+  for (size_t t = 1; t < std::min<size_t>(threads, n); t++) {
+    pool.emplace_back(work);
+  }
+  work();
+  for (std::thread& t : pool) {
+    t.join();
+  }
+  if (error) {
+    std::rethrow_exception(error);
+  }
+}
+
 /**
  * Find a set of controllers which are safe and cover the initial space.
  *
  * This function expects that the initial spaces has been partitioned already.
  * A controller is learned for each partition which is safe in that partition.
  *
+ * Candidate splits are evaluated on up to `threads` threads. This must be
+ * called without holding the GIL if `threads` is more than one, since the
+ * threads take the GIL to call `measure`. Each thread has its own random
+ * number generator and its own Apron managers, which are allocated for every
+ * abstract value (see abstract.cpp), so no abstract state is shared between
+ * threads. The generator is reseeded for every candidate and `measure` is
+ * given seeds drawn from it (see measure_similarity), so the result is the
+ * same for any number of threads.
+ *
  * \param env The environment under control.
  * \param covers A partitioning of the initial space.
  * \param bound The bound on the time horizon.
  * \param measure A callback for measuring similarity to a network.
+ * \param threads The number of threads to use, or 0 to use one per core.
  */
 std::vector<Controller> synthesize_shield(const Environment& env,
     std::vector<Space> covers, std::vector<Eigen::MatrixXd> inits,
-    int bound, PyObject* measure) {
+    int bound, PyObject* measure, unsigned int threads) {
   // covers and inits are passed by value becuase we need to copy it to make
   // modifications anyway.
+  if (threads == 0) {
+    threads = std::max(1u, std::thread::hardware_concurrency());
+  }
 
   auto init = synthesize_fixed_covers(env, covers, inits, bound, measure);
 
@@ -1350,15 +1829,12 @@ std::vector<Controller> synthesize_shield(const Environment& env,
     }
 
     // Split: try each dimension and split at a set of random points. Then
-    // choose whatever split gets the best score.
-    double best_score = -std::numeric_limits<double>::max();
-    std::vector<Controller> best_controller;
-    std::vector<Space> best_covers;
-    std::vector<Eigen::MatrixXd> best_inits;
-    std::vector<double> best_scores;
+    // choose whatever split gets the best score. The split points are drawn
+    // first and the candidate splits, which are independent, are then
+    // evaluated in parallel.
+    std::vector<std::pair<int, double>> candidates;
     //std::cout << to_split << ": " << covers[to_split].bb_lower.size() << std::endl;
     for (int d = 0; d < covers[to_split].bb_lower.size(); d++) {
-      std::cout << "Dimension: " << (d + 1) << " / " << covers[to_split].bb_lower.size() << std::endl;
       // Sample from a truncated uniform distribution. We'll center the
       // distribution at the middle of the bounding box and put two
       // standard deviations at the boundaries of the bounding box.
@@ -1374,39 +1850,71 @@ std::vector<Controller> synthesize_shield(const Environment& env,
       std::normal_distribution<double> distribution(mu, sig);
       // Try 5 random samples
       for (int j = 0; j < 5; j++) {
-        std::cout << "Sample: " << (j + 1) << " / 5" << std::endl;
         // We'll just throw out samples outside our range. About 95% of samples
         // will be within the range so this shouldn't be a performance issue.
         double x = distribution(generator);
         while (x < a || x > b) {
           x = distribution(generator);
         }
+        candidates.push_back(std::make_pair(d, x));
+      }
+    }
+    if (candidates.empty()) {
+      // Every dimension of the cover is flat so there is nothing to split.
+      break;
+    }
+    std::cout << "Evaluating " << candidates.size() << " split candidates on "
+      << std::min<size_t>(threads, candidates.size()) << " threads"
+      << std::endl;
+
+    // Each candidate reseeds the generator of its thread, so that the
+    // candidates do not depend on how they are scheduled.
+    unsigned int seed = random_engine()();
+    std::vector<std::vector<Space>> candidate_covers(candidates.size());
+    std::vector<std::vector<Eigen::MatrixXd>> candidate_inits(
+        candidates.size());
+    std::vector<std::vector<Controller>> candidate_controllers(
+        candidates.size());
+    std::vector<double> candidate_scores(candidates.size());
+    parallel_for(candidates.size(), threads, [&](size_t c) {
+      random_engine().seed(seed + c);
+      // Split covers
+      std::vector<Space> new_covers = covers;
+      std::vector<Eigen::MatrixXd> new_inits = inits;
+      const Space& s = covers[to_split];
+      auto split_space = split_cover(s, candidates[c].first,
+          candidates[c].second);
+      new_covers[to_split] = split_space.first;
+      new_covers.push_back(split_space.second);
+      new_inits.push_back(inits[to_split]);
+      auto new_controller = synthesize_fixed_covers(env, new_covers,
+          new_inits, bound, measure);
+      //std::cout << "New shield size: " << new_controller.size() << std::endl;
+      candidate_scores[c] = measure_shield(new_controller, measure);
+      candidate_covers[c] = std::move(new_covers);
+      candidate_inits[c] = std::move(new_inits);
+      candidate_controllers[c] = std::move(new_controller);
+    });
+    // The calling thread evaluated some of the candidates, so its generator
+    // is reseeded for the rest of the split to not depend on which.
+    random_engine().seed(seed + candidates.size());
 
-        // Split covers
-        std::vector<Space> new_covers = covers;
-        std::vector<Eigen::MatrixXd> new_inits = inits;
-        const Space& s = covers[to_split];
-        auto split_space = split_cover(s, d, x);
-        new_covers[to_split] = split_space.first;
-        new_covers.push_back(split_space.second);
-        new_inits.push_back(inits[to_split]);
-        auto new_controller = synthesize_fixed_covers(env, new_covers,
-            new_inits, bound, measure);
-        //std::cout << "New shield size: " << new_controller.size() << std::endl;
-        double score = measure_shield(new_controller, measure);
-        //std::cout << "score: " << score << " -- best score: " << best_score << std::endl;
-        if (score > best_score) {
-          //std::cout << "new best x: " << x << std::endl;
-          best_score = score;
-          best_covers = new_covers;
-          best_inits = new_inits;
-          best_controller = new_controller;
-          best_scores = scores;
-          best_scores[to_split] = measure_piece(best_controller[to_split], measure);
-          best_scores.push_back(measure_piece(best_controller.back(), measure));
-        }
+    double best_score = -std::numeric_limits<double>::max();
+    size_t best = 0;
+    for (size_t c = 0; c < candidates.size(); c++) {
+      //std::cout << "score: " << candidate_scores[c] << " -- best score: " << best_score << std::endl;
+      if (candidate_scores[c] > best_score) {
+        //std::cout << "new best x: " << candidates[c].second << std::endl;
+        best_score = candidate_scores[c];
+        best = c;
       }
     }
+    std::vector<Controller> best_controller = candidate_controllers[best];
+    std::vector<Space> best_covers = candidate_covers[best];
+    std::vector<Eigen::MatrixXd> best_inits = candidate_inits[best];
+    std::vector<double> best_scores = scores;
+    best_scores[to_split] = measure_piece(best_controller[to_split], measure);
+    best_scores.push_back(measure_piece(best_controller.back(), measure));
     init = best_controller;
     //std::cout << "Shield size (update " << i << "): " << init.size() << std::endl;
     inits = best_inits;
@@ -1461,10 +1969,16 @@ static PyObject* py_synthesize_shield(PyObject* self, PyObject* args) {
   PyObject* old_shield;
   int bound;
   PyObject* measure;
-  if (!PyArg_ParseTuple(args, "OOOiO", &env_tuple, &covers, &old_shield,
-        &bound, &measure)) {
+  unsigned int threads = 0;
+  unsigned long seed = 0;
+  if (!PyArg_ParseTuple(args, "OOOiO|Ik", &env_tuple, &covers, &old_shield,
+        &bound, &measure, &threads, &seed)) {
     return NULL;
   }
+  if (PyTuple_Size(args) > 6) {
+    // Synthesis runs on this thread, so this makes it deterministic.
+    random_engine().seed(seed);
+  }
   std::unique_ptr<Environment> env;
   if (PyTuple_Size(env_tuple) == 4) {
     PyObject* env_capsule;
@@ -1483,6 +1997,9 @@ static PyObject* py_synthesize_shield(PyObject* self, PyObject* args) {
         PyCapsule_GetPointer(env_capsule, "synthesis.env_capsule");
     bool continuous = (cont_obj == Py_True);
     std::vector<LinCons> uns = pylist_to_lincons(unsafe);
+    if (PyErr_Occurred()) {
+      return NULL;
+    }
     env = std::make_unique<NonlinearEnv>(update->concrete, update->update,
         continuous, dt, uns);
   } else if (PyTuple_Size(env_tuple) == 9) {
@@ -1502,6 +2019,9 @@ static PyObject* py_synthesize_shield(PyObject* self, PyObject* args) {
     }
     bool continuous = (cont_obj == Py_True);
     std::vector<LinCons> uns = pylist_to_lincons(unsafe);
+    if (PyErr_Occurred()) {
+      return NULL;
+    }
     std::vector<double> bs;
     for (Py_ssize_t i = 0; i < PyList_Size(breaks); i++) {
       bs.push_back(PyFloat_AsDouble(PyList_GetItem(breaks, i)));
@@ -1543,17 +2063,41 @@ static PyObject* py_synthesize_shield(PyObject* self, PyObject* args) {
       PyErr_SetString(PyExc_RuntimeError, "Malformed environment");
       return NULL;
     }
-    Eigen::MatrixXd a = pylist_to_matrix(a_list);
-    Eigen::MatrixXd b = pylist_to_matrix(b_list);
+    Eigen::MatrixXd a = pyarray_to_matrix(a_list);
+    Eigen::MatrixXd b = pyarray_to_matrix(b_list);
+    if (PyErr_Occurred()) {
+      return NULL;
+    }
     bool continuous = (cont_obj == Py_True);
     std::vector<LinCons> uns = pylist_to_lincons(unsafe);
+    if (PyErr_Occurred()) {
+      return NULL;
+    }
     env = std::make_unique<LinearEnv>(a, b, continuous, dt, uns);
   }
 
   std::vector<Eigen::MatrixXd> inits = pylist_to_matrix_list(old_shield);
-
-  auto controller = synthesize_shield(*env, pylist_to_space(covers),
-      inits, bound, measure);
+  if (PyErr_Occurred()) {
+    return NULL;
+  }
+  std::vector<Space> spaces = pylist_to_space(covers);
+
+  // Synthesis only needs the GIL to call measure, so other python threads
+  // and the threads evaluating split candidates can run in the meantime.
+  std::vector<Controller> controller;
+  std::string error;
+  Py_BEGIN_ALLOW_THREADS
+  try {
+    controller = synthesize_shield(*env, spaces, inits, bound, measure,
+        threads);
+  } catch (const std::exception& e) {
+    error = e.what();
+  }
+  Py_END_ALLOW_THREADS
+  if (!error.empty()) {
+    PyErr_SetString(PyExc_RuntimeError, error.c_str());
+    return NULL;
+  }
 
   //std::cout << "Shield size (before error): " << controller.size() << std::endl;
 
@@ -1604,6 +2148,9 @@ static PyObject* py_get_covers(PyObject* self, PyObject* args) {
         PyCapsule_GetPointer(env_capsule, "synthesis.env_capsule");
     bool continuous = (cont_obj == Py_True);
     std::vector<LinCons> uns = pylist_to_lincons(unsafe);
+    if (PyErr_Occurred()) {
+      return NULL;
+    }
     env = std::make_unique<NonlinearEnv>(update->concrete, update->update,
         continuous, dt, uns);
   } else if (PyTuple_Size(env_tuple) == 9) {
@@ -1623,6 +2170,9 @@ static PyObject* py_get_covers(PyObject* self, PyObject* args) {
     }
     bool continuous = (cont_obj == Py_True);
     std::vector<LinCons> uns = pylist_to_lincons(unsafe);
+    if (PyErr_Occurred()) {
+      return NULL;
+    }
     std::vector<double> bs;
     for (Py_ssize_t i = 0; i < PyList_Size(breaks); i++) {
       bs.push_back(PyFloat_AsDouble(PyList_GetItem(breaks, i)));
@@ -1668,10 +2218,16 @@ static PyObject* py_get_covers(PyObject* self, PyObject* args) {
       PyErr_SetString(PyExc_RuntimeError, "Malformed environment");
       return NULL;
     }
-    Eigen::MatrixXd a = pylist_to_matrix(a_list);
-    Eigen::MatrixXd b = pylist_to_matrix(b_list);
+    Eigen::MatrixXd a = pyarray_to_matrix(a_list);
+    Eigen::MatrixXd b = pyarray_to_matrix(b_list);
+    if (PyErr_Occurred()) {
+      return NULL;
+    }
     bool continuous = (cont_obj == Py_True);
     std::vector<LinCons> uns = pylist_to_lincons(unsafe);
+    if (PyErr_Occurred()) {
+      return NULL;
+    }
     env = std::make_unique<LinearEnv>(a, b, continuous, dt, uns);
   }
   if (PyErr_Occurred()) {
@@ -1681,13 +2237,31 @@ static PyObject* py_get_covers(PyObject* self, PyObject* args) {
   std::vector<Eigen::MatrixXd> inits = pylist_to_matrix_list(shield);
   if (PyErr_Occurred()) {
     PyErr_PrintEx(0);
-    throw std::runtime_error("get_covers after pylist_to_matrix");
+    throw std::runtime_error("get_covers after pylist_to_matrix_list");
   }
   std::vector<Space> covers = pylist_to_space(cover_list);
   if (PyErr_Occurred()) {
     PyErr_PrintEx(0);
     throw std::runtime_error("get_covers after pylist_to_space");
   }
+  // The covers are independent and need no python objects, so they are
+  // computed in parallel without the GIL.
+  std::vector<LinCons> lcs(inits.size());
+  std::string error;
+  Py_BEGIN_ALLOW_THREADS
+  try {
+    parallel_for(inits.size(),
+        std::max(1u, std::thread::hardware_concurrency()), [&](size_t i) {
+      lcs[i] = get_cover(*env, inits[i], covers[i], bound);
+    });
+  } catch (const std::exception& e) {
+    error = e.what();
+  }
+  Py_END_ALLOW_THREADS
+  if (!error.empty()) {
+    PyErr_SetString(PyExc_RuntimeError, error.c_str());
+    return NULL;
+  }
   PyObject* ret = PyList_New(inits.size());
   if (PyErr_Occurred()) {
     PyErr_PrintEx(0);
@@ -1698,9 +2272,9 @@ static PyObject* py_get_covers(PyObject* self, PyObject* args) {
       PyErr_PrintEx(0);
       throw std::runtime_error("get_covers before iteration " + std::to_string(i));
     }
-    LinCons lc = get_cover(*env, inits[i], covers[i], bound);
-    PyObject* t = Py_BuildValue("NN", matrix_to_pylist(lc.weights),
-        vector_to_pylist(lc.biases));
+    const LinCons& lc = lcs[i];
+    PyObject* t = Py_BuildValue("NN", matrix_to_pyarray(lc.weights),
+        vector_to_pyarray(lc.biases));
     PyList_SetItem(ret, i, t);
     if (PyErr_Occurred()) {
       PyErr_PrintEx(0);
@@ -1710,6 +2284,41 @@ static PyObject* py_get_covers(PyObject* self, PyObject* args) {
   return ret;
 }
 
+static PyObject* py_sample_polytope(PyObject* self, PyObject* args) {
+  PyObject* py_a;
+  PyObject* py_b;
+  PyObject* py_lower;
+  PyObject* py_upper;
+  int n;
+  unsigned long seed = 0;
+  if (!PyArg_ParseTuple(args, "OOOOi|k", &py_a, &py_b, &py_lower, &py_upper,
+        &n, &seed)) {
+    return NULL;
+  }
+  Space s = {
+    .space = LinCons(pyarray_to_matrix(py_a), pyarray_to_vector(py_b)),
+    .bb_lower = pyarray_to_vector(py_lower),
+    .bb_upper = pyarray_to_vector(py_upper)
+  };
+  if (PyErr_Occurred()) {
+    return NULL;
+  }
+  if (s.space.weights.rows() == 0) {
+    s.space.weights = Eigen::MatrixXd(0, s.bb_lower.size());
+  }
+  std::optional<Eigen::MatrixXd> samples;
+  if (PyTuple_Size(args) > 5) {
+    std::mt19937 generator(seed);
+    samples = sample_polytope(s, n, generator);
+  } else {
+    samples = sample_polytope(s, n, random_engine());
+  }
+  if (!samples) {
+    Py_RETURN_NONE;
+  }
+  return matrix_to_pyarray(samples.value());
+}
+
 void destroy_capsule(PyObject* capsule) {
   PythonCapsule* update = (PythonCapsule*)
       PyCapsule_GetPointer(capsule, "synthesis.env_capsule");
@@ -1797,11 +2406,14 @@ static PyObject* py_get_capsule(PyObject* self, PyObject* args) {
 
 static PyMethodDef SynthesisMethods[] = {
   {"synthesize_shield", py_synthesize_shield, METH_VARARGS,
-   "Synthesize a shield for a given environment."},
+   "Synthesize a shield for a given environment, evaluating split candidates "
+   "on the given number of threads (by default one per core)."},
   {"get_covers", py_get_covers, METH_VARARGS,
    "Get the regions in which a shield should be applied."},
   {"get_env_capsule", py_get_capsule, METH_VARARGS,
    "Get the abstract transformer for an environment by name."},
+  {"sample_polytope", py_sample_polytope, METH_VARARGS,
+   "Sample points from a polytope within a bounding box by hit-and-run."},
   {NULL, NULL, 0, NULL}
 };
 
@@ -1814,6 +2426,7 @@ static struct PyModuleDef synthesismodule = {
 };
 
 PyMODINIT_FUNC PyInit_synthesis(void) {
+  import_array();
   return PyModule_Create(&synthesismodule);
 }
 
@@ -1962,7 +2575,7 @@ int main() {
   std::vector<Eigen::MatrixXd> inits;
   inits.push_back(k);
 
-  auto res = synthesize_shield(env, covers, inits, 10, NULL);
+  auto res = synthesize_shield(env, covers, inits, 10, NULL, 0);
 
   for (const Controller& c : res) {
     std::cout << "Matrix:" << std::endl;
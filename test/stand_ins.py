@@ -0,0 +1,23 @@
+# external imports
+import numpy as np
+
+class LinearActor(object):
+    """A stand-in for the actor network with the policy u = tanh(K x).
+
+    It counts the states it is queried at, and set_weights() bumps its
+    weights_version as ActorNetwork.set_numpy_weights() does.
+    """
+
+    def __init__(self, K):
+        self.K = np.asarray(K, dtype=np.float64)
+        self.weights_version = 0
+        self.queries = 0
+
+    def predict(self, X):
+        X = np.asarray(X)
+        self.queries += len(X)
+        return np.tanh(X.dot(self.K.T))
+
+    def set_weights(self, K):
+        self.K = np.asarray(K, dtype=np.float64)
+        self.weights_version += 1
@@ -0,0 +1,138 @@
+# external imports
+import threading
+import unittest
+import numpy as np
+
+# internal inputs
+from actor_cache import ActorCache
+from test.stand_ins import LinearActor
+
+class TestActorCache(unittest.TestCase):
+
+    def test_error_bound(self):
+
+        # cached actions are within the documented bound of the actor's,
+        # and are those of the cell centers
+        np.random.seed(0)
+        K = np.array([[2.0, -1.0, 0.5], [0.3, 0.0, -3.0]])
+        actor = LinearActor(K)
+        resolution = 0.01
+        cache = ActorCache(actor, resolution=resolution)
+        X = np.random.uniform(-1.0, 1.0, (500, 3))
+        U = cache.predict(X)
+        self.assertEqual(U.shape, (500, 2))
+        # tanh is 1-Lipschitz, so the Lipschitz constant of the actor is at
+        # most the spectral norm of K
+        L = np.linalg.norm(K, 2)
+        error = np.linalg.norm(U - actor.predict(X), axis=1)
+        self.assertTrue((error <= L * resolution * np.sqrt(3) / 2).all())
+        centers = np.floor(X / resolution + 0.5) * resolution
+        np.testing.assert_array_almost_equal(U, actor.predict(centers))
+
+    def test_hits(self):
+
+        # states in the same cell are answered from the cache
+        actor = LinearActor([[1.0, 1.0]])
+        cache = ActorCache(actor, resolution=0.1)
+        X = np.array([[0.0, 0.0], [0.01, -0.02], [0.5, 0.5], [0.52, 0.49]])
+        U = cache.predict(X)
+        self.assertEqual(actor.queries, 2)
+        np.testing.assert_array_equal(U[0], U[1])
+        np.testing.assert_array_equal(U[2], U[3])
+        np.testing.assert_array_equal(cache.predict(X[1:2]), U[1:2])
+        self.assertEqual(actor.queries, 2)
+        # states of a batch which share a cell that was not cached are all
+        # misses, though the actor is queried once
+        metrics = cache.get_metrics()
+        self.assertEqual(metrics['hits'], 1)
+        self.assertEqual(metrics['misses'], 4)
+        self.assertEqual(metrics['entries'], 2)
+
+    def test_eviction(self):
+
+        # the least recently used cells are evicted first
+        actor = LinearActor([[1.0]])
+        cache = ActorCache(actor, resolution=1.0, max_entries=3)
+        cache.predict(np.array([[0.0], [1.0], [2.0]]))
+        # use 0 again, so that 1 is the least recently used
+        cache.predict(np.array([[0.0]]))
+        cache.predict(np.array([[3.0]]))
+        self.assertEqual(cache.get_metrics()['entries'], 3)
+        queries = actor.queries
+        cache.predict(np.array([[0.0], [2.0], [3.0]]))
+        self.assertEqual(actor.queries, queries)
+        cache.predict(np.array([[1.0]]))
+        self.assertEqual(actor.queries, queries + 1)
+
+        # a batch larger than the cache is still answered in full
+        U = cache.predict(np.arange(10.0).reshape(10, 1))
+        np.testing.assert_array_almost_equal(U,
+                np.tanh(np.arange(10.0)).reshape(10, 1))
+        self.assertEqual(cache.get_metrics()['entries'], 3)
+
+    def test_invalidation(self):
+
+        # the cache is cleared when the weights of the actor change
+        actor = LinearActor([[1.0]])
+        cache = ActorCache(actor, resolution=0.1)
+        X = np.array([[0.5]])
+        np.testing.assert_array_almost_equal(cache.predict(X), np.tanh(X))
+        actor.set_weights([[-2.0]])
+        np.testing.assert_array_almost_equal(cache.predict(X),
+                np.tanh(-2.0 * X))
+        self.assertEqual(actor.queries, 2)
+        self.assertEqual(cache.get_metrics()['entries'], 1)
+
+        # and when invalidated explicitly
+        cache.invalidate()
+        self.assertEqual(cache.get_metrics()['entries'], 0)
+        cache.predict(X)
+        self.assertEqual(actor.queries, 3)
+
+    def test_concurrent_misses(self):
+
+        # threads which miss at the same time query the actor concurrently,
+        # which would time out the barrier if the lock were held
+        class BarrierActor(LinearActor):
+            def predict(self, X):
+                barrier.wait(timeout=5.0)
+                return LinearActor.predict(self, X)
+
+        threads = 4
+        barrier = threading.Barrier(threads)
+        actor = BarrierActor([[1.0, -1.0]])
+        cache = ActorCache(actor, resolution=0.1)
+        X = np.random.RandomState(0).uniform(-1.0, 1.0, (threads, 8, 2))
+        U = [None] * threads
+        errors = []
+        def query(i):
+            try:
+                U[i] = cache.predict(X[i])
+            except threading.BrokenBarrierError as e:
+                errors.append(e)
+        workers = [threading.Thread(target=query, args=(i,))
+                for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        centers = np.floor(X / 0.1 + 0.5) * 0.1
+        for i in range(threads):
+            np.testing.assert_array_almost_equal(U[i],
+                    np.tanh(centers[i].dot(actor.K.T)))
+        metrics = cache.get_metrics()
+        self.assertEqual(metrics['hits'] + metrics['misses'], threads * 8)
+        self.assertEqual(metrics['entries'],
+                len(set(map(tuple, np.rint(centers.reshape(-1, 2) / 0.1)))))
+
+    def test_attributes(self):
+
+        # other attributes are those of the actor
+        actor = LinearActor([[1.0]])
+        cache = ActorCache(actor)
+        np.testing.assert_array_equal(cache.K, actor.K)
+        self.assertEqual(cache.weights_version, 0)
+
+if __name__ == '__main__':
+    unittest.main()
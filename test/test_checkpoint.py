@@ -0,0 +1,111 @@
+# external imports
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+# internal inputs
+from checkpoint import CheckpointWriter
+
+class Variable(object):
+    """A stand-in for a tf.Variable holding a numpy array."""
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = np.array(value, dtype=np.float64)
+
+    def load(self, value, sess):
+        self.value = np.array(value)
+
+class Session(object):
+    """A stand-in for a tf.Session which evaluates Variables."""
+
+    def run(self, var_list):
+        return [var.value.copy() for var in var_list]
+
+class TestCheckpointWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.save_path = os.path.join(self.directory, 'model.chkp')
+        self.sess = Session()
+        self.vars = [Variable('w:0', [1.0, 2.0]), Variable('b:0', 3.0)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def checkpoints(self):
+        return sorted(name for name in os.listdir(self.directory)
+                if name.endswith('.npz'))
+
+    def test_rotation(self):
+
+        # only the last keep checkpoints are kept, besides the best one
+        writer = CheckpointWriter(self.vars, keep=2)
+        for i in range(6):
+            self.vars[1].value = np.array(float(i))
+            writer.save(self.sess, self.save_path, metrics={'step': i},
+                    best=(i == 1))
+        writer.close()
+        self.assertEqual(self.checkpoints(), ['model.chkp-1.npz',
+            'model.chkp-4.npz', 'model.chkp-5.npz'])
+        with open(self.save_path + '.latest') as f:
+            self.assertEqual(json.load(f), {'path': 'model.chkp-5.npz',
+                'metrics': {'step': 5}})
+        with open(self.save_path + '.best') as f:
+            self.assertEqual(json.load(f), {'path': 'model.chkp-1.npz',
+                'metrics': {'step': 1}})
+
+    def test_new_best(self):
+
+        # an old best checkpoint is removed once it is replaced, unless it
+        # is still one of the last keep checkpoints
+        writer = CheckpointWriter(self.vars, keep=2)
+        for i in range(4):
+            writer.save(self.sess, self.save_path, best=(i == 0))
+        writer.save(self.sess, self.save_path, best=True)
+        writer.save(self.sess, self.save_path, best=True)
+        writer.close()
+        self.assertEqual(self.checkpoints(), ['model.chkp-4.npz',
+            'model.chkp-5.npz'])
+
+    def test_restore(self):
+
+        # restore loads the best checkpoint, or else the latest one
+        writer = CheckpointWriter(self.vars)
+        for (i, best) in enumerate((False, True, False)):
+            self.vars[1].value = np.array(float(i))
+            writer.save(self.sess, self.save_path, best=best)
+        writer.flush()
+        self.vars[0].value = np.zeros(2)
+        writer.restore(self.sess, self.save_path)
+        np.testing.assert_array_equal(self.vars[0].value, [1.0, 2.0])
+        self.assertEqual(self.vars[1].value, 1.0)
+        os.remove(self.save_path + '.best')
+        writer.restore(self.sess, self.save_path)
+        self.assertEqual(self.vars[1].value, 2.0)
+        writer.restore(self.sess, self.save_path + '-0.npz')
+        self.assertEqual(self.vars[1].value, 0.0)
+        writer.close()
+
+    def test_error(self):
+
+        # a failed write is raised by close, even if it was the last one
+        writer = CheckpointWriter(self.vars)
+        path = os.path.join(self.directory, 'file')
+        open(path, 'w').close()
+        writer.save(self.sess, os.path.join(path, 'model.chkp'))
+        self.assertRaises(RuntimeError, writer.close)
+
+        # and by flush and the next save
+        writer = CheckpointWriter(self.vars)
+        writer.save(self.sess, os.path.join(path, 'model.chkp'))
+        self.assertRaises(RuntimeError, writer.flush)
+        self.assertRaises(RuntimeError, writer.save, self.sess,
+                self.save_path)
+        self.assertRaises(RuntimeError, writer.close)
+
+if __name__ == '__main__':
+    unittest.main()
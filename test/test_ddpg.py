@@ -0,0 +1,97 @@
+# external imports
+import copy
+import unittest
+import numpy as np
+
+# internal inputs
+from replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+try:
+    import synthesis
+except ImportError:
+    synthesis = None
+if synthesis is not None:
+    import tensorflow as tf
+    from DDPG import ActorNetwork, CriticNetwork, DDPGUpdate, update_networks
+
+@unittest.skipIf(synthesis is None, 'the synthesis extension is not built')
+class TestDDPGUpdate(unittest.TestCase):
+
+    state_dim = 3
+    action_dim = 2
+    minibatch_size = 16
+
+    def setUp(self):
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.set_random_seed(0)
+            self.sess = tf.Session()
+            self.actor = ActorNetwork(self.sess, [16, 16], self.state_dim,
+                    self.action_dim, 2.0, 0.01, 0.1, self.minibatch_size)
+            self.critic = CriticNetwork(self.sess, [16, 16], self.state_dim,
+                    self.action_dim, 0.01, 0.1, 0.9,
+                    self.actor.get_num_trainable_vars())
+            self.update = DDPGUpdate(self.sess, self.actor, self.critic)
+            self.sess.run(tf.global_variables_initializer())
+            # every variable, including the state of the optimizers
+            self.variables = tf.global_variables()
+            self.initial = self.sess.run(self.variables)
+            self.initial_actor = self.sess.run(self.actor.network_params)
+
+    def tearDown(self):
+        self.sess.close()
+
+    def fill(self, replay_buffer):
+        random_state = np.random.RandomState(1)
+        n = 2 * self.minibatch_size
+        replay_buffer.add_batch(
+                random_state.randn(n, self.state_dim),
+                random_state.uniform(-2.0, 2.0, (n, self.action_dim)),
+                random_state.randn(n), random_state.rand(n) < 0.25,
+                random_state.randn(n, self.state_dim))
+        return replay_buffer
+
+    def step(self, replay_buffer, update):
+        """One update from the initial weights, returning the new weights."""
+        with self.graph.as_default():
+            for (var, value) in zip(self.variables, self.initial):
+                var.load(value, self.sess)
+            self.actor.numpy_actor = None
+            np.random.seed(2)
+            q = update_networks(self.actor, self.critic, replay_buffer,
+                    self.minibatch_size, update=update)
+            params = [self.actor.network_params, self.critic.network_params,
+                    self.actor.target_network_params,
+                    self.critic.target_network_params]
+            return q, [self.sess.run(p) for p in params]
+
+    def assert_same_step(self, replay_buffer):
+        q, weights = self.step(copy.deepcopy(replay_buffer), None)
+        fused_q, fused_weights = self.step(replay_buffer, self.update)
+        self.assertAlmostEqual(q, fused_q, places=5)
+        for (ws, fused_ws) in zip(weights, fused_weights):
+            self.assertEqual(len(ws), len(fused_ws))
+            for (w, fused_w) in zip(ws, fused_ws):
+                np.testing.assert_allclose(w, fused_w, rtol=1e-4, atol=1e-6)
+        # the weights changed at all
+        for (w, initial) in zip(weights[0], self.initial_actor):
+            self.assertFalse(np.array_equal(w, initial))
+
+    def test_update(self):
+
+        # the fused op gives the weights of the separate session calls
+        self.assert_same_step(self.fill(ReplayBuffer(64)))
+
+    def test_prioritized_update(self):
+
+        # and so do the importance sampling weights and the new priorities
+        replay_buffer = self.fill(PrioritizedReplayBuffer(64))
+        replay_buffer.update_priorities(np.arange(2 * self.minibatch_size),
+                np.linspace(0.1, 3.0, 2 * self.minibatch_size))
+        unfused = copy.deepcopy(replay_buffer)
+        self.step(unfused, None)
+        self.assert_same_step(replay_buffer)
+        np.testing.assert_allclose(unfused.tree.tree, replay_buffer.tree.tree,
+                rtol=1e-4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# external imports
+import unittest
+import numpy as np
+
+# internal inputs
+from Environment import Environment, FastEnvironment
+
+class TestFastEnvironment(unittest.TestCase):
+
+    def environment(self):
+        # A double integrator which is unsafe for x[0] >= 2
+        A = np.matrix([[0.0, 1.0], [0.0, 0.0]])
+        B = np.matrix([[0.0], [1.0]])
+        s_min = np.array([[-1.0], [-1.0]])
+        s_max = np.array([[1.0], [1.0]])
+        x_min = np.array([[-5.0], [-5.0]])
+        x_max = np.array([[5.0], [5.0]])
+        u_min = np.array([[-10.0]])
+        u_max = np.array([[10.0]])
+        Q = np.matrix(np.eye(2))
+        R = np.matrix([[0.1]])
+        return Environment(A, B, u_min, u_max, s_min, s_max, x_min, x_max,
+                Q, R, continuous=True, timestep=0.1, terminal_err=0.01,
+                unsafe_A=[np.matrix([[-1.0, 0.0]])],
+                unsafe_b=[np.matrix([[-2.0]])])
+
+    def test_assign_xk(self):
+
+        # an assigned state is the one which is observed and stepped from,
+        # as with Environment
+        env = self.environment()
+        fast = FastEnvironment(self.environment())
+        u = np.array([[0.5]])
+        for x in ([[3.0], [0.0]], [[0.0], [0.5]], [[6.0], [1.0]]):
+            env.reset(np.matrix([[0.0], [0.0]]))
+            fast.reset(np.array([[0.0], [0.0]]))
+            env.step(u)
+            fast.step(u)
+            env.xk = np.matrix(x)
+            fast.xk = np.matrix(x)
+            np.testing.assert_array_equal(fast.xk, np.array(x))
+            self.assertEqual(fast.is_unsafe(), x[0][0] >= 2.0)
+            for safe in (True, False):
+                (x1, r1, t1) = env.observation(safe=safe)
+                (x2, r2, t2) = fast.observation(safe=safe)
+                np.testing.assert_array_almost_equal(x2, x1)
+                self.assertAlmostEqual(r2, r1)
+                self.assertEqual(t2, t1)
+            (x1, r1, t1) = env.step(u, safe=False)
+            (x2, r2, t2) = fast.step(u, safe=False)
+            np.testing.assert_array_almost_equal(x2, x1)
+            self.assertAlmostEqual(r2, r1)
+            self.assertEqual(t2, t1)
+
+if __name__ == '__main__':
+    unittest.main()
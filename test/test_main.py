@@ -0,0 +1,56 @@
+# external imports
+import unittest
+import numpy as np
+
+# internal inputs
+try:
+    import main
+except ImportError:
+    main = None
+
+@unittest.skipIf(main is None, 'the dependencies of main are not installed')
+class TestSimulateLinearPolicies(unittest.TestCase):
+
+    def penalties(self, X, x_min, x_max, unsafe_flag):
+        """The state penalties of one step from each row of X."""
+        # Each policy stays where it starts and is rewarded nothing else
+        Ks = np.zeros((1, 1, X.shape[1]))
+        rewards = []
+        for x in X:
+            rewards.append(main.simulate_linear_policies(None, Ks, x, 1,
+                None, None, 0.0, x_min=x_min, x_max=x_max,
+                unsafe_flag=unsafe_flag, batch_f=lambda X, U: X,
+                batch_rewardf=lambda X, Q, U, R: np.zeros(len(X)))[0])
+        return -np.array(rewards)
+
+    def test_unsafe_bounds(self):
+
+        # the penalty of every state matches the per-state check, with one
+        # and several columns of bounds
+        np.random.seed(0)
+        X = np.random.uniform(-2.0, 2.0, (200, 3))
+        for k in (1, 3):
+            x_min = np.random.uniform(-1.5, 0.0, (3, k))
+            x_max = x_min + np.random.uniform(0.5, 2.0, (3, k))
+            expected = np.array([100.0 * ((np.array(np.matrix(x).T) < x_max) *
+                (np.array(np.matrix(x).T) > x_min)).all(axis=1).any()
+                for x in X])
+            self.assertTrue(0 < np.count_nonzero(expected) < len(X))
+            np.testing.assert_array_equal(
+                    self.penalties(X, x_min, x_max, True), expected)
+
+    def test_bounds(self):
+
+        # without unsafe_flag each dimension outside the first column of
+        # the bounds is penalized
+        np.random.seed(1)
+        X = np.random.uniform(-2.0, 2.0, (50, 2))
+        x_min = np.array([[-1.0, -5.0], [-0.5, -5.0]])
+        x_max = np.array([[1.0, 5.0], [0.5, 5.0]])
+        expected = 100.0 * ((X < x_min[:, 0]).sum(axis=1) +
+                (X > x_max[:, 0]).sum(axis=1))
+        np.testing.assert_array_equal(
+                self.penalties(X, x_min, x_max, False), expected)
+
+if __name__ == '__main__':
+    unittest.main()
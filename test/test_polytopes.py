@@ -0,0 +1,147 @@
+# external imports
+import unittest
+import numpy as np
+import scipy
+
+# internal inputs
+from polytopes import PolytopeUnion, BoxTree, bounding_box, linprog_method
+
+def brute_force_find(polytopes, x):
+    """The index of the first polytope containing x, or -1."""
+    for (j, (A, b)) in enumerate(polytopes):
+        if (np.dot(A, x) <= np.ravel(b)).all():
+            return j
+    return -1
+
+def box(lower, upper):
+    """The polytope of the axis-aligned box between lower and upper."""
+    dim = len(lower)
+    A = np.vstack((np.eye(dim), -np.eye(dim)))
+    b = np.concatenate((upper, -np.asarray(lower)))
+    return (A, b)
+
+class TestPolytopeUnion(unittest.TestCase):
+
+    def polytopes(self):
+        np.random.seed(0)
+        polytopes = []
+        for _ in range(20):
+            lower = np.random.uniform(-5.0, 4.0, 2)
+            upper = lower + np.random.uniform(0.5, 2.0, 2)
+            polytopes.append(box(lower, upper))
+        # a triangle
+        polytopes.append((np.array([[-1.0, 0.0], [0.0, -1.0], [1.0, 1.0]]),
+            np.array([0.0, 0.0, 1.0])))
+        # an empty polytope
+        polytopes.append((np.array([[1.0, 0.0], [-1.0, 0.0]]),
+            np.array([-1.0, 0.0])))
+        # a half plane, whose bounding box is unbounded
+        polytopes.append((np.array([[1.0, 1.0]]), np.array([-8.0])))
+        # the whole plane
+        polytopes.append((np.zeros((0, 2)), np.zeros(0)))
+        return polytopes
+
+    def points(self, polytopes):
+        np.random.seed(1)
+        X = [np.random.uniform(-10.0, 10.0, (200, 2))]
+        # corners of the boxes and the triangle, which are on the boundary
+        for (A, b) in polytopes[:20]:
+            X.append([[-b[2], -b[3]], [b[0], b[1]], [-b[2], b[1]]])
+        X.append([[0.0, 0.0], [1.0, 0.0], [0.5, 0.5], [-4.0, -4.0]])
+        return np.vstack(X)
+
+    def test_find(self):
+
+        # find and find_one agree with a loop over the polytopes, with and
+        # without the whole plane at the end
+        polytopes = self.polytopes()
+        X = self.points(polytopes)
+        for ps in (polytopes, polytopes[:-1]):
+            expected = np.array([brute_force_find(ps, x) for x in X])
+            union = PolytopeUnion(ps)
+            indexed = PolytopeUnion(ps, index=True)
+            np.testing.assert_array_equal(union.find(X), expected)
+            np.testing.assert_array_equal(union.any(X), expected >= 0)
+            for (x, j) in zip(X, expected):
+                self.assertEqual(union.find_one(x), j)
+                self.assertEqual(indexed.find_one(x), j)
+            # the points reach the triangle and the half plane, and only
+            # miss every polytope without the whole plane
+            self.assertTrue({20, 22} <= set(expected))
+            self.assertEqual(-1 in expected, len(ps) < len(polytopes))
+
+    def test_empty_union(self):
+
+        # no polytope contains anything
+        union = PolytopeUnion([], dim=2, index=True)
+        X = np.zeros((3, 2))
+        self.assertEqual(union.contains(X).shape, (3, 0))
+        np.testing.assert_array_equal(union.find(X), [-1, -1, -1])
+        self.assertEqual(union.find_one(X[0]), -1)
+
+    def check_bounding_box(self, method):
+
+        # a box is its own bounding box, up to the tolerance
+        lower, upper = bounding_box(*box([-1.0, 2.0], [3.0, 4.0]),
+                method=method)
+        np.testing.assert_array_almost_equal(lower, [-1.0, 2.0], decimal=5)
+        np.testing.assert_array_almost_equal(upper, [3.0, 4.0], decimal=5)
+        self.assertTrue((lower <= [-1.0, 2.0]).all())
+        self.assertTrue((upper >= [3.0, 4.0]).all())
+
+        # unbounded directions have infinite bounds
+        lower, upper = bounding_box(np.array([[1.0, 0.0]]), np.array([2.0]),
+                method=method)
+        np.testing.assert_array_equal(lower, [-np.inf, -np.inf])
+        self.assertAlmostEqual(upper[0], 2.0, places=5)
+        self.assertEqual(upper[1], np.inf)
+
+        # an empty polytope has an empty box
+        lower, upper = bounding_box(np.array([[1.0], [-1.0]]),
+                np.array([-1.0, 0.0]), method=method)
+        self.assertTrue((lower > upper).all())
+
+    def test_bounding_box(self):
+        self.check_bounding_box(None)
+
+    @unittest.skipIf(tuple(int(v) for v in scipy.__version__.split('.')[:2])
+            >= (1, 11), 'the installed SciPy no longer has the pinned solver')
+    def test_bounding_box_pinned_scipy(self):
+        # the method used with the SciPy pinned in requirements.txt
+        self.check_bounding_box(linprog_method('1.4.1'))
+
+    def test_linprog_method(self):
+        self.assertEqual(linprog_method('1.4.1'), 'revised simplex')
+        self.assertEqual(linprog_method('1.5.0'), 'highs')
+        self.assertEqual(linprog_method('1.17.1'), 'highs')
+        self.assertEqual(linprog_method('2.0.0rc1'), 'highs')
+        self.assertEqual(linprog_method(), linprog_method(scipy.__version__))
+
+class TestBoxTree(unittest.TestCase):
+
+    def test_query(self):
+
+        # query agrees with a linear scan over the boxes
+        np.random.seed(2)
+        lower = np.random.uniform(-5.0, 5.0, (100, 3))
+        upper = lower + np.random.uniform(0.0, 3.0, (100, 3))
+        # unbounded boxes
+        lower[:5, 0] = -np.inf
+        upper[5:10, 1] = np.inf
+        # empty boxes
+        upper[10:15] = lower[10:15] - 1.0
+        tree = BoxTree(lower, upper, leaf_size=4)
+        X = np.vstack((np.random.uniform(-6.0, 6.0, (300, 3)),
+            lower[15:30], upper[15:30]))
+        for x in X:
+            expected = np.flatnonzero(((lower <= x) & (x <= upper)).all(axis=1))
+            np.testing.assert_array_equal(tree.query(x), expected)
+
+    def test_empty(self):
+
+        # a tree without boxes finds nothing
+        tree = BoxTree(np.zeros((0, 2)), np.zeros((0, 2)))
+        self.assertEqual(tree.query(np.zeros(2)), [])
+
+if __name__ == '__main__':
+    unittest.main()
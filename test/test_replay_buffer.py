@@ -0,0 +1,170 @@
+# external imports
+import unittest
+import numpy as np
+
+# internal inputs
+from replay_buffer import ReplayBuffer, SumTree, PrioritizedReplayBuffer
+
+class TestReplayBuffer(unittest.TestCase):
+
+    def test_add(self):
+
+        # add and add_batch write the same columns
+        buf = ReplayBuffer(10, dtype=np.float64)
+        other = ReplayBuffer(10, dtype=np.float64)
+        S = np.arange(12.0).reshape(4, 3)
+        A = np.arange(4.0).reshape(4, 1)
+        R = np.arange(4.0) * 10
+        T = np.array([False, True, False, False])
+        for i in range(4):
+            buf.add(np.matrix(S[i]).T, A[i], R[i], T[i], S[i] + 1)
+        idx = other.add_batch(S, A, R, T, S + 1)
+        np.testing.assert_array_equal(idx, np.arange(4))
+        self.assertEqual(buf.size(), 4)
+        self.assertEqual(other.size(), 4)
+        for (x, y) in zip((buf.s, buf.a, buf.r, buf.t, buf.s2),
+                (other.s, other.a, other.r, other.t, other.s2)):
+            np.testing.assert_array_equal(x[:4], y[:4])
+        np.testing.assert_array_equal(buf.s[:4], S)
+        np.testing.assert_array_equal(buf.t[:4], T)
+
+    def test_wrap_around(self):
+
+        # the oldest transitions are overwritten once the buffer is full
+        buf = ReplayBuffer(5, dtype=np.float64)
+        buf.add_batch(np.zeros((3, 2)), np.zeros((3, 1)), np.arange(3.0),
+                np.zeros(3, dtype=bool), np.zeros((3, 2)))
+        idx = buf.add_batch(np.zeros((4, 2)), np.zeros((4, 1)),
+                np.arange(3.0, 7.0), np.zeros(4, dtype=bool),
+                np.zeros((4, 2)))
+        np.testing.assert_array_equal(idx, [3, 4, 0, 1])
+        np.testing.assert_array_equal(buf.r, [5.0, 6.0, 2.0, 3.0, 4.0])
+        self.assertEqual(buf.size(), 5)
+        self.assertEqual(buf.position, 2)
+
+    def test_sample_batch(self):
+
+        # a minibatch holds whole transitions from the filled slots
+        np.random.seed(0)
+        buf = ReplayBuffer(8)
+        n = 6
+        S = np.arange(2.0 * n).reshape(n, 2)
+        buf.add_batch(S, S[:, :1], np.arange(n), np.arange(n) % 2 == 0,
+                S + 1)
+        s, a, r, t, s2 = buf.sample_batch(4)
+        self.assertEqual(s.shape, (4, 2))
+        self.assertEqual(s.dtype, np.float32)
+        i = r.astype(int)
+        self.assertTrue((i < n).all())
+        np.testing.assert_array_equal(s, S[i])
+        np.testing.assert_array_equal(a, S[i, :1])
+        np.testing.assert_array_equal(t, i % 2 == 0)
+        np.testing.assert_array_equal(s2, S[i] + 1)
+
+        # a batch larger than the buffer holds every transition once
+        s, a, r, t, s2 = buf.sample_batch(10)
+        np.testing.assert_array_equal(np.sort(r), np.arange(n))
+
+        # clear empties the buffer
+        buf.clear()
+        self.assertEqual(buf.size(), 0)
+        self.assertEqual(len(buf.sample_batch(4)[0]), 0)
+
+    def test_sample_without_replacement(self):
+
+        # a minibatch never holds a slot twice, and every slot is drawn
+        # equally often, both when the buffer is barely larger than the
+        # minibatch and when it is much larger
+        np.random.seed(0)
+        for n in (10, 50):
+            buf = ReplayBuffer(n)
+            buf.add_batch(np.zeros((n, 1)), np.zeros((n, 1)), np.arange(n),
+                    np.zeros(n, dtype=bool), np.zeros((n, 1)))
+            counts = np.zeros(n)
+            for _ in range(2000):
+                idx = buf.sample_indices(8)
+                self.assertEqual(len(np.unique(idx)), 8)
+                counts[idx] += 1
+            np.testing.assert_allclose(counts / 2000, 8.0 / n, atol=0.05)
+
+class TestSumTree(unittest.TestCase):
+
+    def test_find(self):
+
+        # find agrees with a search of the prefix sums of the leaves
+        np.random.seed(0)
+        tree = SumTree(6)
+        priorities = np.random.rand(6)
+        tree.update(np.arange(6), priorities)
+        self.assertAlmostEqual(tree.total(), priorities.sum())
+        values = np.random.rand(100) * priorities.sum()
+        np.testing.assert_array_equal(tree.find(values),
+                np.searchsorted(np.cumsum(priorities), values, side='right'))
+
+        # set and update give the same tree
+        other = SumTree(6)
+        for (i, p) in enumerate(priorities):
+            other.set(i, p)
+        np.testing.assert_array_almost_equal(tree.tree, other.tree)
+
+class TestPrioritizedReplayBuffer(unittest.TestCase):
+
+    def fill(self, buffer_size, n):
+        buf = PrioritizedReplayBuffer(buffer_size)
+        idx = buf.add_batch(np.arange(2 * n).reshape(n, 2), np.zeros((n, 1)),
+                np.arange(n), np.zeros(n, dtype=bool),
+                np.arange(2 * n).reshape(n, 2))
+        return buf, idx
+
+    def test_sampling_frequencies(self):
+
+        # transitions are sampled in proportion to p ** alpha
+        np.random.seed(0)
+        buf, idx = self.fill(6, 6)
+        td_errors = np.array([0.1, 0.5, 1.0, 2.0, 0.0, 4.0])
+        buf.update_priorities(idx, td_errors)
+        counts = np.zeros(6)
+        for _ in range(2000):
+            counts += np.bincount(buf.sample_indices(4), minlength=6)
+        expected = np.power(td_errors + buf.epsilon, buf.alpha)
+        expected /= expected.sum()
+        np.testing.assert_allclose(counts / counts.sum(), expected, atol=0.01)
+
+    def test_weights(self):
+
+        # importance sampling weights are normalized to a maximum of 1
+        np.random.seed(0)
+        buf, idx = self.fill(8, 8)
+        buf.update_priorities(idx, np.arange(1.0, 9.0))
+        for _ in range(10):
+            s, a, r, t, s2, weights, sampled = buf.sample_batch(4)
+            self.assertEqual(weights.shape, (4, 1))
+            self.assertAlmostEqual(weights.max(), 1.0)
+            probs = buf.tree.get(sampled) / buf.tree.total()
+            expected = np.power(8 * probs, -buf.beta)
+            np.testing.assert_array_almost_equal(weights.ravel(),
+                    expected / expected.max())
+            np.testing.assert_array_equal(r, sampled)
+
+    def test_wrap_around(self):
+
+        # updates after the buffer wraps around land on the slots the
+        # transitions were written to
+        buf, _ = self.fill(5, 3)
+        idx = buf.add_batch(np.zeros((4, 2)), np.zeros((4, 1)),
+                np.arange(10, 14), np.zeros(4, dtype=bool), np.zeros((4, 2)))
+        np.testing.assert_array_equal(idx, [3, 4, 0, 1])
+        np.testing.assert_array_equal(buf.r[idx], np.arange(10, 14))
+        buf.update_priorities(idx, np.array([1.0, 2.0, 3.0, 4.0]))
+        expected = np.power(np.array([3.0, 4.0, 1.0, 1.0, 2.0]) +
+                buf.epsilon, buf.alpha)
+        # slot 2 still has the initial priority
+        expected[2] = 1.0
+        np.testing.assert_array_almost_equal(buf.tree.get(np.arange(5)),
+                expected)
+        np.testing.assert_array_almost_equal(buf.tree.get(np.arange(5, 8)),
+                np.zeros(3))
+        self.assertAlmostEqual(buf.tree.total(), expected.sum())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# external imports
+import unittest
+import numpy as np
+
+# internal inputs
+from Environment import Environment
+from rollout import rollout, LinearController
+
+class TestRollout(unittest.TestCase):
+
+    def environment(self):
+        # A double integrator which is unsafe for x[0] >= 2
+        A = np.matrix([[0.0, 1.0], [0.0, 0.0]])
+        B = np.matrix([[0.0], [1.0]])
+        s_min = np.array([[-3.0], [-3.0]])
+        s_max = np.array([[3.0], [3.0]])
+        x_min = np.array([[-5.0], [-5.0]])
+        x_max = np.array([[5.0], [5.0]])
+        u_min = np.array([[-10.0]])
+        u_max = np.array([[10.0]])
+        Q = np.matrix(np.eye(2))
+        R = np.matrix([[0.1]])
+        return Environment(A, B, u_min, u_max, s_min, s_max, x_min, x_max,
+                Q, R, continuous=True, timestep=0.1, terminal_err=0.5,
+                unsafe_A=[np.matrix([[-1.0, 0.0]])],
+                unsafe_b=[np.matrix([[-2.0]])])
+
+    def scalar_rollout(self, env, K, bias, x0, steps, safe):
+        """Simulate one trajectory with Environment.step()."""
+        states = np.zeros((steps + 1, env.state_dim))
+        actions = np.zeros((steps, env.action_dim))
+        rewards = np.zeros(steps)
+        terminals = np.zeros(steps, dtype=bool)
+        first_violation = -1
+        x = env.reset(np.matrix(x0).T)
+        states[0] = x0
+        for t in range(steps):
+            if bias:
+                u = K[:, :-1].dot(np.asarray(x)) + K[:, -1:]
+            else:
+                u = K.dot(np.asarray(x))
+            x, r, terminal = env.step(u, safe=safe)
+            states[t+1:] = np.ravel(x)
+            actions[t] = np.ravel(u)
+            rewards[t] = r
+            terminals[t] = terminal
+            if first_violation < 0 and (r == env.bad_reward or
+                    env.unsafe_set.any(np.asarray(x).T)[0]):
+                first_violation = t
+            if terminal:
+                break
+        return states, actions, rewards, terminals, first_violation
+
+    def test_linear_controller(self):
+
+        # rollout agrees with the scalar simulation loop
+        env = self.environment()
+        steps = 40
+        np.random.seed(0)
+        X0 = np.random.uniform(-3.0, 3.0, (20, 2))
+        controllers = [
+            (np.array([[-1.0, -1.5]]), False),
+            (np.array([[0.5, -0.2]]), False),
+            (np.array([[-1.0, -1.5, 0.8]]), True),
+        ]
+        outcomes = set()
+        for (K, bias) in controllers:
+            for safe in (True, False):
+                states, actions, rewards, terminals, first_violation = \
+                        rollout(env, LinearController(K, bias=bias), X0,
+                                steps, safe=safe)
+                for (i, x0) in enumerate(X0):
+                    expected = self.scalar_rollout(env, K, bias, x0, steps,
+                            safe)
+                    np.testing.assert_array_almost_equal(states[i],
+                            expected[0])
+                    np.testing.assert_array_almost_equal(actions[i],
+                            expected[1])
+                    np.testing.assert_array_almost_equal(rewards[i],
+                            expected[2])
+                    np.testing.assert_array_equal(terminals[i], expected[3])
+                    self.assertEqual(first_violation[i], expected[4])
+                    outcomes.add((terminals[i].any(), expected[4] >= 0))
+        # the trajectories cover every combination of terminating and
+        # violating safety
+        self.assertEqual(len(outcomes), 4)
+
+if __name__ == '__main__':
+    unittest.main()
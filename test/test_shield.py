@@ -0,0 +1,76 @@
+# external imports
+import unittest
+import numpy as np
+
+# internal inputs
+from test.stand_ins import LinearActor
+try:
+    import synthesis
+except ImportError:
+    synthesis = None
+if synthesis is not None:
+    from Environment import Environment
+    from shield import Shield
+
+@unittest.skipIf(synthesis is None, 'the synthesis extension is not built')
+class TestShield(unittest.TestCase):
+
+    def road(self):
+        # The road benchmark: position, velocity and a constant
+        A = np.matrix([[0, 10, 0], [0, 0, 0], [0, 0, 0]])
+        B = np.matrix([[0], [10], [0]])
+        s_min = np.array([[0], [0], [1]])
+        s_max = np.array([[0], [0], [1]])
+        x_min = np.array([[-100.0], [-10.0], [0.0]])
+        x_max = np.array([[100.0], [10.0], [2.0]])
+        u_min = np.array([[-2.0]])
+        u_max = np.array([[5.0]])
+        env = Environment(A, B, u_min, u_max, s_min, s_max, x_min, x_max,
+                None, None, continuous=True)
+        Ks = [np.matrix([[0.0, 0.0, 0.0]])]
+        invs = [(np.matrix([[0.0, 1.0, 0.0]]), np.matrix([[10.0]]))]
+        covers = [(invs[0][0], invs[0][1], np.matrix([[-1.0, -1.0, 1.0]]),
+                np.matrix([[3.0, 5.0, 1.0]]))]
+        return env, Shield(env, K_list=Ks, inv_list=invs, cover_list=covers,
+                bound=30)
+
+    def train(self, threads):
+        env, old_shield = self.road()
+        shield = Shield(env)
+        np.random.seed(0)
+        shield.train_shield(old_shield, LinearActor([[-0.5, -1.0, 1.0]]),
+                bound=30, threads=threads)
+        return shield
+
+    def test_synthesis_env(self):
+
+        # without unsafe polytopes the environment is unsafe outside of
+        # [x_min, x_max], one flat halfspace per bound
+        env, shield = self.road()
+        unsafe = shield.synthesis_env()[4]
+        self.assertEqual(len(unsafe), 6)
+        x = np.array([0.0, 11.0, 1.0])
+        for (A, b) in unsafe:
+            self.assertEqual(np.shape(A), (1, 3))
+            self.assertEqual(np.shape(b), (1,))
+        self.assertEqual([bool(A.dot(x) <= b) for (A, b) in unsafe],
+                [False, False, False, True, False, False])
+
+    def test_threads(self):
+
+        # the result of synthesis does not depend on the number of threads
+        # evaluating the split candidates
+        serial = self.train(1)
+        parallel = self.train(4)
+        self.assertEqual(len(serial.K_list), len(parallel.K_list))
+        for (k1, k2) in zip(serial.K_list, parallel.K_list):
+            np.testing.assert_array_equal(k1, k2)
+        for ((A1, b1), (A2, b2)) in zip(serial.inv_list, parallel.inv_list):
+            np.testing.assert_array_equal(A1, A2)
+            np.testing.assert_array_equal(b1, b2)
+        for (c1, c2) in zip(serial.cover_list, parallel.cover_list):
+            for (x1, x2) in zip(c1, c2):
+                np.testing.assert_array_equal(x1, x2)
+
+if __name__ == '__main__':
+    unittest.main()